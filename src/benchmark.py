@@ -0,0 +1,151 @@
+import argparse
+import cv2
+from dataclasses import replace
+import datetime
+import json
+import math
+import numpy
+import platform
+import subprocess
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from wpimath.geometry import Pose3d
+
+from config.ConnectionConfig import ConnectionConfigLoader
+from pipeline.ApriltagDetector import ApriltagDetection, ApriltagDetector
+from pipeline.LatencyMetrics import LatencyMetrics
+from pipeline.NTOutput import NTOutput
+from pipeline.PoseEstimator import PoseEstimator
+from pipeline.Profiler import Profiler
+from pipeline.StreamOutput import StreamOutput
+from synthetic.SceneGenerator import SceneGenerator
+from synthetic.WallScene import make_scene
+
+def time_calls(function: Callable[[], Any], iterations: int) -> Dict[str, Any]:
+    function()
+    times: List[float] = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        function()
+        times.append((time.perf_counter() - start) * 1000.0)
+    return { "iterations": iterations, "median_ms": float(numpy.median(times)), "p95_ms": float(numpy.percentile(times, 95)), "min_ms": min(times) }
+
+def corner_error(detections: List[ApriltagDetection], truth: List[ApriltagDetection]) -> Tuple[float, float]:
+    # Recall and RMS corner error in pixels of the detections that match a rendered tag
+    expected = { int(tag.id): tag.corners.reshape(4, 2) for tag in truth }
+    errors = [detection.corners.reshape(4, 2) - expected[int(detection.id)] for detection in detections if int(detection.id) in expected]
+    found = len({ int(detection.id) for detection in detections } & set(expected.keys()))
+    recall = found / len(expected) if len(expected) > 0 else math.nan
+    return recall, float(numpy.sqrt(numpy.mean(numpy.square(errors)))) if len(errors) > 0 else math.nan
+
+def pose_error(pose: Optional[Pose3d], truth: Pose3d) -> Dict[str, float]:
+    if pose == None:
+        return { "translation_error_m": math.nan, "rotation_error_rad": math.nan }
+    return {
+        "translation_error_m": pose.translation().distance(truth.translation()),
+        "rotation_error_rad": abs((pose.rotation() - truth.rotation()).angle) # type: ignore
+    }
+
+def benchmark_scene(width: int, height: int, tag_count: int, tag_pixels: int, profiles: List[str], decimations: List[int], iterations: int, nt_output: NTOutput, stream_output: StreamOutput) -> List[Dict[str, Any]]:
+    scene = make_scene(width, height, tag_count, tag_pixels)
+    case: Dict[str, Any] = { "resolution": str(width) + "x" + str(height), "tags": tag_count, "tag_pixels": tag_pixels }
+    if scene == None:
+        return [dict(case, stage = "skipped", reason = "tags do not fit in the image")]
+    calibration_config, nt_config, position, target = scene
+    generator = SceneGenerator(calibration_config, nt_config, width, height)
+    camera_pose = generator.look_at(position, target)
+    capture, truth = generator.render(camera_pose, 0.5, 2.0)
+    robot_pose = generator.robot_pose(camera_pose)
+    results: List[Dict[str, Any]] = []
+
+    detections: List[ApriltagDetection] = []
+    for profile in profiles:
+        # A detector applies its profile when it first sees a config, so each profile gets its own
+        apriltag_detector = ApriltagDetector()
+        for decimation in decimations:
+            detector_config = replace(nt_config, detector_profile = profile, decimation = decimation)
+            found = apriltag_detector.search(capture, detector_config)
+            recall, error = corner_error(found, truth)
+            timing = time_calls(lambda: apriltag_detector.search(capture, detector_config), iterations)
+            results.append(dict(case, stage = "detect", profile = profile, decimation = decimation, recall = recall, corner_error_px = error, **timing))
+            if profile == profiles[0] and decimation == decimations[0]:
+                detections = found
+
+    # The remaining stages work on what the first detector setting found, so their accuracy includes its corner error
+    pose_estimator = PoseEstimator()
+    pose_estimation = pose_estimator.get_estimated_pose(detections, calibration_config, nt_config, 0.0)
+    timing = time_calls(lambda: pose_estimator.get_estimated_pose(detections, calibration_config, nt_config, 0.0), iterations * 10)
+    results.append(dict(case, stage = "pose", **pose_error(pose_estimation.pose if pose_estimation != None else None, robot_pose), **timing))
+
+    observations = pose_estimator.get_tag_observations(detections, calibration_config, nt_config)
+    debug_pose_estimation = pose_estimator.get_estimated_debug_pose(observations, nt_config)
+    timing = time_calls(lambda: pose_estimator.get_estimated_debug_pose(pose_estimator.get_tag_observations(detections, calibration_config, nt_config), nt_config), iterations * 10)
+    results.append(dict(case, stage = "debug_pose", **timing))
+
+    timing = time_calls(lambda: nt_output.update(time.time(), 30, pose_estimation, debug_pose_estimation, observations), iterations * 10)
+    results.append(dict(case, stage = "nt_output", **timing))
+
+    preview = stream_output.make_preview(capture, detections)
+    jpeg = stream_output.encode_jpeg(preview, StreamOutput.DEFAULT_QUALITY, 1.0)
+    timing = time_calls(lambda: stream_output.encode_jpeg(preview, StreamOutput.DEFAULT_QUALITY, 1.0), iterations)
+    results.append(dict(case, stage = "stream_encode", preview = str(preview.shape[1]) + "x" + str(preview.shape[0]), jpeg_bytes = len(jpeg), **timing))
+    return results
+
+def metadata() -> Dict[str, Any]:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output = True, text = True, check = True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = ""
+    return {
+        "date": datetime.datetime.now().isoformat(),
+        "commit": commit,
+        "platform": platform.platform(),
+        "processor": platform.machine(),
+        "python": platform.python_version(),
+        "opencv": cv2.__version__,
+        "numpy": numpy.__version__,
+        "opencv_threads": cv2.getNumThreads()
+    }
+
+def parse_list(source: str) -> List[str]:
+    return [item for item in source.split(",") if item != ""]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Time each pipeline stage on rendered scenes and report accuracy against ground truth")
+    parser.add_argument("--resolutions", default = "640x480,1280x720,1600x1200")
+    parser.add_argument("--tag-counts", default = "1,4,16")
+    parser.add_argument("--tag-pixels", default = "24,64,160", help = "tag widths in pixels")
+    parser.add_argument("--profiles", default = "default,fast", help = "detector profiles, the first one feeds the later stages")
+    parser.add_argument("--decimations", default = "1,2")
+    parser.add_argument("--iterations", type = int, default = 10, help = "timed detector runs per case, the faster stages run ten times as many")
+    parser.add_argument("--output", help = "write the results as JSON to this file")
+    args = parser.parse_args()
+
+    connection_config = ConnectionConfigLoader()._parse({ "name": "benchmark", "nt_uri": "", "video_port": 0 })
+    nt_output = NTOutput(connection_config)
+    stream_output = StreamOutput(LatencyMetrics(), Profiler(connection_config))
+    results: List[Dict[str, Any]] = []
+
+    print("stage          resolution  tags  px  profile  dec  median ms   p95 ms  accuracy")
+    for resolution in parse_list(args.resolutions):
+        width, height = [int(value) for value in resolution.split("x")]
+        for tag_count in [int(value) for value in parse_list(args.tag_counts)]:
+            for tag_pixels in [int(value) for value in parse_list(args.tag_pixels)]:
+                for result in benchmark_scene(width, height, tag_count, tag_pixels, parse_list(args.profiles), [int(value) for value in parse_list(args.decimations)], args.iterations, nt_output, stream_output):
+                    results.append(result)
+                    if result["stage"] == "skipped":
+                        continue
+                    accuracy = ""
+                    if result["stage"] == "detect":
+                        accuracy = "recall %.2f, corners %.3f px" % (result["recall"], result["corner_error_px"])
+                    elif result["stage"] == "pose":
+                        accuracy = "%.4f m, %.4f rad" % (result["translation_error_m"], result["rotation_error_rad"])
+                    print("%-14s %10s %5d %3d  %-8s %3s %10.3f %8.3f  %s" % (
+                        result["stage"], result["resolution"], result["tags"], result["tag_pixels"],
+                        result.get("profile", ""), str(result.get("decimation", "")), result["median_ms"], result["p95_ms"], accuracy
+                    ))
+
+    if args.output != None:
+        with open(args.output, "w") as file:
+            json.dump({ "metadata": metadata(), "results": results }, file, indent = 1)
+        print("Wrote " + str(len(results)) + " results to " + args.output)
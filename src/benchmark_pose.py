@@ -0,0 +1,147 @@
+import cv2
+from dataclasses import replace
+import json
+import math
+import numpy
+import time
+from typing import List, Optional, Tuple
+from wpimath.geometry import Pose3d, Rotation3d, Transform3d, Translation3d
+
+from config.CalibrationConfig import CalibrationConfig
+from config.NTConfig import NTConfig, NTConfigTagLayout, generate_default
+from pipeline.ApriltagDetector import ApriltagDetection
+from pipeline.PoseEstimator import PoseEstimation, PoseEstimator
+import pipeline.PoseMath as PoseMath
+
+TAG_COUNTS = [1, 2, 4, 8, 16, 32]
+ITERATIONS = 500
+
+def make_scene(tag_count: int) -> Tuple[CalibrationConfig, NTConfig, List[ApriltagDetection]]:
+    calibration_config = CalibrationConfig(numpy.array([[1000.0, 0.0, 800.0], [0.0, 1000.0, 600.0], [0.0, 0.0, 1.0]]), numpy.zeros((1, 5)))
+    tags = [{ "id": i + 1, "x": 8.0, "y": 2.5 + 0.5 * (i % 8), "z": 0.3 + 0.4 * (i // 8), "rx": 0.0, "ry": 0.0, "rz": math.pi } for i in range(tag_count)]
+    nt_config = generate_default()
+    nt_config = replace(
+        nt_config,
+        camera_position = [0.2, 0.1, 0.3, 0.0, -0.1, 0.05],
+        tag_layout = NTConfigTagLayout(json.dumps(tags), nt_config.tag_size),
+        debug_tag = 1
+    )
+
+    camera = PoseMath.from_pose(Pose3d(Translation3d(3.0, 4.1, 0.6), Rotation3d(0.02, -0.05, 0.1)))
+    field_to_camera = PoseMath.invert(camera)
+    rvec, _ = cv2.Rodrigues(PoseMath.OPENCV_TO_WPILIB.T @ field_to_camera[:3, :3] @ PoseMath.OPENCV_TO_WPILIB)
+    tvec = PoseMath.OPENCV_TO_WPILIB.T @ field_to_camera[:3, 3]
+
+    detections: List[ApriltagDetection] = []
+    for tag in tags:
+        object_points = nt_config.tag_layout.object_points[nt_config.tag_layout.index[tag["id"]]]
+        image_points, _ = cv2.projectPoints(object_points, rvec, tvec, calibration_config.distortion_matrix, calibration_config.distortion_coefficients)
+        detections.append(ApriltagDetection(tag["id"], image_points.reshape(1, 4, 2).astype(numpy.float32)))
+
+    return calibration_config, nt_config, detections
+
+def legacy_to_wpilib(tvec: numpy.ndarray, rvec: numpy.ndarray) -> Pose3d:
+    return Pose3d(
+        Translation3d(tvec[2][0], -tvec[0][0], -tvec[1][0]),
+        Rotation3d(
+            numpy.array([rvec[2][0], -rvec[0][0], -rvec[1][0]]),
+            math.sqrt(math.pow(rvec[0][0], 2) + math.pow(rvec[1][0], 2) + math.pow(rvec[2][0], 2))
+        )
+    )
+
+def legacy_estimated_pose(detections: List[ApriltagDetection], calibration_config: CalibrationConfig, nt_config: NTConfig, tag_layout_poses: List[Pose3d]) -> Optional[PoseEstimation]:
+    # get_estimated_pose as it was before the pose math moved to matrices, with the whole chain done in WPILib
+    # geometry. The layout used to hold a Pose3d for every tag, which tag_layout_poses stands in for.
+    tags: List[int] = []
+    tag_poses: List[Pose3d] = []
+    rows: List[int] = []
+    image_points: List[numpy.ndarray] = []
+    for detection in detections:
+        row = nt_config.tag_layout.index.get(detection.id)
+        if row != None:
+            rows.append(row)
+            image_points.append(detection.corners.reshape(4, 2))
+            tags.append(detection.id)
+            tag_poses.append(tag_layout_poses[row])
+    if len(tags) == 0:
+        return None
+
+    camera_to_robot = Transform3d(
+        Translation3d(nt_config.camera_position[0], nt_config.camera_position[1], nt_config.camera_position[2]),
+        Rotation3d(nt_config.camera_position[3], nt_config.camera_position[4], nt_config.camera_position[5])
+    ).inverse()
+    if len(tags) == 1:
+        _, rvecs, tvecs, errors = cv2.solvePnPGeneric(
+            nt_config.tag_layout.tag_object_points,
+            image_points[0].astype(numpy.float64),
+            calibration_config.distortion_matrix,
+            calibration_config.distortion_coefficients,
+            flags = cv2.SOLVEPNP_IPPE_SQUARE
+        )
+        if errors[0][0] < errors[1][0] * nt_config.error_ambiguity:
+            best = 0
+        elif errors[1][0] < errors[0][0] * nt_config.error_ambiguity:
+            best = 1
+        else:
+            return None
+        camera_to_tag_pose = legacy_to_wpilib(tvecs[best], rvecs[best])
+        distance = camera_to_tag_pose.translation().norm() # type: ignore
+        camera_to_tag = Transform3d(camera_to_tag_pose.translation(), camera_to_tag_pose.rotation())
+        final_pose = tag_poses[0].transformBy(camera_to_tag if best == 0 else camera_to_tag.inverse()).transformBy(camera_to_robot)
+    else:
+        _, rvecs, tvecs, _ = cv2.solvePnPGeneric(
+            nt_config.tag_layout.object_points[rows].reshape(-1, 3),
+            numpy.concatenate(image_points).astype(numpy.float64),
+            calibration_config.distortion_matrix,
+            calibration_config.distortion_coefficients,
+            flags = cv2.SOLVEPNP_SQPNP
+        )
+        camera_to_field_pose = legacy_to_wpilib(tvecs[0], rvecs[0])
+        field_to_camera = Transform3d(camera_to_field_pose.translation(), camera_to_field_pose.rotation()).inverse()
+        final_pose = Pose3d(field_to_camera.translation(), field_to_camera.rotation()).transformBy(camera_to_robot)
+        total_distance = 0.0
+        for tag_pose in tag_poses:
+            total_distance += final_pose.relativeTo(tag_pose).translation().norm() # type: ignore
+        distance = total_distance / len(tag_poses)
+
+    if final_pose.X() < -nt_config.field_margin[0] or final_pose.Y() < -nt_config.field_margin[1] or final_pose.Z() < -nt_config.field_margin[2] or final_pose.X() > nt_config.field_size[0] + nt_config.field_margin[0] or final_pose.Y() > nt_config.field_size[1] + nt_config.field_margin[1] or final_pose.Z() > nt_config.field_size[2] + nt_config.field_margin[2]: # type: ignore
+        return None
+    return PoseEstimation(tags, final_pose, distance)
+
+def temporal_frames(pose_estimator: PoseEstimator, detections: List[ApriltagDetection], calibration_config: CalibrationConfig, nt_config: NTConfig): # type: ignore
+    temporal_config = replace(nt_config, temporal_pose = True)
+    timestamp = 0.0
+    while True:
+        timestamp += 0.02
+        yield pose_estimator.get_estimated_pose(detections, calibration_config, temporal_config, timestamp)
+
+def time_per_call(function, iterations: int) -> float: # type: ignore
+    start = time.perf_counter()
+    for _ in range(iterations):
+        function()
+    return (time.perf_counter() - start) / iterations * 1000.0
+
+if __name__ == "__main__":
+    pose_estimator = PoseEstimator()
+    print("tags  before ms  after ms  temporal ms  max diff")
+
+    for tag_count in TAG_COUNTS:
+        calibration_config, nt_config, detections = make_scene(tag_count)
+        tag_layout_poses = [PoseMath.to_pose(matrix) for matrix in nt_config.tag_layout.matrices]
+
+        legacy_estimation = legacy_estimated_pose(detections, calibration_config, nt_config, tag_layout_poses)
+        estimation = pose_estimator.get_estimated_pose(detections, calibration_config, nt_config, 0.0)
+        assert legacy_estimation != None and estimation != None, "the synthetic scene should give a pose"
+        difference = max(
+            legacy_estimation.pose.translation().distance(estimation.pose.translation()),
+            abs(math.remainder((legacy_estimation.pose.rotation() - estimation.pose.rotation()).angle, 2.0 * math.pi)), # type: ignore
+            abs(legacy_estimation.distance - estimation.distance)
+        )
+
+        # Whole frames, from the detections to the returned estimate, so the solve is counted on both sides
+        before_ms = time_per_call(lambda: legacy_estimated_pose(detections, calibration_config, nt_config, tag_layout_poses), ITERATIONS)
+        after_ms = time_per_call(lambda: pose_estimator.get_estimated_pose(detections, calibration_config, nt_config, 0.0), ITERATIONS)
+        temporal = temporal_frames(PoseEstimator(), detections, calibration_config, nt_config)
+        temporal_ms = time_per_call(lambda: next(temporal), ITERATIONS)
+
+        print("%4d  %9.3f  %8.3f  %11.3f  %.2e" % (tag_count, before_ms, after_ms, temporal_ms, difference))
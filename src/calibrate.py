@@ -1,19 +1,27 @@
+import argparse
+import collections
+import datetime
+import numpy
+import os
 import time
 
+from calibration.BatchCalibration import detect_views, read_frames, select_views
 from calibration.CalibrationSession import CalibrationSession
+from calibration.CalibrationSolver import solve
 from config.CalibrationConfig import CalibrationConfigLoader
 from config.NTConfig import generate_default
 from pipeline.Camera import Camera
 
 FRAMES = 10
+OUTLIER_FACTOR = 3.0
 
-if __name__ == "__main__":
+def calibrate_live(calibration_config_loader: CalibrationConfigLoader, args: argparse.Namespace) -> None:
     nt_config = generate_default()
-    calibration_config_loader = CalibrationConfigLoader()
-    calibration_session = CalibrationSession(12, 9, 0.030, 0.023)
+    snapshot_directory = os.path.join(args.snapshots, datetime.datetime.now().strftime("%Y%m%d_%H%M%S"))
+    calibration_session = CalibrationSession(args.squares[0], args.squares[1], args.square_length, args.marker_length, snapshot_directory)
     camera = Camera()
 
-    print("Running calibration")
+    print("Running calibration, saving snapshots to " + snapshot_directory)
 
     for i in range(FRAMES):
         print("Caputuring frame in 3...")
@@ -33,4 +41,63 @@ if __name__ == "__main__":
         time.sleep(1)
 
     print("Finished gathering frames")
-    calibration_session.save_to_file(calibration_config_loader)
+    calibration_session.save_to_file(calibration_config_loader, args.name)
+
+def calibrate_batch(calibration_config_loader: CalibrationConfigLoader, args: argparse.Namespace) -> None:
+    start = time.perf_counter()
+    count, views = detect_views(read_frames(args.source, args.stride), args.squares[0], args.squares[1], args.square_length, args.marker_length, args.workers)
+    print("Found the board in " + str(len(views)) + " of " + str(count) + " frames in %.1f s" % (time.perf_counter() - start))
+    if len(views) == 0:
+        return
+
+    size = collections.Counter(view.size for view in views).most_common(1)[0][0]
+    if any(view.size != size for view in views):
+        views = [view for view in views if view.size == size]
+        print("Using the " + str(len(views)) + " frames at the most common resolution, " + str(size[0]) + "x" + str(size[1]))
+
+    start = time.perf_counter()
+    views = select_views(views, args.max_views)
+    solution = solve([view.obj_points for view in views], [view.img_points for view in views], size)
+
+    # Views far worse than the rest are usually blurred or misdetected, so they are dropped and the rest solved again
+    if solution.is_valid():
+        limit = OUTLIER_FACTOR * float(numpy.median(solution.view_errors))
+        kept = [view for view, error in zip(views, solution.view_errors) if error <= limit]
+        if len(kept) < len(views):
+            print("Dropping " + str(len(views) - len(kept)) + " views with a reprojection error above %.3f px" % limit)
+            views = kept
+            solution = solve([view.obj_points for view in views], [view.img_points for view in views], size)
+    print("Solved " + str(len(views)) + " views in %.1f s" % (time.perf_counter() - start))
+
+    if not solution.is_valid():
+        print("Calibration failed: " + solution.error)
+        return
+
+    errors = numpy.array(solution.view_errors)
+    print("RMS reprojection error %.3f px" % solution.rms)
+    print("Per view error: mean %.3f px, median %.3f px, max %.3f px" % (errors.mean(), numpy.median(errors), errors.max()))
+    for index in numpy.argsort(errors)[::-1][:5]:
+        print("  %.3f px  %s" % (errors[index], views[index].source))
+
+    calibration_config_loader.write(solution.distortion_matrix, solution.distortion_coefficients, size[0], size[1], args.name, solution.rms, solution.view_errors) # type: ignore
+    print("Finished calibration")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Calibrate a camera from a ChArUco board, live or from saved frames")
+    parser.add_argument("source", nargs = "?", help = "directory of images, video file or .blr recording; captures live from the camera when left out")
+    parser.add_argument("--calibration", default = CalibrationConfigLoader.FILENAME)
+    parser.add_argument("--name", default = "", help = "calibration name, mode_<width>x<height> by default")
+    parser.add_argument("--squares", type = int, nargs = 2, default = [12, 9], metavar = ("X", "Y"))
+    parser.add_argument("--square-length", type = float, default = 0.030)
+    parser.add_argument("--marker-length", type = float, default = 0.023)
+    parser.add_argument("--max-views", type = int, default = 40, help = "views passed to the solver, chosen to cover the image and board tilt")
+    parser.add_argument("--stride", type = int, default = 5, help = "use every Nth frame of a video or recording")
+    parser.add_argument("--workers", type = int, default = os.cpu_count() or 1)
+    parser.add_argument("--snapshots", default = "calibration_snapshots", help = "where live snapshots are saved")
+    args = parser.parse_args()
+
+    calibration_config_loader = CalibrationConfigLoader(args.calibration)
+    if args.source != None:
+        calibrate_batch(calibration_config_loader, args)
+    else:
+        calibrate_live(calibration_config_loader, args)
@@ -0,0 +1,126 @@
+import cv2
+import cv2.typing
+from dataclasses import dataclass
+import math
+import multiprocessing
+import numpy
+import numpy.typing
+import os
+from typing import Iterator, List, Optional, Tuple
+
+from calibration.CalibrationSession import CalibrationSession
+from config.NTConfig import generate_default
+from pipeline.ReplayCamera import ReplayCamera
+
+IMAGE_EXTENSIONS = [".png", ".jpg", ".jpeg", ".bmp", ".pgm", ".tif", ".tiff"]
+MIN_CORNERS = 12
+
+@dataclass
+class CalibrationView:
+    source: str
+    obj_points: cv2.typing.MatLike
+    img_points: cv2.typing.MatLike
+    size: Tuple[int, int]
+
+# Each pool worker builds its own board and detector once, since neither can be pickled
+_board: Optional[cv2.aruco.CharucoBoard] = None
+_detector: Optional[cv2.aruco.CharucoDetector] = None
+
+def _init_worker(squares_x: int, squares_y: int, square_length: float, marker_length: float) -> None:
+    global _board, _detector
+    cv2.setNumThreads(1)
+    _board = cv2.aruco.CharucoBoard((squares_x, squares_y), square_length, marker_length, cv2.aruco.getPredefinedDictionary(CalibrationSession.DICTIONARY))
+    _detector = cv2.aruco.CharucoDetector(_board, cv2.aruco.CharucoParameters(), cv2.aruco.DetectorParameters(), cv2.aruco.RefineParameters())
+
+def _detect_view(item: Tuple[str, Optional[cv2.typing.MatLike]]) -> Optional[CalibrationView]:
+    source, image = item
+    if image is None:
+        image = cv2.imread(source, cv2.IMREAD_GRAYSCALE)
+        if image is None:
+            return None
+
+    charuco_corners, charuco_ids, _, _ = _detector.detectBoard(image) # type: ignore
+    if charuco_ids is None or len(charuco_ids) < MIN_CORNERS:
+        return None
+    obj_points, img_points = _board.matchImagePoints(charuco_corners, charuco_ids) # type: ignore
+    return CalibrationView(source, obj_points, img_points, (image.shape[1], image.shape[0]))
+
+def read_frames(path: str, stride: int) -> Iterator[Tuple[str, Optional[cv2.typing.MatLike]]]:
+    # Images are yielded by name and read by the workers. Video and recording frames have to be decoded here.
+    if os.path.isdir(path):
+        for name in sorted(os.listdir(path)):
+            if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS:
+                yield os.path.join(path, name), None
+    elif path.endswith(".blr"):
+        camera = ReplayCamera(path)
+        index = 0
+        while True:
+            success, capture = camera.read(generate_default())
+            if not success:
+                break
+            if index % stride == 0:
+                yield path + "#" + str(index), capture
+            index += 1
+        camera.release()
+    else:
+        video = cv2.VideoCapture(path)
+        index = 0
+        while video.grab():
+            if index % stride == 0:
+                success, frame = video.retrieve()
+                if success:
+                    yield path + "#" + str(index), cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if len(frame.shape) == 3 else frame
+            index += 1
+        video.release()
+
+def detect_views(frames: Iterator[Tuple[str, Optional[cv2.typing.MatLike]]], squares_x: int, squares_y: int, square_length: float, marker_length: float, workers: int) -> Tuple[int, List[CalibrationView]]:
+    # Frames are sent in batches so that a long video is never decoded into memory all at once
+    context = multiprocessing.get_context("spawn")
+    views: List[CalibrationView] = []
+    count = 0
+    with context.Pool(workers, _init_worker, (squares_x, squares_y, square_length, marker_length)) as pool:
+        batch: List[Tuple[str, Optional[cv2.typing.MatLike]]] = []
+        for frame in frames:
+            batch.append(frame)
+            if len(batch) >= workers * 4:
+                views += [view for view in pool.map(_detect_view, batch) if view != None]
+                count += len(batch)
+                batch = []
+        views += [view for view in pool.map(_detect_view, batch) if view != None]
+        count += len(batch)
+    return count, views
+
+def view_features(view: CalibrationView) -> numpy.typing.NDArray[numpy.float64]:
+    # Where the board is in the image, how much of it it covers and how far it is tilted towards each axis.
+    # Tilt is measured with a guessed focal length, which is good enough to tell views apart.
+    width, height = view.size
+    points = view.img_points.reshape(-1, 2).astype(numpy.float64)
+    center = points.mean(axis = 0) / [width, height]
+    scale = math.sqrt(cv2.contourArea(cv2.convexHull(points.astype(numpy.float32))) / (width * height))
+
+    homography, _ = cv2.findHomography(view.obj_points.reshape(-1, 3)[:, :2], points)
+    if homography is None:
+        return numpy.array([center[0], center[1], scale, 0.0, 0.0])
+    focal = max(width, height)
+    camera_matrix = numpy.array([[focal, 0.0, width / 2.0], [0.0, focal, height / 2.0], [0.0, 0.0, 1.0]])
+    columns = numpy.linalg.solve(camera_matrix, homography)
+    normal = numpy.cross(columns[:, 0] / numpy.linalg.norm(columns[:, 0]), columns[:, 1] / numpy.linalg.norm(columns[:, 1]))
+    normal *= numpy.sign(normal[2]) if normal[2] != 0 else 1.0
+    tilt_x = math.atan2(normal[1], normal[2]) / (math.pi / 2.0)
+    tilt_y = math.atan2(normal[0], normal[2]) / (math.pi / 2.0)
+    return numpy.array([center[0], center[1], scale, tilt_x, tilt_y])
+
+def select_views(views: List[CalibrationView], count: int) -> List[CalibrationView]:
+    # Farthest point sampling over view_features, starting from the view that sees the most corners. The solve time of
+    # calibrateCamera grows with the number of views, while near duplicate views add little.
+    if len(views) <= count:
+        return views
+
+    features = numpy.array([view_features(view) for view in views])
+    selected = [int(numpy.argmax([len(view.img_points) for view in views]))]
+    distances = numpy.linalg.norm(features - features[selected[0]], axis = 1)
+    while len(selected) < count:
+        index = int(numpy.argmax(distances))
+        selected.append(index)
+        distances = numpy.minimum(distances, numpy.linalg.norm(features - features[index], axis = 1))
+    return [views[index] for index in sorted(selected)]
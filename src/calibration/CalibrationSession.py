@@ -1,20 +1,28 @@
 import cv2
 import cv2.typing
-from typing import Optional, Sequence
+import os
+from typing import List, Optional
 
+from calibration.CalibrationSolver import CalibrationSolver, solve
 from filter.OverlayMarkers import OverlayMarkers
 from config.CalibrationConfig import CalibrationConfigLoader
 
 class CalibrationSession:
+    DICTIONARY = cv2.aruco.DICT_5X5_1000
+
     _board: cv2.aruco.CharucoBoard
     _camera_size: Optional[cv2.typing.Size] = None
     _detector: cv2.aruco.CharucoDetector
-    _img_points: Sequence[cv2.typing.MatLike] = []
-    _obj_points: Sequence[cv2.typing.MatLike] = []
+    _img_points: List[cv2.typing.MatLike]
+    _obj_points: List[cv2.typing.MatLike]
     _overlay_markers = OverlayMarkers()
+    _snapshot_directory: str
 
-    def __init__(self, squaresX: int, squaresY: int, squareLengthMeters: float, markerLengthMeters: float) -> None:
-        self._board = cv2.aruco.CharucoBoard((squaresX, squaresY), squareLengthMeters, markerLengthMeters, cv2.aruco.getPredefinedDictionary(cv2.aruco.DICT_5X5_1000))
+    def __init__(self, squaresX: int, squaresY: int, squareLengthMeters: float, markerLengthMeters: float, snapshot_directory: str = "") -> None:
+        self._img_points = []
+        self._obj_points = []
+        self._snapshot_directory = snapshot_directory
+        self._board = cv2.aruco.CharucoBoard((squaresX, squaresY), squareLengthMeters, markerLengthMeters, cv2.aruco.getPredefinedDictionary(self.DICTIONARY))
 
         self._detector = cv2.aruco.CharucoDetector(
             self._board,
@@ -25,32 +33,55 @@ class CalibrationSession:
 
     def intake_frame(self, capture: cv2.typing.MatLike, save: bool) -> None:
         if self._camera_size == None:
-            self._camera_size = (capture.shape[0], capture.shape[1])
+            self._camera_size = (capture.shape[1], capture.shape[0])
 
         charuco_corners, charuco_ids, marker_corners, marker_ids = self._detector.detectBoard(capture)
-        self._overlay_markers.add_charuco_detection(capture, charuco_corners, charuco_ids, marker_corners, marker_ids)
 
         if save and len(marker_corners) > 0 and len(marker_ids) > 0:
             obj_points, image_points = self._board.matchImagePoints(charuco_corners, charuco_ids) # type: ignore
             self._obj_points.append(obj_points) # type: ignore
             self._img_points.append(image_points) # type: ignore
+            self._save_snapshot(capture)
             print("Took calibration snap")
 
-    def save_to_file(self, calibration_config_loader: CalibrationConfigLoader) -> None:
-        if len(self._img_points) == 0 or len(self._obj_points) == 0:
-            print("Unable to calibrate: no data")
+        # Drawn after the snapshot is saved, since the overlay goes onto the capture itself
+        self._overlay_markers.add_charuco_detection(capture, charuco_corners, charuco_ids, marker_corners, marker_ids)
+
+    def views(self) -> int:
+        return len(self._img_points)
+
+    def start_solve(self) -> Optional[CalibrationSolver]:
+        if not self._can_solve():
+            return None
+        return CalibrationSolver(self._obj_points, self._img_points, self._camera_size) # type: ignore
+
+    def save_to_file(self, calibration_config_loader: CalibrationConfigLoader, name: str = "") -> None:
+        if not self._can_solve():
             return
 
-        calibration_config_loader.remove_config()
+        solution = solve(self._obj_points, self._img_points, self._camera_size) # type: ignore
+        if solution.is_valid():
+            calibration_config_loader.write(solution.distortion_matrix, solution.distortion_coefficients, solution.width, solution.height, name, solution.rms, solution.view_errors) # type: ignore
+            print("Finished calibration with RMS reprojection error %.3f px" % solution.rms)
+        else:
+            print("Calibration failed: " + solution.error)
 
-        if self._camera_size == None:
-            print("Unable to calibrate: cannot determine camera size")
+    def _save_snapshot(self, capture: cv2.typing.MatLike) -> None:
+        # Snapshots can be calibrated again later with calibrate.py
+        if self._snapshot_directory == "":
             return
+        os.makedirs(self._snapshot_directory, exist_ok = True)
+        filename = os.path.join(self._snapshot_directory, "snap_%03d.png" % len(self._img_points))
+        if not cv2.imwrite(filename, capture, [cv2.IMWRITE_PNG_COMPRESSION, 1]):
+            print("Unable to save calibration snapshot to " + filename)
+
+    def _can_solve(self) -> bool:
+        if len(self._img_points) == 0 or len(self._obj_points) == 0:
+            print("Unable to calibrate: no data")
+            return False
 
-        rms, distortion_matrix, distortion_coefficients, _, _ = cv2.calibrateCamera(self._obj_points, self._img_points, self._camera_size, None, None) # type: ignore
+        if self._camera_size == None:
+            print("Unable to calibrate: cannot determine camera size")
+            return False
 
-        if rms:
-            calibration_config_loader.write(distortion_matrix, distortion_coefficients) # type: ignore
-            print("Finished calibration")
-        else:
-            print("Calibration failed")
+        return True
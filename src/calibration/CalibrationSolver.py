@@ -0,0 +1,101 @@
+import cv2
+import cv2.typing
+from dataclasses import dataclass, field
+import math
+import numpy
+import queue
+import threading
+import time
+from typing import Any, Callable, List, Optional, Sequence
+
+@dataclass
+class CalibrationSolution:
+    width: int
+    height: int
+    rms: float = math.nan
+    distortion_matrix: Optional[cv2.typing.MatLike] = None
+    distortion_coefficients: Optional[cv2.typing.MatLike] = None
+    view_errors: List[float] = field(default_factory = list)
+    error: str = ""
+
+    def is_valid(self) -> bool:
+        return self.error == ""
+
+MIN_VIEWS = 3
+MAX_RMS = 2.0
+
+def solve(obj_points: Sequence[cv2.typing.MatLike], img_points: Sequence[cv2.typing.MatLike], size: cv2.typing.Size, progress: Callable[[str, float], None] = lambda status, fraction: None) -> CalibrationSolution:
+    solution = CalibrationSolution(size[0], size[1])
+    if len(obj_points) < MIN_VIEWS:
+        solution.error = "need at least " + str(MIN_VIEWS) + " views, got " + str(len(obj_points))
+        return solution
+
+    progress("solving " + str(len(obj_points)) + " views", 0.1)
+    try:
+        rms, distortion_matrix, distortion_coefficients, _, _, _, _, view_errors = cv2.calibrateCameraExtended(obj_points, img_points, size, None, None) # type: ignore
+    except cv2.error as error:
+        solution.error = "solve failed: " + str(error).strip()
+        return solution
+
+    progress("validating", 0.9)
+    solution.rms = float(rms)
+    solution.distortion_matrix = distortion_matrix
+    solution.distortion_coefficients = distortion_coefficients
+    solution.view_errors = view_errors.ravel().tolist()
+
+    # A solve that "succeeds" with nonsense intrinsics must not replace a working calibration
+    fx, fy, cx, cy = distortion_matrix[0, 0], distortion_matrix[1, 1], distortion_matrix[0, 2], distortion_matrix[1, 2]
+    if not numpy.all(numpy.isfinite(distortion_matrix)) or not numpy.all(numpy.isfinite(distortion_coefficients)):
+        solution.error = "solution is not finite"
+    elif fx <= 0 or fy <= 0 or not (0 <= cx < size[0] and 0 <= cy < size[1]):
+        solution.error = "focal length or principal point out of range"
+    elif not solution.rms <= MAX_RMS:
+        solution.error = "RMS reprojection error %.3f px is above %.1f px" % (solution.rms, MAX_RMS)
+    return solution
+
+class CalibrationSolver:
+    # Runs solve() on a separate thread so the frame loop keeps going, as OpenCV releases the GIL while it solves. A
+    # thread rather than a process, since camera workers run as daemon processes, which cannot have children.
+    # cv2.calibrateCamera only reports when it is finished, so progress is the current step and the time spent so far.
+    status = "starting"
+    progress = 0.0
+
+    _messages: "queue.Queue[Any]"
+    _thread: threading.Thread
+    _started: float
+    _cancelled = False
+
+    def __init__(self, obj_points: Sequence[cv2.typing.MatLike], img_points: Sequence[cv2.typing.MatLike], size: cv2.typing.Size) -> None:
+        self._messages = queue.Queue()
+        self._thread = threading.Thread(target = self._solve, args = (list(obj_points), list(img_points), size), daemon = True, name = "calibration-solver")
+        self._thread.start()
+        self._started = time.perf_counter()
+
+    def poll(self) -> Optional[CalibrationSolution]:
+        while True:
+            try:
+                message = self._messages.get_nowait()
+            except queue.Empty:
+                break
+
+            if isinstance(message, CalibrationSolution):
+                self.status = "done" if message.is_valid() else "failed: " + message.error
+                self.progress = 1.0
+                return message
+            self.status, self.progress = message
+        return None
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self._started
+
+    def cancel(self) -> None:
+        # The solve cannot be interrupted, so it runs to the end and its result is dropped
+        self._cancelled = True
+
+    def _solve(self, obj_points: Sequence[cv2.typing.MatLike], img_points: Sequence[cv2.typing.MatLike], size: cv2.typing.Size) -> None:
+        try:
+            solution = solve(obj_points, img_points, size, lambda status, fraction: self._messages.put((status, fraction)))
+        except Exception as error:
+            solution = CalibrationSolution(size[0], size[1], error = "solver failed: " + str(error))
+        if not self._cancelled:
+            self._messages.put(solution)
@@ -1,6 +1,7 @@
 import ntcore
 from typing import Optional
 
+from calibration.CalibrationSolver import CalibrationSolution
 from config.ConnectionConfig import ConnectionConfig
 
 class NTCalibrationController:
@@ -9,6 +10,13 @@ class NTCalibrationController:
     _calibrating: Optional[ntcore.BooleanSubscriber] = None
     _snap: Optional[ntcore.BooleanSubscriber] = None
     _last_snap = False
+    _published = False
+    _views: ntcore.IntegerPublisher
+    _status: ntcore.StringPublisher
+    _progress: ntcore.DoublePublisher
+    _elapsed: ntcore.DoublePublisher
+    _rms: ntcore.DoublePublisher
+    _view_errors: ntcore.DoubleArrayPublisher
 
     def __init__(self, connection_config: ConnectionConfig) -> None:
         self._connection_config = connection_config
@@ -35,3 +43,28 @@ class NTCalibrationController:
             return True
         else:
             return False
+
+    def update_views(self, views: int) -> None:
+        self._publish()
+        self._views.set(views)
+
+    def update_progress(self, status: str, progress: float, elapsed: float) -> None:
+        self._publish()
+        self._status.set(status)
+        self._progress.set(progress)
+        self._elapsed.set(elapsed)
+
+    def update_solution(self, solution: CalibrationSolution) -> None:
+        self._publish()
+        self._rms.set(solution.rms)
+        self._view_errors.set(solution.view_errors)
+
+    def _publish(self) -> None:
+        if not self._published:
+            self._views = self._table.getIntegerTopic("views").publish()
+            self._status = self._table.getStringTopic("status").publish()
+            self._progress = self._table.getDoubleTopic("progress").publish()
+            self._elapsed = self._table.getDoubleTopic("elapsed").publish()
+            self._rms = self._table.getDoubleTopic("rms").publish()
+            self._view_errors = self._table.getDoubleArrayTopic("viewErrors").publish()
+            self._published = True
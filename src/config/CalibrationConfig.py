@@ -1,32 +1,145 @@
 import cv2
 import cv2.typing
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 import datetime
+import math
 import numpy
 import os
+import re
+from typing import Dict, List, Optional, Sequence, Tuple
 
 @dataclass
 class CalibrationConfig:
     distortion_matrix: cv2.typing.MatLike
     distortion_coefficients: cv2.typing.MatLike
+    width: int = 0
+    height: int = 0
+    rms: float = math.nan
+    view_errors: List[float] = field(default_factory = list)
+
+class CalibrationConfigSet:
+    ASPECT_TOLERANCE = 0.01
+
+    calibrations: Dict[str, CalibrationConfig]
+    _resolved: Dict[Tuple[str, int, int], Optional[CalibrationConfig]]
+
+    def __init__(self, calibrations: Dict[str, CalibrationConfig]) -> None:
+        self.calibrations = calibrations
+        self._resolved = {}
+
+    def __len__(self) -> int:
+        return len(self.calibrations)
+
+    def get(self, name: str, width: int, height: int) -> Optional[CalibrationConfig]:
+        key = (name, width, height)
+        if key not in self._resolved:
+            self._resolved[key] = self._resolve(name, width, height)
+        return self._resolved[key]
+
+    def _resolve(self, name: str, width: int, height: int) -> Optional[CalibrationConfig]:
+        if name != "":
+            if name not in self.calibrations:
+                print("Calibration \"" + name + "\" not found")
+                return None
+            candidates = { name: self.calibrations[name] }
+        else:
+            candidates = self.calibrations
+
+        for calibration in candidates.values():
+            if calibration.width > 0 and calibration.width == width and calibration.height == height:
+                return calibration
+
+        scalable = [calibration for calibration in candidates.values() if calibration.width > 0 and calibration.height > 0 and abs(calibration.width / calibration.height - width / height) < self.ASPECT_TOLERANCE]
+        if len(scalable) > 0:
+            source = max(scalable, key = lambda calibration: calibration.width)
+            print("Scaling calibration from " + str(source.width) + "x" + str(source.height) + " to " + str(width) + "x" + str(height))
+            return self._scale(source, width, height)
+
+        # A calibration saved without its resolution, such as the old single "default" one, may have come from any aspect
+        # ratio, so it is only used once its width and height are added to the file
+        for calibration_name, calibration in candidates.items():
+            if calibration.width <= 0 or calibration.height <= 0:
+                print("Not using calibration \"" + calibration_name + "\", add the resolution it was taken at to use it")
+
+        print("Refusing calibration for " + str(width) + "x" + str(height) + ": no calibration with a matching aspect ratio")
+        return None
+
+    def _scale(self, calibration: CalibrationConfig, width: int, height: int) -> CalibrationConfig:
+        scale_x = width / calibration.width
+        scale_y = height / calibration.height
+        distortion_matrix = numpy.array(calibration.distortion_matrix, dtype = numpy.float64)
+        distortion_matrix[0, 0] *= scale_x
+        distortion_matrix[0, 1] *= scale_x
+        distortion_matrix[0, 2] = (distortion_matrix[0, 2] + 0.5) * scale_x - 0.5
+        distortion_matrix[1, 1] *= scale_y
+        distortion_matrix[1, 2] = (distortion_matrix[1, 2] + 0.5) * scale_y - 0.5
+        return CalibrationConfig(distortion_matrix, calibration.distortion_coefficients, width, height)
 
 class CalibrationConfigLoader:
     FILENAME = "calibration_config.json"
+    NAME_PATTERN = re.compile("^[A-Za-z_][A-Za-z0-9_-]*$")
 
-    def load(self) -> CalibrationConfig:
-        config = CalibrationConfig(numpy.array([]), numpy.array([]))
-        file = cv2.FileStorage(self.FILENAME, cv2.FILE_STORAGE_READ)
-        config.distortion_matrix = file.getNode("distortion_matrix").mat()
-        config.distortion_coefficients = file.getNode("distortion_coefficients").mat()
-        return config
-    
-    def write(self, distortion_matrix: cv2.typing.MatLike, distortion_coefficients: cv2.typing.MatLike) -> None:
-        file = cv2.FileStorage(self.FILENAME, cv2.FILE_STORAGE_WRITE)
+    _filename: str
+
+    def __init__(self, filename: str = FILENAME) -> None:
+        self._filename = filename
+
+    def load(self) -> CalibrationConfigSet:
+        calibrations: Dict[str, CalibrationConfig] = {}
+        if not os.path.exists(self._filename):
+            return CalibrationConfigSet(calibrations)
+
+        file = cv2.FileStorage(self._filename, cv2.FILE_STORAGE_READ)
+        if not file.getNode("distortion_matrix").empty():
+            calibrations["default"] = self._read_calibration(file.root())
+
+        calibrations_node = file.getNode("calibrations")
+        if not calibrations_node.empty():
+            for name in calibrations_node.keys():
+                calibrations[name] = self._read_calibration(calibrations_node.getNode(name))
+
+        file.release()
+        return CalibrationConfigSet(calibrations)
+
+    def write(self, distortion_matrix: cv2.typing.MatLike, distortion_coefficients: cv2.typing.MatLike, width: int, height: int, name: str = "", rms: float = math.nan, view_errors: Sequence[float] = ()) -> None:
+        if name == "":
+            name = "mode_" + str(width) + "x" + str(height)
+        if not self.NAME_PATTERN.match(name):
+            print("Invalid calibration name \"" + name + "\"")
+            return
+
+        calibrations = self.load().calibrations
+        calibrations[name] = CalibrationConfig(distortion_matrix, distortion_coefficients, width, height, rms, list(view_errors))
+
+        file = cv2.FileStorage(self._filename, cv2.FILE_STORAGE_WRITE)
         file.write("date", str(datetime.datetime.now()))
-        file.write("distortion_matrix", distortion_matrix)
-        file.write("distortion_coefficients", distortion_coefficients)
+        file.startWriteStruct("calibrations", cv2.FileNode_MAP)
+        for calibration_name, calibration in calibrations.items():
+            file.startWriteStruct(calibration_name, cv2.FileNode_MAP)
+            file.write("width", calibration.width)
+            file.write("height", calibration.height)
+            file.write("distortion_matrix", calibration.distortion_matrix)
+            file.write("distortion_coefficients", calibration.distortion_coefficients)
+            if not math.isnan(calibration.rms):
+                file.write("rms", calibration.rms)
+            if len(calibration.view_errors) > 0:
+                errors = numpy.array(calibration.view_errors)
+                file.write("view_errors", errors)
+                file.write("view_error_mean", float(errors.mean()))
+                file.write("view_error_max", float(errors.max()))
+            file.endWriteStruct()
+        file.endWriteStruct()
         file.release()
 
-    def remove_config (self) -> None:
-        if os.path.exists(self.FILENAME):
-            os.remove(self.FILENAME)
+    def _read_calibration(self, node: cv2.FileNode) -> CalibrationConfig:
+        config = CalibrationConfig(numpy.array([]), numpy.array([]))
+        config.distortion_matrix = node.getNode("distortion_matrix").mat()
+        config.distortion_coefficients = node.getNode("distortion_coefficients").mat()
+        if not node.getNode("width").empty() and not node.getNode("height").empty():
+            config.width = int(node.getNode("width").real())
+            config.height = int(node.getNode("height").real())
+        if not node.getNode("rms").empty():
+            config.rms = node.getNode("rms").real()
+        if not node.getNode("view_errors").empty():
+            config.view_errors = node.getNode("view_errors").mat().ravel().tolist()
+        return config
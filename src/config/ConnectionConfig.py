@@ -1,20 +1,69 @@
 from dataclasses import dataclass
 import json
+from typing import Any, Dict, List
 
 @dataclass
 class ConnectionConfig:
     name: str
     nt_uri: str
     video_port: int
+    runner: str
+    max_stream_clients: int
+    device_path: str
+    calibration_file: str
+    recording_directory: str
+    log_directory: str
+    log_retention_bytes: int
+    snapshot_directory: str
+    h264_bitrate: int
+    h264_keyframe_interval: int
+    cache_directory: str
+    profile_directory: str
+    profile_mode: str
 
 class ConnectionConfigLoader:
     FILENAME = "connection_config.json"
 
     def load(self) -> ConnectionConfig:
-        config = ConnectionConfig("", "", 0)
+        return self.load_all()[0]
+
+    def load_all(self) -> List[ConnectionConfig]:
         with open(self.FILENAME) as file:
             parsed_file = json.loads(file.read())
-            config.name = parsed_file["name"]
-            config.nt_uri = parsed_file["nt_uri"]
-            config.video_port = parsed_file["video_port"]
+            if isinstance(parsed_file, list):
+                return [self._parse(parsed_camera) for parsed_camera in parsed_file]
+            else:
+                return [self._parse(parsed_file)]
+
+    def _parse(self, parsed_file: Dict[str, Any]) -> ConnectionConfig:
+        config = ConnectionConfig("", "", 0, "sequential", 8, "", "calibration_config.json", "recordings", "logs", 256 * 1024 * 1024, "calibration_snapshots", 1000, 30, "cache", "profiles", "sampling")
+        config.name = parsed_file["name"]
+        config.nt_uri = parsed_file["nt_uri"]
+        config.video_port = parsed_file["video_port"]
+        if "runner" in parsed_file:
+            config.runner = parsed_file["runner"]
+        if "max_stream_clients" in parsed_file:
+            config.max_stream_clients = parsed_file["max_stream_clients"]
+        if "device_path" in parsed_file:
+            config.device_path = parsed_file["device_path"]
+        if "calibration_file" in parsed_file:
+            config.calibration_file = parsed_file["calibration_file"]
+        if "recording_directory" in parsed_file:
+            config.recording_directory = parsed_file["recording_directory"]
+        if "log_directory" in parsed_file:
+            config.log_directory = parsed_file["log_directory"]
+        if "log_retention_bytes" in parsed_file:
+            config.log_retention_bytes = parsed_file["log_retention_bytes"]
+        if "snapshot_directory" in parsed_file:
+            config.snapshot_directory = parsed_file["snapshot_directory"]
+        if "h264_bitrate" in parsed_file:
+            config.h264_bitrate = parsed_file["h264_bitrate"]
+        if "h264_keyframe_interval" in parsed_file:
+            config.h264_keyframe_interval = parsed_file["h264_keyframe_interval"]
+        if "cache_directory" in parsed_file:
+            config.cache_directory = parsed_file["cache_directory"]
+        if "profile_directory" in parsed_file:
+            config.profile_directory = parsed_file["profile_directory"]
+        if "profile_mode" in parsed_file:
+            config.profile_mode = parsed_file["profile_mode"]
         return config
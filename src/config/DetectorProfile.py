@@ -0,0 +1,104 @@
+import cv2
+from dataclasses import asdict, dataclass, fields
+import json
+import os
+from typing import Any, Dict
+
+@dataclass(frozen = True)
+class DetectorProfile:
+    adaptive_thresh_win_size_min: int = 3
+    adaptive_thresh_win_size_max: int = 23
+    adaptive_thresh_win_size_step: int = 10
+    min_marker_perimeter_rate: float = 0.03
+    max_marker_perimeter_rate: float = 4.0
+    corner_refinement_method: str = "none"
+    polygonal_approx_accuracy_rate: float = 0.03
+
+    def window_sizes(self) -> int:
+        # detectMarkers thresholds the whole image once per window size, which dominates its run time
+        return max((self.adaptive_thresh_win_size_max - self.adaptive_thresh_win_size_min) // max(self.adaptive_thresh_win_size_step, 1) + 1, 1)
+
+    def to_parameters(self) -> cv2.aruco.DetectorParameters:
+        parameters = cv2.aruco.DetectorParameters()
+        parameters.adaptiveThreshWinSizeMin = self.adaptive_thresh_win_size_min
+        parameters.adaptiveThreshWinSizeMax = self.adaptive_thresh_win_size_max
+        parameters.adaptiveThreshWinSizeStep = self.adaptive_thresh_win_size_step
+        parameters.minMarkerPerimeterRate = self.min_marker_perimeter_rate
+        parameters.maxMarkerPerimeterRate = self.max_marker_perimeter_rate
+        parameters.cornerRefinementMethod = CORNER_REFINEMENT_METHODS[self.corner_refinement_method]
+        parameters.polygonalApproxAccuracyRate = self.polygonal_approx_accuracy_rate
+        return parameters
+
+CORNER_REFINEMENT_METHODS = {
+    "none": cv2.aruco.CORNER_REFINE_NONE,
+    "subpix": cv2.aruco.CORNER_REFINE_SUBPIX,
+    "contour": cv2.aruco.CORNER_REFINE_CONTOUR,
+    "apriltag": cv2.aruco.CORNER_REFINE_APRILTAG
+}
+
+# "default" matches cv2.aruco.DetectorParameters(). The others trade threshold window sizes and the smallest
+# accepted tag for speed, or spend more time for tags that are small, dim or unevenly lit.
+BUILTIN_PROFILES = {
+    "default": DetectorProfile(),
+    "fast": DetectorProfile(
+        adaptive_thresh_win_size_min = 5,
+        adaptive_thresh_win_size_max = 15,
+        adaptive_thresh_win_size_step = 10,
+        min_marker_perimeter_rate = 0.05,
+        polygonal_approx_accuracy_rate = 0.05
+    ),
+    "single_window": DetectorProfile(
+        adaptive_thresh_win_size_min = 13,
+        adaptive_thresh_win_size_max = 13,
+        adaptive_thresh_win_size_step = 10,
+        min_marker_perimeter_rate = 0.05,
+        polygonal_approx_accuracy_rate = 0.05
+    ),
+    "accurate": DetectorProfile(
+        adaptive_thresh_win_size_min = 3,
+        adaptive_thresh_win_size_max = 33,
+        adaptive_thresh_win_size_step = 5,
+        min_marker_perimeter_rate = 0.02,
+        corner_refinement_method = "subpix"
+    )
+}
+
+class DetectorProfileLoader:
+    FILENAME = "detector_profiles.json"
+
+    _filename: str
+
+    def __init__(self, filename: str = FILENAME) -> None:
+        self._filename = filename
+
+    def load(self) -> Dict[str, DetectorProfile]:
+        # Profiles in the file are added to the built in ones and replace them when the names match
+        profiles = dict(BUILTIN_PROFILES)
+        for name, values in self._read().items():
+            try:
+                profiles[name] = self._parse(values)
+            except (KeyError, TypeError, ValueError) as error:
+                print("Ignoring detector profile \"" + name + "\": " + str(error))
+        return profiles
+
+    def write(self, name: str, profile: DetectorProfile) -> None:
+        profiles = self._read()
+        profiles[name] = asdict(profile)
+        with open(self._filename, "w") as file:
+            file.write(json.dumps(profiles, indent = 4))
+
+    def _read(self) -> Dict[str, Any]:
+        if not os.path.exists(self._filename):
+            return {}
+        with open(self._filename) as file:
+            return json.loads(file.read())
+
+    def _parse(self, values: Dict[str, Any]) -> DetectorProfile:
+        names = { field.name for field in fields(DetectorProfile) }
+        unknown = [key for key in values.keys() if key not in names]
+        if len(unknown) > 0:
+            raise KeyError("unknown parameters " + ", ".join(unknown))
+        profile = DetectorProfile(**values)
+        if profile.corner_refinement_method not in CORNER_REFINEMENT_METHODS:
+            raise ValueError("unknown corner refinement method \"" + profile.corner_refinement_method + "\"")
+        return profile
@@ -1,9 +1,15 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, fields, replace
 import json
 import ntcore
-from typing import List
+import numpy
+import numpy.typing
+import os
+import threading
+from typing import Any, Dict, List, Optional, Set
+from wpimath.geometry import Pose3d, Rotation3d, Translation3d
 
 from config.ConnectionConfig import ConnectionConfig
+import pipeline.PoseMath as PoseMath
 
 @dataclass
 class NTConfigTag:
@@ -15,95 +21,278 @@ class NTConfigTag:
     ry: float
     rz: float
 
-@dataclass
+class NTConfigTagLayout:
+    source: str
+    tag_size: float
+    tags: List[NTConfigTag]
+    index: Dict[int, int]
+    matrices: numpy.typing.NDArray[numpy.float64]
+    object_points: numpy.typing.NDArray[numpy.float64]
+    tag_object_points: numpy.typing.NDArray[numpy.float64]
+
+    def __init__(self, source: str, tag_size: float) -> None:
+        self.source = source
+        self.tag_size = tag_size
+        try:
+            self.tags = [NTConfigTag(tag["id"], tag["x"], tag["y"], tag["z"], tag["rx"], tag["ry"], tag["rz"]) for tag in json.loads(source)]
+        except:
+            self.tags = []
+
+        self.index = {}
+        matrices: List[numpy.typing.NDArray[numpy.float64]] = []
+        for tag in self.tags:
+            matrix = PoseMath.from_pose(Pose3d(Translation3d(tag.x, tag.y, tag.z), Rotation3d(tag.rx, tag.ry, tag.rz)))
+            if tag.id in self.index:
+                matrices[self.index[tag.id]] = matrix
+            else:
+                self.index[tag.id] = len(matrices)
+                matrices.append(matrix)
+        self.matrices = numpy.array(matrices).reshape(-1, 4, 4)
+
+        corners = numpy.array([
+            [0.0, tag_size / 2.0, -tag_size / 2.0, 1.0],
+            [0.0, -tag_size / 2.0, -tag_size / 2.0, 1.0],
+            [0.0, -tag_size / 2.0, tag_size / 2.0, 1.0],
+            [0.0, tag_size / 2.0, tag_size / 2.0, 1.0]
+        ])
+        self.object_points = (corners @ self.matrices.transpose(0, 2, 1))[:, :, :3] @ PoseMath.OPENCV_TO_WPILIB
+
+        self.tag_object_points = numpy.array([
+            [-tag_size / 2.0, tag_size / 2.0, 0.0],
+            [tag_size / 2.0, tag_size / 2.0, 0.0],
+            [tag_size / 2.0, -tag_size / 2.0, 0.0],
+            [-tag_size / 2.0, -tag_size / 2.0, 0.0]
+        ])
+
+    def __len__(self) -> int:
+        return len(self.matrices)
+
+@dataclass(frozen = True)
 class NTConfig:
     device_path: str
     height: int
     width: int 
+    pixel_format: str
+    calibration_name: str
     auto_exposure: int
     absolute_exposure: int
     gain: int
     camera_position: List[float]
     error_ambiguity: float
+    temporal_pose: bool
+    temporal_max_error: float
+    temporal_timeout: float
     tag_size: float
     tag_family: str
-    tag_layout: List[NTConfigTag]
+    detector_profile: str
+    decimation: int
+    roi_tracking: bool
+    roi_padding: float
+    roi_refresh_interval: int
+    tag_layout: NTConfigTagLayout
     debug_tag: int
     field_size: List[float]
     field_margin: List[float]
+    recording: bool
+    profile: bool
+    profile_seconds: float
+    version: int = 0
+
+    def changed_fields(self, previous: Optional["NTConfig"]) -> Set[str]:
+        # NTConfigUpdater hands back the same snapshot until a topic changes, which makes the common case free.
+        # Snapshots made any other way, such as with dataclasses.replace, can share a version and are compared.
+        if previous is None:
+            return { field.name for field in fields(self) }
+        elif previous is self:
+            return set()
+        else:
+            return { field.name for field in fields(self) if field.name != "version" and getattr(self, field.name) != getattr(previous, field.name) }
 
 def generate_default() -> NTConfig:
     return NTConfig(
         device_path = "/dev/video0",
         height = 1200,
         width = 1600,
+        pixel_format = "BGR",
+        calibration_name = "",
         auto_exposure = 1,
         absolute_exposure = 10,
         gain = 25,
         camera_position = [0.0, 0.0, 0.0, 0.0, 0.0, 0.0],
         error_ambiguity = 0.15,
+        temporal_pose = False,
+        temporal_max_error = 1.0,
+        temporal_timeout = 0.5,
         tag_size = 0.1524,
         tag_family = "16h5",
-        tag_layout = [],
+        detector_profile = "default",
+        decimation = 1,
+        roi_tracking = False,
+        roi_padding = 0.5,
+        roi_refresh_interval = 10,
+        tag_layout = NTConfigTagLayout("[]", 0.1524),
         debug_tag = 9,
         field_size = [16.5417, 8.0136, 0.0],
-        field_margin = [0.5, 0.5, 0.75]
+        field_margin = [0.5, 0.5, 0.75],
+        recording = False,
+        profile = False,
+        profile_seconds = 10.0
     )
 
+def serialize(nt_config: NTConfig) -> str:
+    values: Dict[str, Any] = { field.name: getattr(nt_config, field.name) for field in fields(nt_config) }
+    values["tag_layout"] = nt_config.tag_layout.source
+    return json.dumps(values)
+
+def deserialize(source: str) -> NTConfig:
+    default = generate_default()
+    values: Dict[str, Any] = json.loads(source)
+    changes = { field.name: values[field.name] for field in fields(default) if field.name in values and field.name != "tag_layout" }
+    changes["tag_layout"] = NTConfigTagLayout(values.get("tag_layout", "[]"), changes.get("tag_size", default.tag_size))
+    return replace(default, **changes)
+
 class NTConfigUpdater:
+    TOPICS = {
+        "device_path": "devicePath",
+        "height": "height",
+        "width": "width",
+        "pixel_format": "pixelFormat",
+        "calibration_name": "calibrationName",
+        "auto_exposure": "autoExposure",
+        "absolute_exposure": "absoluteExposure",
+        "gain": "gain",
+        "camera_position": "cameraPosition",
+        "error_ambiguity": "errorAmbiguity",
+        "temporal_pose": "temporalPose",
+        "temporal_max_error": "temporalMaxError",
+        "temporal_timeout": "temporalTimeout",
+        "tag_size": "tagSize",
+        "tag_family": "tagFamily",
+        "detector_profile": "detectorProfile",
+        "decimation": "decimation",
+        "roi_tracking": "roiTracking",
+        "roi_padding": "roiPadding",
+        "roi_refresh_interval": "roiRefreshInterval",
+        "tag_layout": "tagLayout",
+        "debug_tag": "debugTag",
+        "field_size": "fieldSize",
+        "field_margin": "fieldMargin",
+        "recording": "recording",
+        "profile": "profile",
+        "profile_seconds": "profileSeconds"
+    }
+
     _connection_config: ConnectionConfig
-    _subbed: bool = False
-    _device_path: ntcore.StringSubscriber
-    _height: ntcore.IntegerSubscriber
-    _width: ntcore.IntegerSubscriber
-    _auto_exposure: ntcore.IntegerSubscriber
-    _absolute_exposure: ntcore.IntegerSubscriber
-    _gain: ntcore.IntegerSubscriber
-    _camera_position: ntcore.DoubleArraySubscriber
-    _error_ambiguity: ntcore.DoubleSubscriber
-    _tag_size: ntcore.DoubleSubscriber
-    _tag_family: ntcore.StringSubscriber
-    _tag_layout: ntcore.StringSubscriber
-    _debug_tag: ntcore.IntegerSubscriber
-    _field_size: ntcore.DoubleArraySubscriber
-    _field_margin: ntcore.DoubleArraySubscriber
+    _poller: Optional[ntcore.NetworkTableListenerPoller] = None
+    _subscribers: Dict[str, Any]
+    _fields: Dict[str, str]
 
     def __init__(self, connection_config: ConnectionConfig) -> None:
         self._connection_config = connection_config
+        self._subscribers = {}
+        self._fields = {}
 
-    def update(self, nt_config: NTConfig) -> None:
-        if not self._subbed:
-            table = ntcore.NetworkTableInstance.getDefault().getTable("/Blacklight-" + self._connection_config.name + "/config")
-            self._device_path = table.getStringTopic("devicePath").subscribe(nt_config.device_path)
-            self._height = table.getIntegerTopic("height").subscribe(nt_config.height)
-            self._width = table.getIntegerTopic("width").subscribe(nt_config.width)
-            self._auto_exposure = table.getIntegerTopic("autoExposure").subscribe(nt_config.auto_exposure)
-            self._absolute_exposure = table.getIntegerTopic("absoluteExposure").subscribe(nt_config.absolute_exposure)
-            self._gain = table.getIntegerTopic("gain").subscribe(nt_config.gain)
-            self._camera_position = table.getDoubleArrayTopic("cameraPosition").subscribe(nt_config.camera_position)
-            self._error_ambiguity = table.getDoubleTopic("errorAmbiguity").subscribe(nt_config.error_ambiguity)
-            self._tag_size = table.getDoubleTopic("tagSize").subscribe(nt_config.tag_size)
-            self._tag_family = table.getStringTopic("tagFamily").subscribe(nt_config.tag_family)
-            self._tag_layout = table.getStringTopic("tagLayout").subscribe(json.dumps(nt_config.tag_layout))
-            self._debug_tag = table.getIntegerTopic("debugTag").subscribe(nt_config.debug_tag)
-            self._field_size = table.getDoubleArrayTopic("fieldSize").subscribe(nt_config.field_size)
-            self._field_margin = table.getDoubleArrayTopic("fieldMargin").subscribe(nt_config.field_margin)
-            self._subbed = True
-
-        nt_config.device_path = self._device_path.get()
-        nt_config.height = self._height.get()
-        nt_config.width = self._width.get()
-        nt_config.auto_exposure = self._auto_exposure.get()
-        nt_config.absolute_exposure = self._absolute_exposure.get()
-        nt_config.gain = self._gain.get()
-        nt_config.camera_position = self._camera_position.get()
-        nt_config.error_ambiguity = self._error_ambiguity.get()
-        nt_config.tag_size = self._tag_size.get()
-        nt_config.tag_family = self._tag_family.get()
+    def update(self, nt_config: NTConfig) -> NTConfig:
+        # Returns nt_config itself until a topic changes, then a new snapshot with the next version
+        if self._poller == None:
+            instance = ntcore.NetworkTableInstance.getDefault()
+            table = instance.getTable("/Blacklight-" + self._connection_config.name + "/config")
+            self._poller = ntcore.NetworkTableListenerPoller(instance)
+            for field, topic in self.TOPICS.items():
+                subscriber = self._subscribe(table, topic, getattr(nt_config, field))
+                self._subscribers[field] = subscriber
+                self._fields[subscriber.getTopic().getName()] = field
+                self._poller.addListener(subscriber, ntcore.EventFlags.kValueAll | ntcore.EventFlags.kImmediate)
+
+        changes: Dict[str, Any] = {}
+        for event in self._poller.readQueue():
+            if isinstance(event.data, ntcore.ValueEventData):
+                field = self._fields.get(event.data.topic.getName())
+                if field != None:
+                    changes[field] = self._subscribers[field].get()
+        if len(changes) == 0:
+            return nt_config
+
+        tag_layout = changes.pop("tag_layout", nt_config.tag_layout.source)
+        tag_size = changes.get("tag_size", nt_config.tag_size)
+        if tag_layout != nt_config.tag_layout.source or tag_size != nt_config.tag_layout.tag_size:
+            changes["tag_layout"] = NTConfigTagLayout(tag_layout, tag_size)
+
+        changes = { field: value for field, value in changes.items() if getattr(nt_config, field) != value }
+        if len(changes) == 0:
+            return nt_config
+
+        print("NT config changed: " + ", ".join(sorted(changes.keys())))
+        return replace(nt_config, version = nt_config.version + 1, **changes)
+
+    def _subscribe(self, table: ntcore.NetworkTable, topic: str, default: Any) -> Any:
+        if isinstance(default, NTConfigTagLayout):
+            return table.getStringTopic(topic).subscribe(default.source)
+        elif isinstance(default, bool):
+            return table.getBooleanTopic(topic).subscribe(default)
+        elif isinstance(default, int):
+            return table.getIntegerTopic(topic).subscribe(default)
+        elif isinstance(default, float):
+            return table.getDoubleTopic(topic).subscribe(default)
+        elif isinstance(default, str):
+            return table.getStringTopic(topic).subscribe(default)
+        else:
+            return table.getDoubleArrayTopic(topic).subscribe(default)
+
+class NTConfigCache:
+    # Keeps the last applied config on disk, so that after a restart the pipeline can run with it before NT connects.
+    # Writes happen on their own thread and replace the file in one step, so a power loss never leaves half a file.
+    _filename: str
+    _lock: threading.Lock
+    _pending: Optional[NTConfig] = None
+    _written: Optional[NTConfig] = None
+    _event: threading.Event
+
+    def __init__(self, connection_config: ConnectionConfig) -> None:
+        self._filename = os.path.join(connection_config.cache_directory, "Blacklight-" + connection_config.name + ".json") if connection_config.cache_directory != "" else ""
+        self._lock = threading.Lock()
+        self._event = threading.Event()
+        if self._filename != "":
+            threading.Thread(target = self._write_loop, daemon = True, name = "config-cache").start()
+
+    def load(self) -> Optional[NTConfig]:
+        if self._filename == "" or not os.path.exists(self._filename):
+            return None
         try:
-            nt_config.tag_layout = json.loads(self._tag_layout.get())
-        except:
-            nt_config.tag_layout = []
-        nt_config.debug_tag = self._debug_tag.get()
-        nt_config.field_size = self._field_size.get()
-        nt_config.field_margin = self._field_margin.get()
+            with open(self._filename) as file:
+                nt_config = deserialize(file.read())
+        except (OSError, ValueError, TypeError, AttributeError) as error:
+            print("Ignoring config cache " + self._filename + ": " + str(error))
+            return None
+
+        # Recording and profiling have to be turned on again from NT
+        self._written = replace(nt_config, recording = False, profile = False)
+        return self._written
+
+    def update(self, nt_config: NTConfig) -> None:
+        if self._filename == "" or nt_config is self._written or nt_config is self._pending:
+            return
+        with self._lock:
+            self._pending = nt_config
+        self._event.set()
+
+    def _write_loop(self) -> None:
+        while True:
+            self._event.wait()
+            self._event.clear()
+            with self._lock:
+                nt_config = self._pending
+            if nt_config == None or nt_config is self._written:
+                continue
+
+            try:
+                os.makedirs(os.path.dirname(self._filename) or ".", exist_ok = True)
+                temporary = self._filename + ".tmp"
+                with open(temporary, "w") as file:
+                    file.write(serialize(nt_config))
+                    file.flush()
+                    os.fsync(file.fileno())
+                os.replace(temporary, self._filename)
+                self._written = nt_config
+            except OSError as error:
+                print("Unable to write config cache " + self._filename + ": " + str(error))
@@ -1,9 +1,14 @@
 import cv2
 import cv2.typing
-from typing import Sequence, Optional
+import numpy
+from typing import List, Sequence, Optional
+
+from pipeline.ApriltagDetector import ApriltagDetection
 
 class OverlayMarkers:
-    def add_detections(self, capture: cv2.typing.MatLike, corners: Sequence[cv2.typing.MatLike], ids: cv2.typing.MatLike) -> None:
+    def add_detections(self, capture: cv2.typing.MatLike, detections: List[ApriltagDetection], scale: float) -> None:
+        corners = [(detection.corners * scale).astype(numpy.float32) for detection in detections]
+        ids = numpy.array([[detection.id] for detection in detections], dtype = numpy.int32)
         cv2.aruco.drawDetectedMarkers(capture, corners, ids)
 
     def add_charuco_detection(self, capture: cv2.typing.MatLike, charuco_corners: Optional[cv2.typing.MatLike], charuco_ids: Optional[cv2.typing.MatLike], marker_corners: Optional[Sequence[cv2.typing.MatLike]], marker_ids: Optional[cv2.typing.MatLike]) -> None:
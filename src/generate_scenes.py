@@ -0,0 +1,89 @@
+import argparse
+import cv2
+from dataclasses import replace
+import json
+import numpy
+import os
+from typing import Any, Dict, List
+from wpimath.geometry import Pose3d
+
+from config.CalibrationConfig import CalibrationConfigLoader
+from config.NTConfig import NTConfigTagLayout, generate_default, serialize
+from synthetic.SceneGenerator import SceneGenerator
+
+def to_list(pose: Pose3d) -> List[float]:
+    return [pose.X(), pose.Y(), pose.Z(), pose.rotation().X(), pose.rotation().Y(), pose.rotation().Z()]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Render tags from a tag layout at random camera poses, with ground truth")
+    parser.add_argument("layout", help = "tag layout JSON, in the same format as the tagLayout topic")
+    parser.add_argument("output", help = "directory for the images and ground_truth.json")
+    parser.add_argument("--calibration", default = CalibrationConfigLoader.FILENAME)
+    parser.add_argument("--calibration-name", default = "")
+    parser.add_argument("--width", type = int, default = 1600)
+    parser.add_argument("--height", type = int, default = 1200)
+    parser.add_argument("--tag-size", type = float, default = 0.1524)
+    parser.add_argument("--tag-family", default = "16h5")
+    parser.add_argument("--camera-position", type = float, nargs = 6, default = [0.0] * 6, metavar = ("X", "Y", "Z", "RX", "RY", "RZ"), help = "robot to camera transform")
+    parser.add_argument("--count", type = int, default = 100)
+    parser.add_argument("--min-distance", type = float, default = 1.0)
+    parser.add_argument("--max-distance", type = float, default = 6.0)
+    parser.add_argument("--max-angle", type = float, default = 0.8, help = "largest angle off a tag's axis to view it from, in radians")
+    parser.add_argument("--blur", type = float, default = 0.5, help = "Gaussian blur sigma in pixels")
+    parser.add_argument("--noise", type = float, default = 2.0, help = "Gaussian noise sigma in gray levels")
+    parser.add_argument("--seed", type = int, default = 0)
+    args = parser.parse_args()
+
+    calibration_config = CalibrationConfigLoader(args.calibration).load().get(args.calibration_name, args.width, args.height)
+    if calibration_config == None:
+        print("No calibration for " + str(args.width) + "x" + str(args.height))
+        exit(1)
+
+    with open(args.layout) as file:
+        layout = file.read()
+    nt_config = replace(
+        generate_default(),
+        width = args.width,
+        height = args.height,
+        calibration_name = args.calibration_name,
+        tag_size = args.tag_size,
+        tag_family = args.tag_family,
+        camera_position = args.camera_position,
+        tag_layout = NTConfigTagLayout(layout, args.tag_size)
+    )
+    if len(nt_config.tag_layout) == 0:
+        print("No tags in " + args.layout)
+        exit(1)
+
+    generator = SceneGenerator(calibration_config, nt_config, args.width, args.height)
+    rng = numpy.random.default_rng(args.seed)
+    os.makedirs(args.output, exist_ok = True)
+
+    frames: List[Dict[str, Any]] = []
+    while len(frames) < args.count:
+        camera_pose = generator.sample_camera_pose(rng, args.min_distance, args.max_distance, args.max_angle)
+        image, truth = generator.render(camera_pose, args.blur, args.noise, len(frames) + args.seed)
+        if len(truth) == 0:
+            continue
+
+        name = "scene_%04d.png" % len(frames)
+        cv2.imwrite(os.path.join(args.output, name), image)
+        frames.append({
+            "image": name,
+            "camera_pose": to_list(camera_pose),
+            "robot_pose": to_list(generator.robot_pose(camera_pose)),
+            "tags": [{ "id": int(tag.id), "corners": tag.corners.reshape(4, 2).tolist() } for tag in truth]
+        })
+
+    with open(os.path.join(args.output, "ground_truth.json"), "w") as file:
+        json.dump({
+            "calibration": {
+                "width": args.width,
+                "height": args.height,
+                "distortion_matrix": numpy.asarray(calibration_config.distortion_matrix).tolist(),
+                "distortion_coefficients": numpy.asarray(calibration_config.distortion_coefficients).ravel().tolist()
+            },
+            "nt_config": json.loads(serialize(nt_config)),
+            "frames": frames
+        }, file, indent = 1)
+    print("Wrote " + str(len(frames)) + " scenes to " + args.output)
@@ -21,88 +21,104 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import replace
 import ntcore
 import time
-from typing import Optional
 
-from calibration.CalibrationSession import CalibrationSession
 from calibration.NTCalibrationController import NTCalibrationController
 from config.CalibrationConfig import CalibrationConfigLoader
-from config.ConnectionConfig import ConnectionConfigLoader
-from config.NTConfig import NTConfigUpdater, generate_default
+from config.ConnectionConfig import ConnectionConfig, ConnectionConfigLoader
+from config.DetectorProfile import DetectorProfileLoader
+from config.NTConfig import NTConfig, NTConfigCache, NTConfigUpdater, generate_default
 from pipeline.ApriltagDetector import ApriltagDetector
+from pipeline.BinaryLog import BinaryLog
 from pipeline.Camera import Camera
+from pipeline.FrameRecorder import FrameRecorder
+from pipeline.LatencyMetrics import LatencyMetrics
 from pipeline.NTOutput import NTOutput
 from pipeline.PoseEstimator import PoseEstimator
+from pipeline.Profiler import Profiler
 from pipeline.StreamOutput import StreamOutput
-
-if __name__ == "__main__":
-    connection_config_loader = ConnectionConfigLoader()
-    connection_config = connection_config_loader.load()
-    print("Loaded connection config")
-
-    calibration_config_loader = CalibrationConfigLoader()
-    calibration_config = calibration_config_loader.load()
-    print("Loaded calibration config")
-
-    nt_config_updater = NTConfigUpdater(connection_config)
-    nt_config = generate_default()
-    print("Generated NT config")
-
-    calibration_controller = NTCalibrationController(connection_config)
-    calibration_session: Optional[CalibrationSession] = None
-
-    camera = Camera()
-    apriltag_detector = ApriltagDetector()
-    pose_estimator = PoseEstimator()
-    nt_output = NTOutput(connection_config)
-    stream_output = StreamOutput()
-
+from runner.PipelinedRunner import PipelinedRunner
+from runner.Runner import Runner, RunnerComponents
+from runner.SequentialRunner import SequentialRunner
+
+def build_detector(nt_config: NTConfig) -> ApriltagDetector:
+    detector_profiles = DetectorProfileLoader().load()
+    print("Loaded " + str(len(detector_profiles)) + " detector profiles")
+    apriltag_detector = ApriltagDetector(detector_profiles)
+    apriltag_detector.warm_up(nt_config)
+    print("Warmed up detector")
+    return apriltag_detector
+
+def run(connection_config: ConnectionConfig) -> None:
+    start = time.perf_counter()
+
+    # NT and the stream server run on their own threads, so they connect while the rest of startup happens
     ntcore.NetworkTableInstance.getDefault().setServer(connection_config.nt_uri)
     ntcore.NetworkTableInstance.getDefault().startClient4("Blacklight-" + connection_config.name)
     print("Started NT Client")
 
+    metrics = LatencyMetrics()
+    profiler = Profiler(connection_config)
+    stream_output = StreamOutput(metrics, profiler)
     stream_output.start_server(connection_config)
     print("Started stream server")
 
-    fps = 0
-    frames = 0
-    last_frame_print = 0
-    while True:
-        nt_config_updater.update(nt_config)
-
-        timestamp = time.time()
-        cam_success, capture = camera.read(nt_config)
-
-        if not cam_success:
-            print("Unable to capture frame")
-            time.sleep(0.5)
-            continue
-
-        frames += 1
-        if timestamp - last_frame_print > 1:
-            fps = frames
-            frames = 0
-            print("Pipeline running at " + str(fps) + " fps")
-            last_frame_print = timestamp
-
-        if calibration_controller.is_calibrating():
-            if calibration_session == None:
-                calibration_session = CalibrationSession(12, 9, 0.030, 0.023)
-
-            calibration_session.intake_frame(capture, calibration_controller.should_snap())
-        else:
-            if calibration_session != None:
-                calibration_session.save_to_file(calibration_config_loader)
-                calibration_session = None
-
-            if len(calibration_config.distortion_coefficients) > 0 and len(calibration_config.distortion_matrix) > 0:
-                detections = apriltag_detector.search(capture, nt_config)
-                pose_estimation = pose_estimator.get_estimated_pose(detections, calibration_config, nt_config)
-                debug_pose_estimation = pose_estimator.get_estimated_debug_pose(detections, calibration_config, nt_config)
-                nt_output.update(timestamp, fps, pose_estimation, debug_pose_estimation)
-            else:
-                print("No calibration found")
-                time.sleep(0.5)
-
-        stream_output.update(capture)
+    # The last applied config is used until NT says otherwise, so the camera opens with the right settings and
+    # poses can be estimated with the right tag layout before NT connects
+    nt_config_cache = NTConfigCache(connection_config)
+    cached_config = nt_config_cache.load()
+    if cached_config != None:
+        nt_config = cached_config
+        print("Loaded cached NT config with " + str(len(nt_config.tag_layout)) + " tags")
+    else:
+        nt_config = generate_default()
+        print("Generated NT config")
+    if connection_config.device_path != "":
+        nt_config = replace(nt_config, device_path = connection_config.device_path)
+
+    calibration_config_loader = CalibrationConfigLoader(connection_config.calibration_file)
+    camera = Camera()
+    with ThreadPoolExecutor(max_workers = 3, thread_name_prefix = "startup") as startup:
+        camera_started = startup.submit(camera.open, nt_config)
+        calibration_configs = startup.submit(calibration_config_loader.load)
+        apriltag_detector = startup.submit(build_detector, nt_config)
+    camera_started.result()
+    print("Loaded " + str(len(calibration_configs.result())) + " calibration configs")
+
+    components = RunnerComponents(
+        connection_config = connection_config,
+        calibration_config_loader = calibration_config_loader,
+        calibration_configs = calibration_configs.result(),
+        nt_config_updater = NTConfigUpdater(connection_config),
+        nt_config = nt_config,
+        nt_config_cache = nt_config_cache,
+        calibration_controller = NTCalibrationController(connection_config),
+        camera = camera,
+        apriltag_detector = apriltag_detector.result(),
+        pose_estimator = PoseEstimator(),
+        nt_output = NTOutput(connection_config),
+        stream_output = stream_output,
+        metrics = metrics,
+        frame_recorder = FrameRecorder(connection_config),
+        binary_log = BinaryLog(connection_config),
+        profiler = profiler
+    )
+
+    runner: Runner
+    if connection_config.runner == "pipelined":
+        runner = PipelinedRunner(components)
+    else:
+        runner = SequentialRunner(components)
+    print("Running " + connection_config.runner + " pipeline, started in %.2f s" % (time.perf_counter() - start))
+
+    runner.run()
+
+if __name__ == "__main__":
+    connection_config_loader = ConnectionConfigLoader()
+    connection_config = connection_config_loader.load()
+    print("Loaded connection config")
+
+    run(connection_config)
@@ -1,10 +1,11 @@
 import cv2
 import cv2.typing
 from dataclasses import dataclass
-from typing import List, Optional
+import numpy
+from typing import Dict, List, Optional
 
+from config.DetectorProfile import BUILTIN_PROFILES, DetectorProfile
 from config.NTConfig import NTConfig
-from filter.OverlayMarkers import OverlayMarkers
 
 @dataclass
 class ApriltagDetection:
@@ -12,26 +13,120 @@ class ApriltagDetection:
     corners: cv2.typing.MatLike
 
 class ApriltagDetector:
+    ROI_MIN_PADDING = 16
+    REFINE_CRITERIA = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.01)
+
     _config: Optional[NTConfig] = None
-    _detector = cv2.aruco.ArucoDetector(cv2.aruco.getPredefinedDictionary(cv2.aruco.DICT_ARUCO_ORIGINAL), cv2.aruco.DetectorParameters(), cv2.aruco.RefineParameters())
+    _profiles: Dict[str, DetectorProfile]
+    _detector: cv2.aruco.ArucoDetector
     _dictionary: Optional[cv2.aruco.Dictionary] = None
-    _overlay_markers = OverlayMarkers()
+    _tracked: List[ApriltagDetection]
+    _frames_since_full_search = 0
+
+    def __init__(self, profiles: Dict[str, DetectorProfile] = BUILTIN_PROFILES) -> None:
+        self._profiles = profiles
+        self._tracked = []
+        self._detector = cv2.aruco.ArucoDetector(cv2.aruco.getPredefinedDictionary(cv2.aruco.DICT_ARUCO_ORIGINAL), cv2.aruco.DetectorParameters(), cv2.aruco.RefineParameters())
+
+    def warm_up(self, nt_config: NTConfig) -> None:
+        # The first search builds the dictionary and allocates the threshold buffers, which is better done before frames arrive
+        self.search(numpy.zeros((nt_config.height, nt_config.width), numpy.uint8), nt_config)
 
     def search(self, capture: cv2.typing.MatLike, nt_config: NTConfig) -> List[ApriltagDetection]:
         self._update_config(nt_config)
 
         if (self._dictionary != None):
-            corners, ids, _ = self._detector.detectMarkers(capture)
-            self._overlay_markers.add_detections(capture, corners, ids)
-            if (len(corners) == 0):
-                return []
-            else:
-                return [ApriltagDetection(id[0], corner) for id, corner in zip(ids, corners)]
+            if nt_config.roi_tracking and len(self._tracked) > 0 and self._frames_since_full_search < nt_config.roi_refresh_interval:
+                detections: List[ApriltagDetection] = []
+                for x0, y0, x1, y1 in self._regions(capture, nt_config.roi_padding):
+                    detections += self._detect(capture[y0:y1, x0:x1], x0, y0, nt_config.decimation)
+
+                found_ids = [detection.id for detection in detections]
+                if all(tracked.id in found_ids for tracked in self._tracked):
+                    self._frames_since_full_search += 1
+                    self._tracked = detections
+                    return detections
+
+            self._frames_since_full_search = 0
+            self._tracked = self._detect(capture, 0, 0, nt_config.decimation)
+            return self._tracked
         else:
             return []
 
+    def _detect(self, image: cv2.typing.MatLike, x_offset: int, y_offset: int, decimation: int) -> List[ApriltagDetection]:
+        if decimation > 1:
+            decimated = cv2.resize(image, None, fx = 1.0 / decimation, fy = 1.0 / decimation, interpolation = cv2.INTER_AREA)
+            corners, ids, _ = self._detector.detectMarkers(decimated)
+            corners = [self._refine(image, (corner + 0.5) * decimation - 0.5, decimation) for corner in corners]
+        else:
+            corners, ids, _ = self._detector.detectMarkers(image)
+
+        if (len(corners) == 0):
+            return []
+        elif x_offset == 0 and y_offset == 0:
+            return [ApriltagDetection(id[0], corner) for id, corner in zip(ids, corners)]
+        else:
+            offset = numpy.array([x_offset, y_offset], dtype = numpy.float32)
+            return [ApriltagDetection(id[0], corner + offset) for id, corner in zip(ids, corners)]
+
+    def _refine(self, image: cv2.typing.MatLike, corners: cv2.typing.MatLike, decimation: int) -> cv2.typing.MatLike:
+        points = corners.reshape(-1, 2)
+        side = min(numpy.linalg.norm(points - numpy.roll(points, 1, axis = 0), axis = 1))
+        window = max(2, min(decimation * 2, int(side / 6)))
+        height, width = image.shape[0], image.shape[1]
+        x0 = max(int(points[:, 0].min()) - window - 2, 0)
+        y0 = max(int(points[:, 1].min()) - window - 2, 0)
+        x1 = min(int(points[:, 0].max()) + window + 3, width)
+        y1 = min(int(points[:, 1].max()) + window + 3, height)
+
+        crop = image[y0:y1, x0:x1]
+        if len(crop.shape) == 3:
+            crop = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY)
+
+        offset = numpy.array([x0, y0], dtype = numpy.float32)
+        local = numpy.clip(points - offset, 0, [x1 - x0 - 1, y1 - y0 - 1]).astype(numpy.float32).reshape(-1, 1, 2)
+        refined = cv2.cornerSubPix(crop, local, (window, window), (-1, -1), self.REFINE_CRITERIA)
+        return (refined.reshape(1, 4, 2) + offset).astype(numpy.float32)
+
+    def _regions(self, capture: cv2.typing.MatLike, padding: float) -> List[List[int]]:
+        height, width = capture.shape[0], capture.shape[1]
+        regions: List[List[int]] = []
+        for tracked in self._tracked:
+            points = tracked.corners.reshape(-1, 2)
+            x0, y0 = points.min(axis = 0)
+            x1, y1 = points.max(axis = 0)
+            pad = max(x1 - x0, y1 - y0) * padding + self.ROI_MIN_PADDING
+            regions.append([max(int(x0 - pad), 0), max(int(y0 - pad), 0), min(int(x1 + pad) + 1, width), min(int(y1 + pad) + 1, height)])
+
+        merged = True
+        while merged:
+            merged = False
+            for i in range(len(regions)):
+                for j in range(i + 1, len(regions)):
+                    a, b = regions[i], regions[j]
+                    if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                        regions[i] = [min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])]
+                        del regions[j]
+                        merged = True
+                        break
+                if merged:
+                    break
+
+        return regions
+
     def _update_config(self, new_config: NTConfig) -> None:
-        if self._config == None or new_config.tag_family != self._config.tag_family:
+        changed = new_config.changed_fields(self._config)
+        if "detector_profile" in changed:
+            profile = self._profiles.get(new_config.detector_profile)
+            if profile != None:
+                print("Apriltag Detector profile changed to \"" + new_config.detector_profile + "\"")
+            else:
+                print("Detector profile \"" + new_config.detector_profile + "\" not found, using \"default\"")
+                profile = self._profiles.get("default", BUILTIN_PROFILES["default"])
+            self._detector.setDetectorParameters(profile.to_parameters())
+            self._tracked = []
+
+        if "tag_family" in changed:
             lookup = self._dictionary_lookup(new_config.tag_family)
             if lookup != None:
                 print("Apriltag Detector dictionary changed")
@@ -41,6 +136,7 @@ class ApriltagDetector:
                 print("Apriltag Detector dictionary removed")
                 self._dictionary = None
                 self._detector.setDictionary(cv2.aruco.getPredefinedDictionary(cv2.aruco.DICT_ARUCO_ORIGINAL))
+            self._tracked = []
 
         self._config = new_config
 
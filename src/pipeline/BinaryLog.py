@@ -0,0 +1,140 @@
+import datetime
+import math
+import numpy
+import numpy.typing
+import os
+import queue
+import struct
+import threading
+from typing import BinaryIO, Dict, List, Optional, Tuple
+
+from config.ConnectionConfig import ConnectionConfig
+from pipeline.ApriltagDetector import ApriltagDetection
+from pipeline.PoseEstimator import PoseEstimation
+
+MAX_TAGS = 16
+STAGES = ["capture", "detect", "pose", "publish"]
+
+# One packed record per frame. Timings are in milliseconds; unused tag slots have id -1 and absent values are NaN.
+RECORD = numpy.dtype([
+    ("timestamp", "<f8"),
+    ("latency", "<f4"),
+    ("timings", "<f4", (len(STAGES),)),
+    ("tag_count", "u1"),
+    ("ids", "<i2", (MAX_TAGS,)),
+    ("corners", "<f4", (MAX_TAGS, 4, 2)),
+    ("ippe_errors", "<f4", (2,)),
+    ("pose", "<f8", (6,)),
+    ("distance", "<f4")
+])
+RECORD_STRUCT = struct.Struct("<df" + str(len(STAGES)) + "fB" + str(MAX_TAGS) + "h" + str(MAX_TAGS * 8) + "f2f6df")
+
+MAGIC = b"BLOG"
+VERSION = 1
+HEADER = struct.Struct("<4sHH8x")
+
+class BinaryLog:
+    MAX_BYTES = 32 * 1024 * 1024
+    QUEUE_SIZE = 256
+
+    _connection_config: ConnectionConfig
+    _queue: "queue.Queue[bytes]"
+    _dropped = 0
+
+    def __init__(self, connection_config: ConnectionConfig) -> None:
+        self._connection_config = connection_config
+        self._queue = queue.Queue(self.QUEUE_SIZE)
+        if connection_config.log_directory != "":
+            threading.Thread(target = self._write_loop, daemon = True, name = "binary-log").start()
+
+    def update(self, timestamp: float, latency: float, timings: Dict[str, float], detections: List[ApriltagDetection], ippe_errors: Tuple[float, float], pose_estimation: Optional[PoseEstimation]) -> None:
+        if self._connection_config.log_directory == "":
+            return
+
+        count = min(len(detections), MAX_TAGS)
+        ids = [int(detection.id) for detection in detections[:count]] + [-1] * (MAX_TAGS - count)
+        corners: List[float] = []
+        for detection in detections[:count]:
+            corners += detection.corners.ravel().tolist()
+        corners += [math.nan] * (MAX_TAGS * 8 - len(corners))
+
+        if pose_estimation != None:
+            rotation = pose_estimation.pose.rotation()
+            pose = [pose_estimation.pose.X(), pose_estimation.pose.Y(), pose_estimation.pose.Z(), rotation.X(), rotation.Y(), rotation.Z(), pose_estimation.distance]
+        else:
+            pose = [math.nan] * 7
+
+        try:
+            self._queue.put_nowait(RECORD_STRUCT.pack(
+                timestamp,
+                latency * 1000.0,
+                *[timings.get(stage, math.nan) * 1000.0 for stage in STAGES],
+                count,
+                *ids,
+                *corners,
+                *ippe_errors,
+                *pose
+            ))
+        except queue.Full:
+            self._dropped += 1
+
+    def _write_loop(self) -> None:
+        file: Optional[BinaryIO] = None
+        size = 0
+        while True:
+            records = [self._queue.get()]
+            while not self._queue.empty():
+                records.append(self._queue.get_nowait())
+            data = b"".join(records)
+
+            if file == None or size + len(data) > self.MAX_BYTES:
+                if file != None:
+                    file.close()
+                file = self._open()
+                size = HEADER.size
+                self._remove_old_logs()
+
+            file.write(data)
+            file.flush()
+            size += len(data)
+
+    def _open(self) -> BinaryIO:
+        os.makedirs(self._connection_config.log_directory, exist_ok = True)
+        filename = os.path.join(self._connection_config.log_directory, self._prefix() + datetime.datetime.now().strftime("%Y%m%d_%H%M%S_%f") + ".bll")
+        print("Logging detections to " + filename + (", dropped " + str(self._dropped) + " records so far" if self._dropped > 0 else ""))
+        file = open(filename, "wb")
+        file.write(HEADER.pack(MAGIC, VERSION, RECORD.itemsize))
+        return file
+
+    def _prefix(self) -> str:
+        return "Blacklight-" + self._connection_config.name + "_"
+
+    def _remove_old_logs(self) -> None:
+        # Keeps this camera's logs under log_retention_bytes by deleting the oldest, never the one being written
+        if self._connection_config.log_retention_bytes <= 0:
+            return
+        directory = self._connection_config.log_directory
+        names = sorted(name for name in os.listdir(directory) if name.startswith(self._prefix()) and name.endswith(".bll"))
+        sizes = [os.path.getsize(os.path.join(directory, name)) for name in names]
+        total = sum(sizes)
+        for name, size in zip(names[:-1], sizes[:-1]):
+            if total <= self._connection_config.log_retention_bytes:
+                break
+            try:
+                os.remove(os.path.join(directory, name))
+                print("Removed old log " + name)
+            except OSError as error:
+                print("Unable to remove old log " + name + ": " + str(error))
+            total -= size
+
+def load(filename: str) -> numpy.typing.NDArray[numpy.void]:
+    with open(filename, "rb") as file:
+        magic, version, record_size = HEADER.unpack(file.read(HEADER.size))
+    if magic != MAGIC or version != VERSION or record_size != RECORD.itemsize:
+        raise ValueError(filename + " is not a version " + str(VERSION) + " Blacklight log")
+
+    # A log that is still being written may end in a partial record, which is left out
+    count = (os.path.getsize(filename) - HEADER.size) // RECORD.itemsize
+    if count == 0:
+        return numpy.zeros(0, RECORD)
+    return numpy.memmap(filename, dtype = RECORD, mode = "r", offset = HEADER.size, shape = (count,))
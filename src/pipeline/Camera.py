@@ -5,10 +5,29 @@ import time
 from typing import Optional, Tuple
 
 from config.NTConfig import NTConfig
+from pipeline.V4L2Controls import V4L2Controls
 
 class Camera:
+    GSTREAMER_FORMATS = {
+        "BGR": "BGR",
+        "GRAY8": "GRAY8",
+        "YUYV": "YUY2",
+        "NV12": "NV12",
+        "MJPEG": "GRAY8"
+    }
+    TEST_SOURCE = "videotestsrc"
+
+    RESTART_FIELDS = { "device_path", "height", "width", "pixel_format" }
+    CONTROL_FIELDS = { "auto_exposure", "absolute_exposure", "gain" }
+
     _camera: Optional[cv2.VideoCapture] = None
+    _controls: Optional[V4L2Controls] = None
     _config: Optional[NTConfig] = None
+    _gray = False
+
+    def open(self, nt_config: NTConfig) -> None:
+        # Starts the camera ahead of the first read, so that it can be opened alongside the rest of startup
+        self._update_config(nt_config)
 
     def read(self, nt_config: NTConfig) -> Tuple[bool, cv2.typing.MatLike]:
         self._update_config(nt_config)
@@ -17,39 +36,78 @@ class Camera:
             success, frame = self._camera.read()
             if not success:
                 print("Unable to capture camera frame, restarting camera...")
-                self._camera.release()
-                self._camera = None
+                self.release()
                 time.sleep(1)
+            elif self._gray and self._config != None:
+                frame = self._to_gray(frame, self._config.height)
             return success, frame
         else:
             return False, cv2.Mat(numpy.ndarray([]))
 
-    def _update_config(self, new_config: NTConfig) -> None:        
+    def release(self) -> None:
         if self._camera != None:
-            if self._config == None or new_config.device_path != self._config.device_path or new_config.height != self._config.height or new_config.width != self._config.width or new_config.auto_exposure != self._config.auto_exposure or new_config.gain != self._config.gain:
+            self._camera.release()
+            self._camera = None
+        if self._controls != None:
+            self._controls.close()
+            self._controls = None
+
+    def _update_config(self, new_config: NTConfig) -> None:
+        changed = new_config.changed_fields(self._config)
+        if self._camera != None:
+            if len(changed & self.RESTART_FIELDS) > 0:
                 print("Camera config changed, restarting camera...")
-                self._camera.release()
-                self._camera = None
+                self.release()
                 time.sleep(1)
+            elif len(changed & self.CONTROL_FIELDS) > 0:
+                self._apply_controls(new_config)
 
         self._config = new_config
 
         if self._camera == None:
             print("Starting camera...")
-            self._camera = cv2.VideoCapture(
-                "v4l2src device="
-                    + str(self._config.device_path)
-                    + " ! video/x-raw, format=BGR, width="
-                    + str(self._config.width)
-                    + ", height="
-                    + str(self._config.height)
-                    + ", pixel-aspect-ratio=1/1, extra_controls=\"c, exposure_auto="
-                    + str(self._config.auto_exposure)
-                    + ", exposure_absolute="
-                    + str(self._config.absolute_exposure)
-                    + ", gain="
-                    + str(self._config.gain)
-                    + ", sharpness=0, brightness=0\" ! videoconvert ! appsink drop=1",
-                cv2.CAP_GSTREAMER
-            )
+            gstreamer_format = self.GSTREAMER_FORMATS.get(self._config.pixel_format, "BGR")
+            self._gray = gstreamer_format != "BGR"
+            self._camera = cv2.VideoCapture(self._pipeline(self._config, gstreamer_format), cv2.CAP_GSTREAMER)
+            if self._config.device_path != self.TEST_SOURCE:
+                self._controls = V4L2Controls(self._config.device_path)
+                self._controls.set("sharpness", V4L2Controls.SHARPNESS, 0)
+                self._controls.set("brightness", V4L2Controls.BRIGHTNESS, 0)
+                self._apply_controls(self._config)
             print("Camera Started")
+
+    def _pipeline(self, config: NTConfig, gstreamer_format: str) -> str:
+        size = "width=" + str(config.width) + ", height=" + str(config.height)
+        if config.device_path == self.TEST_SOURCE:
+            source = "videotestsrc is-live=true pattern=ball"
+            if config.pixel_format == "MJPEG":
+                source += " ! video/x-raw, " + size + " ! jpegenc"
+        else:
+            source = "v4l2src device=" + config.device_path
+            if config.pixel_format == "MJPEG":
+                source += " ! image/jpeg, " + size
+
+        if config.pixel_format == "MJPEG":
+            return source + " ! jpegdec ! videoconvert ! video/x-raw, format=GRAY8 ! appsink drop=1"
+        else:
+            return (
+                source
+                + " ! video/x-raw, format=" + gstreamer_format + ", " + size + ", pixel-aspect-ratio=1/1"
+                + (" ! videoconvert" if gstreamer_format == "BGR" else "")
+                + " ! appsink drop=1"
+            )
+
+    def _apply_controls(self, config: NTConfig) -> None:
+        # Exposure mode goes first, since most drivers reject an absolute exposure while auto exposure is on
+        if self._controls != None:
+            self._controls.set("exposure_auto", V4L2Controls.EXPOSURE_AUTO, config.auto_exposure)
+            self._controls.set("exposure_absolute", V4L2Controls.EXPOSURE_ABSOLUTE, config.absolute_exposure)
+            self._controls.set("gain", V4L2Controls.GAIN, config.gain)
+
+    def _to_gray(self, frame: cv2.typing.MatLike, height: int) -> cv2.typing.MatLike:
+        if len(frame.shape) == 2:
+            return frame[:height]
+        elif frame.shape[2] == 2:
+            return cv2.extractChannel(frame, 0)
+        else:
+            return cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
@@ -0,0 +1,82 @@
+import cv2
+import cv2.typing
+import datetime
+import os
+import queue
+import struct
+import threading
+from typing import BinaryIO, Optional, Tuple
+
+from config.ConnectionConfig import ConnectionConfig
+from config.NTConfig import NTConfig, serialize
+
+class FrameRecorder:
+    # Each chunk is a header, the NTConfig snapshot as JSON and the frame as a lossless PNG
+    MAGIC = b"BLFR"
+    HEADER = struct.Struct("<4sdII")
+    QUEUE_SIZE = 8
+    IDLE_TIMEOUT = 1.0
+
+    _connection_config: ConnectionConfig
+    _queue: "queue.Queue[Tuple[int, float, cv2.typing.MatLike, NTConfig]]"
+    _session = 0
+    _recording = False
+    _dropped = 0
+
+    def __init__(self, connection_config: ConnectionConfig) -> None:
+        self._connection_config = connection_config
+        self._queue = queue.Queue(self.QUEUE_SIZE)
+        threading.Thread(target = self._write_loop, daemon = True, name = "recorder").start()
+
+    def update(self, timestamp: float, capture: cv2.typing.MatLike, nt_config: NTConfig) -> None:
+        if not nt_config.recording:
+            self._recording = False
+            return
+
+        if not self._recording:
+            self._recording = True
+            self._session += 1
+            self._dropped = 0
+
+        # Copied, as the frame loop goes on to draw onto the capture while it waits here to be encoded
+        try:
+            self._queue.put_nowait((self._session, timestamp, capture.copy(), nt_config))
+        except queue.Full:
+            self._dropped += 1
+
+    def _write_loop(self) -> None:
+        file: Optional[BinaryIO] = None
+        session = 0
+        frames = 0
+        while True:
+            try:
+                frame_session, timestamp, capture, nt_config = self._queue.get(timeout = self.IDLE_TIMEOUT)
+            except queue.Empty:
+                if file != None and not self._recording:
+                    file.close()
+                    file = None
+                    print("Stopped recording after " + str(frames) + " frames, dropped " + str(self._dropped))
+                continue
+
+            if file == None or frame_session != session:
+                if file != None:
+                    file.close()
+                file = self._open()
+                session = frame_session
+                frames = 0
+
+            _, png = cv2.imencode(".png", capture, [cv2.IMWRITE_PNG_COMPRESSION, 1])
+            config = serialize(nt_config).encode("utf-8")
+            image = png.tobytes()
+            file.write(self.HEADER.pack(self.MAGIC, timestamp, len(config), len(image)) + config + image)
+            file.flush()
+            frames += 1
+
+    def _open(self) -> BinaryIO:
+        os.makedirs(self._connection_config.recording_directory, exist_ok = True)
+        filename = os.path.join(
+            self._connection_config.recording_directory,
+            "Blacklight-" + self._connection_config.name + "_" + datetime.datetime.now().strftime("%Y%m%d_%H%M%S") + ".blr"
+        )
+        print("Recording frames to " + filename)
+        return open(filename, "wb")
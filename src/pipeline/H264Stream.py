@@ -0,0 +1,146 @@
+import cv2
+import cv2.typing
+import numpy
+import subprocess
+import threading
+import time
+from typing import Callable, List, Optional, Tuple
+
+class H264Stream:
+    # Encodes previews to H.264 in an MPEG-TS container with a gst-launch child process. Frames are written to its
+    # stdin at a fixed rate from a feeder thread, and the stream is read from its stdout by a reader thread, so the
+    # frame loop only ever swaps in the latest preview.
+    FPS = 30
+    PACKET_SIZE = 188
+    READ_SIZE = 188 * 64
+
+    _bitrate: int
+    _keyframe_interval: int
+    _on_data: Callable[[Optional[bytes]], None]
+    _lock: threading.Lock
+    _frame: Optional[cv2.typing.MatLike] = None
+    _generation = 0
+    _running = False
+
+    def __init__(self, bitrate: int, keyframe_interval: int, on_data: Callable[[Optional[bytes]], None]) -> None:
+        # on_data receives each chunk of the stream, or None when the encoder fails
+        self._bitrate = bitrate
+        self._keyframe_interval = keyframe_interval
+        self._on_data = on_data
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        with self._lock:
+            if self._running:
+                return
+            self._running = True
+            self._generation += 1
+            self._frame = None
+            generation = self._generation
+        threading.Thread(target = self._feed_loop, daemon = True, args = (generation,), name = "h264-feeder").start()
+
+    def stop(self) -> None:
+        with self._lock:
+            self._running = False
+            self._generation += 1
+
+    def update(self, preview: cv2.typing.MatLike) -> None:
+        # I420 needs even dimensions
+        with self._lock:
+            self._frame = preview[:preview.shape[0] & ~1, :preview.shape[1] & ~1]
+
+    def _command(self, width: int, height: int) -> List[str]:
+        return [
+            "gst-launch-1.0", "-q",
+            "fdsrc", "fd=0", "blocksize=" + str(width * height * 3), "!",
+            "rawvideoparse", "width=" + str(width), "height=" + str(height), "format=bgr", "framerate=" + str(self.FPS) + "/1", "!",
+            "videoconvert", "!", "video/x-raw,format=I420", "!",
+            "x264enc", "tune=zerolatency", "speed-preset=ultrafast", "bitrate=" + str(self._bitrate), "key-int-max=" + str(self._keyframe_interval), "!",
+            "video/x-h264,profile=baseline", "!",
+            # Repeating SPS/PPS before every keyframe lets clients that join mid-stream start decoding at the next one
+            "h264parse", "config-interval=-1", "!",
+            "mpegtsmux", "alignment=7", "!",
+            "fdsink", "fd=1", "sync=false"
+        ]
+
+    def _feed_loop(self, generation: int) -> None:
+        # Frames are sent at a constant rate, repeating the last one when the pipeline is slower, so that the
+        # timestamps rawvideoparse assigns match real time
+        process: Optional["subprocess.Popen[bytes]"] = None
+        size: Tuple[int, int] = (0, 0)
+        next_frame = time.perf_counter()
+        while self._generation == generation:
+            delay = next_frame - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            next_frame = max(next_frame + 1.0 / self.FPS, time.perf_counter())
+
+            with self._lock:
+                frame = self._frame
+            if frame is None:
+                continue
+
+            if process == None or (frame.shape[1], frame.shape[0]) != size:
+                # Each encoder gets its own generation, so the reader of the old one drops what it still has buffered
+                # instead of mixing it into the new stream
+                with self._lock:
+                    if self._generation != generation:
+                        break
+                    self._generation += 1
+                    generation = self._generation
+                self._close(process)
+                size = (frame.shape[1], frame.shape[0])
+                process = self._open(size, generation)
+                if process == None:
+                    self.stop()
+                    self._on_data(None)
+                    break
+
+            try:
+                process.stdin.write(numpy.ascontiguousarray(frame).data) # type: ignore
+            except OSError as error:
+                print("H.264 encoder stopped: " + str(error))
+                self.stop()
+                self._on_data(None)
+                break
+        self._close(process)
+
+    def _open(self, size: Tuple[int, int], generation: int) -> Optional["subprocess.Popen[bytes]"]:
+        try:
+            process = subprocess.Popen(self._command(size[0], size[1]), stdin = subprocess.PIPE, stdout = subprocess.PIPE, bufsize = 0)
+        except OSError as error:
+            print("Unable to start H.264 encoder: " + str(error))
+            return None
+        print("Started H.264 encoder at " + str(size[0]) + "x" + str(size[1]) + ", " + str(self._bitrate) + " kbit/s")
+        threading.Thread(target = self._read_loop, daemon = True, args = (process, generation), name = "h264-reader").start()
+        return process
+
+    def _close(self, process: Optional["subprocess.Popen[bytes]"]) -> None:
+        if process == None:
+            return
+        try:
+            process.stdin.close() # type: ignore
+        except OSError:
+            pass
+        try:
+            process.wait(1.0)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+    def _read_loop(self, process: "subprocess.Popen[bytes]", generation: int) -> None:
+        # Only whole transport stream packets are passed on, so each chunk can be the first one a new client receives.
+        # Once the encoder is replaced or stopped its output is still read, so it can exit, but no longer passed on.
+        pending = b""
+        while True:
+            data = process.stdout.read(self.READ_SIZE) # type: ignore
+            if not data:
+                break
+            if self._generation != generation:
+                continue
+            pending += data
+            whole = len(pending) - len(pending) % self.PACKET_SIZE
+            if whole > 0:
+                self._on_data(pending[:whole])
+                pending = pending[whole:]
+        process.stdout.close() # type: ignore
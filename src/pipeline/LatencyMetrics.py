@@ -0,0 +1,55 @@
+import numpy
+import numpy.typing
+import threading
+import time
+from typing import Dict, List, Tuple
+
+class LatencyMetrics:
+    STAGES = ["capture", "detect", "pose", "publish", "encode", "latency"]
+    QUANTILES = [50.0, 95.0, 99.0]
+    WINDOW = 256
+
+    _lock: threading.Lock
+    _samples: Dict[str, List[float]]
+    _counts: Dict[str, int]
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._samples = { stage: [0.0] * self.WINDOW for stage in self.STAGES }
+        self._counts = { stage: 0 for stage in self.STAGES }
+
+    def record(self, stage: str, start: float) -> float:
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            count = self._counts[stage]
+            self._samples[stage][count % self.WINDOW] = elapsed
+            self._counts[stage] = count + 1
+        return elapsed
+
+    def summary(self) -> Dict[str, List[float]]:
+        # Returns [p50, p95, p99, max] in milliseconds over the last WINDOW samples of each stage
+        samples, _ = self._snapshot()
+        return self._summarize(samples)
+
+    def to_text(self) -> str:
+        # Counts and quantiles come from one snapshot, so they describe the same samples
+        samples, counts = self._snapshot()
+        lines: List[str] = []
+        for stage, values in self._summarize(samples).items():
+            for quantile, value in zip(self.QUANTILES, values):
+                lines.append("blacklight_latency_ms{stage=\"" + stage + "\",quantile=\"" + str(quantile / 100.0) + "\"} %.3f" % value)
+            lines.append("blacklight_latency_ms_max{stage=\"" + stage + "\"} %.3f" % values[-1])
+            lines.append("blacklight_latency_count{stage=\"" + stage + "\"} " + str(counts[stage]))
+        return "\n".join(lines) + "\n"
+
+    def _snapshot(self) -> Tuple[Dict[str, numpy.typing.NDArray[numpy.float64]], Dict[str, int]]:
+        with self._lock:
+            samples = { stage: numpy.array(self._samples[stage][:min(self._counts[stage], self.WINDOW)]) for stage in self.STAGES }
+            return samples, dict(self._counts)
+
+    def _summarize(self, samples: Dict[str, numpy.typing.NDArray[numpy.float64]]) -> Dict[str, List[float]]:
+        summary: Dict[str, List[float]] = {}
+        for stage, values in samples.items():
+            if len(values) > 0:
+                summary[stage] = (numpy.append(numpy.percentile(values, self.QUANTILES), values.max()) * 1000.0).tolist()
+        return summary
@@ -1,57 +1,124 @@
 import math
 import ntcore
-from typing import List, Optional
+import numpy
+from typing import Dict, List, Optional
 
 from config.ConnectionConfig import ConnectionConfig
-from pipeline.PoseEstimator import PoseEstimation
+import pipeline.PoseMath as PoseMath
+from pipeline.PoseEstimator import PoseEstimation, TagObservations
 
 class NTOutput:
+    # Layout of the "observations" raw topic, all little endian. The header is followed by the pose and then tag_count tags.
+    # Candidate transforms are camera to tag relative to the camera, in WPILib axes (x forward, y left, z up) with
+    # quaternions ordered w, x, y, z, best candidate first. Unlike debugPoseEstimation they leave out camera_position.
+    # Tags that are not in the layout, other than the debug tag, have NaN candidates.
+    OBSERVATIONS_VERSION = 1
+    OBSERVATIONS_TYPE = "blacklight-observations"
+    MAX_OBSERVATIONS = 32
+    FLAG_POSE = 1
+    FLAG_USED = 1
+    OBSERVATIONS_HEADER = numpy.dtype([
+        ("version", "u1"),
+        ("flags", "u1"),
+        ("tag_count", "<u2"),
+        ("timestamp", "<i8")
+    ])
+    OBSERVATIONS_POSE = numpy.dtype([
+        ("translation", "<f8", (3,)),
+        ("quaternion", "<f8", (4,)),
+        ("distance", "<f8")
+    ])
+    OBSERVATIONS_TAG = numpy.dtype([
+        ("id", "<i2"),
+        ("flags", "u1"),
+        ("corners", "<f4", (4, 2)),
+        ("translation", "<f4", (2, 3)),
+        ("quaternion", "<f4", (2, 4)),
+        ("error", "<f4", (2,))
+    ])
+
     _connection_config: ConnectionConfig
     _published: bool = False
     _fps: ntcore.IntegerPublisher
+    _last_fps = -1
     _pose_estimation: ntcore.DoubleArrayPublisher
     _debug_pose_estimation: ntcore.DoubleArrayPublisher
+    _observations: ntcore.RawPublisher
+    _metrics: Dict[str, ntcore.DoubleArrayPublisher]
+    _buffer: bytearray
+    _header: numpy.ndarray
+    _pose: numpy.ndarray
+    _tags: numpy.ndarray
 
     def __init__(self, connection_config: ConnectionConfig) -> None:
         self._connection_config = connection_config
+        self._metrics = {}
+
+        tags_offset = self.OBSERVATIONS_HEADER.itemsize + self.OBSERVATIONS_POSE.itemsize
+        self._buffer = bytearray(tags_offset + self.MAX_OBSERVATIONS * self.OBSERVATIONS_TAG.itemsize)
+        self._header = numpy.frombuffer(self._buffer, self.OBSERVATIONS_HEADER, 1, 0)
+        self._pose = numpy.frombuffer(self._buffer, self.OBSERVATIONS_POSE, 1, self.OBSERVATIONS_HEADER.itemsize)
+        self._tags = numpy.frombuffer(self._buffer, self.OBSERVATIONS_TAG, self.MAX_OBSERVATIONS, tags_offset)
+        self._header["version"] = self.OBSERVATIONS_VERSION
 
-    def update(self, timestamp: float, fps: int, pose_estimation: Optional[PoseEstimation], debug_pose_estimation: Optional[PoseEstimation]) -> None:
+    def update(self, timestamp: float, fps: int, pose_estimation: Optional[PoseEstimation], debug_pose_estimation: Optional[PoseEstimation], observations: Optional[TagObservations]) -> None:
         if not self._published:
             table = ntcore.NetworkTableInstance.getDefault().getTable("/Blacklight-" + self._connection_config.name + "/output")
             self._fps = table.getIntegerTopic("fps").publish()
             self._pose_estimation = table.getDoubleArrayTopic("poseEstimation").publish()
             self._debug_pose_estimation = table.getDoubleArrayTopic("debugPoseEstimation").publish()
+            self._observations = table.getRawTopic("observations").publish(self.OBSERVATIONS_TYPE)
             self._published = True
 
-        self._fps.set(fps)
+        if fps != self._last_fps:
+            self._fps.set(fps)
+            self._last_fps = fps
+
+        nt_timestamp = math.floor(timestamp * 1000000)
+        self._pose_estimation.set(self._to_array(pose_estimation), nt_timestamp)
+        self._debug_pose_estimation.set(self._to_array(debug_pose_estimation)[:7], nt_timestamp)
+        if observations != None:
+            self._observations.set(self._pack_observations(nt_timestamp, pose_estimation, observations), nt_timestamp)
+
+    def update_metrics(self, summary: Dict[str, List[float]]) -> None:
+        for stage, values in summary.items():
+            if stage not in self._metrics:
+                table = ntcore.NetworkTableInstance.getDefault().getTable("/Blacklight-" + self._connection_config.name + "/output/metrics")
+                self._metrics[stage] = table.getDoubleArrayTopic(stage).publish()
+            self._metrics[stage].set(values)
+
+    def _to_array(self, pose_estimation: Optional[PoseEstimation]) -> List[float]:
+        if pose_estimation == None:
+            return []
+
+        translation = pose_estimation.pose.translation()
+        rotation = pose_estimation.pose.rotation()
+        return [translation.X(), translation.Y(), translation.Z(), rotation.X(), rotation.Y(), rotation.Z(), pose_estimation.distance, *pose_estimation.ids]
+
+    def _pack_observations(self, nt_timestamp: int, pose_estimation: Optional[PoseEstimation], observations: TagObservations) -> bytes:
+        count = min(len(observations.ids), self.MAX_OBSERVATIONS)
+        self._header["timestamp"] = nt_timestamp
+        self._header["tag_count"] = count
 
         if pose_estimation != None:
-            array: List[float] = [
-                pose_estimation.pose.translation().X(), # type: ignore
-                pose_estimation.pose.translation().Y(), # type: ignore
-                pose_estimation.pose.translation().Z(), # type: ignore
-                pose_estimation.pose.rotation().X(), # type: ignore
-                pose_estimation.pose.rotation().Y(), # type: ignore
-                pose_estimation.pose.rotation().Z(), # type: ignore
-                pose_estimation.distance
-            ]
-
-            for id in pose_estimation.ids:
-                array.append(id)
-
-            self._pose_estimation.set(array, math.floor(timestamp * 1000000))
+            quaternion = pose_estimation.pose.rotation().getQuaternion()
+            self._header["flags"] = self.FLAG_POSE
+            self._pose["translation"] = [pose_estimation.pose.X(), pose_estimation.pose.Y(), pose_estimation.pose.Z()]
+            self._pose["quaternion"] = [quaternion.W(), quaternion.X(), quaternion.Y(), quaternion.Z()]
+            self._pose["distance"] = pose_estimation.distance
+            used = pose_estimation.ids
         else:
-            self._pose_estimation.set([], math.floor(timestamp * 1000000))
-
-        if debug_pose_estimation != None:
-            self._debug_pose_estimation.set([
-                debug_pose_estimation.pose.translation().X(), # type: ignore
-                debug_pose_estimation.pose.translation().Y(), # type: ignore
-                debug_pose_estimation.pose.translation().Z(), # type: ignore
-                debug_pose_estimation.pose.rotation().X(), # type: ignore
-                debug_pose_estimation.pose.rotation().Y(), # type: ignore
-                debug_pose_estimation.pose.rotation().Z(), # type: ignore
-                debug_pose_estimation.distance
-            ], math.floor(timestamp * 1000000))
-        else:
-            self._debug_pose_estimation.set([], math.floor(timestamp * 1000000))
+            self._header["flags"] = 0
+            self._pose["translation"] = math.nan
+            self._pose["quaternion"] = math.nan
+            self._pose["distance"] = math.nan
+            used = []
+
+        tags = self._tags[:count]
+        tags["id"] = observations.ids[:count]
+        tags["flags"] = [self.FLAG_USED if id in used else 0 for id in observations.ids[:count]]
+        tags["corners"] = observations.corners[:count]
+        tags["translation"] = observations.tvecs[:count] @ PoseMath.OPENCV_TO_WPILIB.T
+        tags["quaternion"] = PoseMath.rotation_vectors_to_quaternions(observations.rvecs[:count] @ PoseMath.OPENCV_TO_WPILIB.T)
+        tags["error"] = observations.errors[:count]
+        return bytes(self._buffer[:self.OBSERVATIONS_HEADER.itemsize + self.OBSERVATIONS_POSE.itemsize + count * self.OBSERVATIONS_TAG.itemsize])
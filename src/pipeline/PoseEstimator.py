@@ -4,12 +4,13 @@ from dataclasses import dataclass
 import math
 import numpy
 import numpy.typing
-from typing import List, Optional
-from wpimath.geometry import Pose3d, Rotation3d, Transform3d, Translation3d
+from typing import List, Optional, Tuple
+from wpimath.geometry import Pose3d, Rotation3d, Translation3d
 
 from config.CalibrationConfig import CalibrationConfig;
 from config.NTConfig import NTConfig
 from pipeline.ApriltagDetector import ApriltagDetection
+import pipeline.PoseMath as PoseMath
 
 @dataclass
 class PoseEstimation:
@@ -17,60 +18,51 @@ class PoseEstimation:
     pose: Pose3d
     distance: float
 
+@dataclass
+class TagObservations:
+    # Both IPPE candidates for every detected tag, as camera to tag transforms in OpenCV coordinates, best first. Tags
+    # that are not in the layout, other than the debug tag, are not solved and are left NaN.
+    ids: List[int]
+    corners: numpy.typing.NDArray[numpy.float32]
+    rvecs: numpy.typing.NDArray[numpy.float64]
+    tvecs: numpy.typing.NDArray[numpy.float64]
+    errors: numpy.typing.NDArray[numpy.float64]
+
 class PoseEstimator:
-    def get_estimated_pose(self, detections: List[ApriltagDetection], calibration_config: CalibrationConfig, nt_config: NTConfig) -> Optional[PoseEstimation]:
+    # Errors of both IPPE candidates from the last single-tag solve, NaN when the last frame had no single-tag solve
+    ippe_errors: Tuple[float, float] = (math.nan, math.nan)
+    _camera_position: List[float] = []
+    _camera_to_robot: PoseMath.Matrix = numpy.identity(4)
+    _track: Optional[Tuple[cv2.typing.MatLike, cv2.typing.MatLike, float]] = None
+    _track_previous: Optional[Tuple[cv2.typing.MatLike, cv2.typing.MatLike, float]] = None
+    _single_tag_solve: Optional[Tuple[ApriltagDetection, cv2.typing.MatLike, cv2.typing.MatLike, cv2.typing.MatLike]] = None
+
+    def get_estimated_pose(self, detections: List[ApriltagDetection], calibration_config: CalibrationConfig, nt_config: NTConfig, timestamp: float) -> Optional[PoseEstimation]:
+        self.ippe_errors = (math.nan, math.nan)
+        self._single_tag_solve = None
         if len(detections) == 0 or len(calibration_config.distortion_coefficients) == 0 or len(calibration_config.distortion_matrix) == 0 or len(nt_config.tag_layout) == 0:
             return None
 
-        tags: List[int] = []
-        tag_poses: List[Pose3d] = []
-        points: List[List[float]] = []
-        image_points: List[List[float]] = []
-        for detection in detections:
-            tag_pose: Optional[Pose3d] = None
-
-            for config_tag_pose in nt_config.tag_layout:
-                if config_tag_pose.id == detection.id:
-                    tag_pose = Pose3d(
-                        Translation3d(config_tag_pose.x, config_tag_pose.y, config_tag_pose.z),
-                        Rotation3d(config_tag_pose.rx, config_tag_pose.ry, config_tag_pose.rz)
-                    )
-
-            if tag_pose != None:
-                corner_0 = tag_pose + Transform3d(Translation3d(0, nt_config.tag_size / 2.0, -nt_config.tag_size / 2.0), Rotation3d())
-                corner_1 = tag_pose + Transform3d(Translation3d(0, -nt_config.tag_size / 2.0, -nt_config.tag_size / 2.0), Rotation3d())
-                corner_2 = tag_pose + Transform3d(Translation3d(0, -nt_config.tag_size / 2.0, nt_config.tag_size / 2.0), Rotation3d())
-                corner_3 = tag_pose + Transform3d(Translation3d(0, nt_config.tag_size / 2.0, nt_config.tag_size / 2.0), Rotation3d())
-
-                points += [
-                    self._to_opencv(corner_0.translation()),
-                    self._to_opencv(corner_1.translation()),
-                    self._to_opencv(corner_2.translation()),
-                    self._to_opencv(corner_3.translation())
-                ]
-
-                image_points += [
-                    [detection.corners[0][0][0], detection.corners[0][0][1]],
-                    [detection.corners[0][1][0], detection.corners[0][1][1]],
-                    [detection.corners[0][2][0], detection.corners[0][2][1]],
-                    [detection.corners[0][3][0], detection.corners[0][3][1]]
-                ]
-
-                tags.append(detection.id)
-                tag_poses.append(tag_pose)
-
-        if len(tags) == 0:
+        index = nt_config.tag_layout.index
+        matches = [detection for detection in detections if detection.id in index]
+        if len(matches) == 0:
             return None
-        elif len(tags) == 1:
+
+        tags = [detection.id for detection in matches]
+        rows = [index[id] for id in tags]
+        image_points = numpy.concatenate([detection.corners for detection in matches], axis = None).reshape(-1, 2).astype(numpy.float64)
+
+        if len(tags) > 1 and nt_config.temporal_pose:
+            return self._temporal_pose(tags, rows, image_points, calibration_config, nt_config, timestamp)
+
+        # Single tags always get both IPPE solutions and the ambiguity check, so a track is only kept across multi-tag frames
+        self._track = None
+        self._track_previous = None
+        if len(tags) == 1:
             try:
                 _, rvecs, tvecs, errors = cv2.solvePnPGeneric(
-                    numpy.array([
-                        [-nt_config.tag_size / 2.0, nt_config.tag_size / 2.0, 0.0],
-                        [nt_config.tag_size / 2.0, nt_config.tag_size / 2.0, 0.0],
-                        [nt_config.tag_size / 2.0, -nt_config.tag_size / 2.0, 0.0],
-                        [-nt_config.tag_size / 2.0, -nt_config.tag_size / 2.0, 0.0]
-                    ]),
-                    numpy.array(image_points),
+                    nt_config.tag_layout.tag_object_points,
+                    image_points,
                     calibration_config.distortion_matrix,
                     calibration_config.distortion_coefficients,
                     flags = cv2.SOLVEPNP_IPPE_SQUARE
@@ -80,103 +72,164 @@ class PoseEstimator:
 
             error0 = errors[0][0]
             error1 = errors[1][0]
-            field_to_tag_pose = tag_poses[0]
+            self.ippe_errors = (float(error0), float(error1))
+            self._single_tag_solve = (matches[0], rvecs, tvecs, errors)
 
             if (error0 < (error1 * nt_config.error_ambiguity)):
-                camera_to_tag_pose = self._to_wpilib(tvecs[0], rvecs[0])
-                distance = camera_to_tag_pose.translation().norm() # type: ignore
-                final_pose = self._to_robot_pose(field_to_tag_pose.transformBy(Transform3d(camera_to_tag_pose.translation(), camera_to_tag_pose.rotation())), nt_config)
-
-                if self._is_outside_field(final_pose, nt_config):
-                    return None
-                else:
-                    return PoseEstimation(tags, final_pose, distance) # type: ignore
+                final_pose, distance = self._single_tag_pose(tvecs[0], rvecs[0], False, rows[0], nt_config)
             elif (error1 < (error0 * nt_config.error_ambiguity)):
-                camera_to_tag_pose = self._to_wpilib(tvecs[1], rvecs[1])
-                distance = camera_to_tag_pose.translation().norm() # type: ignore
-                final_pose = self._to_robot_pose(field_to_tag_pose.transformBy(Transform3d(camera_to_tag_pose.translation(), camera_to_tag_pose.rotation()).inverse()), nt_config)
-
-                if self._is_outside_field(final_pose, nt_config):
-                    return None
-                else:
-                    return PoseEstimation(tags, final_pose, distance) # type: ignore
+                final_pose, distance = self._single_tag_pose(tvecs[1], rvecs[1], True, rows[0], nt_config)
             else:
                 return None
         else:
-            try:
-                _, rvecs, tvecs, errors = cv2.solvePnPGeneric(
-                    numpy.array(points),
-                    numpy.array(image_points),
-                    calibration_config.distortion_matrix,
-                    calibration_config.distortion_coefficients,
-                    flags = cv2.SOLVEPNP_SQPNP
-                )
-            except:
+            solution = self._solve_field_pose(nt_config.tag_layout.object_points[rows].reshape(-1, 3), image_points, calibration_config)
+            if solution == None:
                 return None
 
-            camera_to_field_pose = self._to_wpilib(tvecs[0], rvecs[0])
-            field_to_camera = Transform3d(camera_to_field_pose.translation(), camera_to_field_pose.rotation()).inverse()
-            final_pose = self._to_robot_pose(Pose3d(field_to_camera.translation(), field_to_camera.rotation()), nt_config)
+            final_pose, distance = self._multi_tag_pose(solution[1], solution[0], rows, nt_config)
 
-            totalDistance = 0.0
-            for tag_pose in tag_poses:
-                totalDistance += final_pose.relativeTo(tag_pose).translation().norm() # type: ignore
-
-            if self._is_outside_field(final_pose, nt_config):
-                    return None
+        if self._is_outside_field(final_pose, nt_config):
+            return None
+        else:
+            return PoseEstimation(tags, PoseMath.to_pose(final_pose), distance)
+
+    def get_tag_observations(self, detections: List[ApriltagDetection], calibration_config: CalibrationConfig, nt_config: NTConfig) -> TagObservations:
+        observations = TagObservations(
+            [detection.id for detection in detections],
+            numpy.array([detection.corners.reshape(4, 2) for detection in detections], dtype = numpy.float32).reshape(-1, 4, 2),
+            numpy.full((len(detections), 2, 3), numpy.nan),
+            numpy.full((len(detections), 2, 3), numpy.nan),
+            numpy.full((len(detections), 2), numpy.nan)
+        )
+        if len(calibration_config.distortion_coefficients) == 0 or len(calibration_config.distortion_matrix) == 0:
+            return observations
+
+        # Only tags the roboRIO can place on the field and the debug tag are solved. A single tag was already solved by
+        # get_estimated_pose for this frame, which is reused when it is the same detection.
+        for i, detection in enumerate(detections):
+            if detection.id not in nt_config.tag_layout.index and detection.id != nt_config.debug_tag:
+                continue
+            if self._single_tag_solve != None and self._single_tag_solve[0] is detection:
+                _, rvecs, tvecs, errors = self._single_tag_solve
             else:
-                return PoseEstimation(tags, final_pose, totalDistance / len(tag_poses)) # type: ignore
-
-    def get_estimated_debug_pose(self, detections: List[ApriltagDetection], calibration_config: CalibrationConfig, nt_config: NTConfig) -> Optional[PoseEstimation]:
-        for detection in detections:
-            if detection.id == nt_config.debug_tag:
                 try:
                     _, rvecs, tvecs, errors = cv2.solvePnPGeneric(
-                        numpy.array([
-                            [-nt_config.tag_size / 2.0, nt_config.tag_size / 2.0, 0.0],
-                            [nt_config.tag_size / 2.0, nt_config.tag_size / 2.0, 0.0],
-                            [nt_config.tag_size / 2.0, -nt_config.tag_size / 2.0, 0.0],
-                            [-nt_config.tag_size / 2.0, -nt_config.tag_size / 2.0, 0.0]
-                        ]),
+                        nt_config.tag_layout.tag_object_points,
                         detection.corners,
                         calibration_config.distortion_matrix,
                         calibration_config.distortion_coefficients,
                         flags = cv2.SOLVEPNP_IPPE_SQUARE
                     )
                 except:
-                    return None
+                    continue
+
+            observations.rvecs[i] = numpy.reshape(rvecs, (2, 3))
+            observations.tvecs[i] = numpy.reshape(tvecs, (2, 3))
+            observations.errors[i] = numpy.reshape(errors, 2)
+        return observations
 
-                error0 = errors[0][0]
-                error1 = errors[1][0]
+    def get_estimated_debug_pose(self, observations: TagObservations, nt_config: NTConfig) -> Optional[PoseEstimation]:
+        for i, id in enumerate(observations.ids):
+            if id == nt_config.debug_tag:
+                error0, error1 = observations.errors[i].tolist()
 
                 if (error0 < (error1 * nt_config.error_ambiguity)):
-                    camera_to_tag_pose = self._to_wpilib(tvecs[0], rvecs[0])
-                    distance = camera_to_tag_pose.translation().norm() # type: ignore
-                    return PoseEstimation([detection.id], self._to_robot_pose(camera_to_tag_pose, nt_config), distance) # type: ignore
+                    camera_to_tag = PoseMath.from_opencv(observations.tvecs[i][0], observations.rvecs[i][0])
                 elif (error1 < (error0 * nt_config.error_ambiguity)):
-                    camera_to_tag_pose = self._to_wpilib(tvecs[1], rvecs[1])
-                    distance = camera_to_tag_pose.translation().norm() # type: ignore
-                    return PoseEstimation([detection.id], self._to_robot_pose(camera_to_tag_pose, nt_config), distance) # type: ignore
+                    camera_to_tag = PoseMath.from_opencv(observations.tvecs[i][1], observations.rvecs[i][1])
                 else:
                     return None
 
-    def _to_opencv(self, translation: Translation3d) -> List[float]:
-        return [-translation.Y(), -translation.Z(), translation.X()] # type: ignore
-
-    def _to_wpilib(self, tvec: cv2.typing.MatLike, rvec: cv2.typing.MatLike) -> Pose3d:
-        return Pose3d(
-            Translation3d(tvec[2][0], -tvec[0][0], -tvec[1][0]),
-            Rotation3d(
-                numpy.array([rvec[2][0], -rvec[0][0], -rvec[1][0]]),
-                math.sqrt(math.pow(rvec[0][0], 2) + math.pow(rvec[1][0], 2) + math.pow(rvec[2][0], 2))
+                distance = float(numpy.sqrt(numpy.square(camera_to_tag[:3, 3]).sum()))
+                return PoseEstimation([id], PoseMath.to_pose(self._to_robot_pose(camera_to_tag, nt_config)), distance)
+
+    def _temporal_pose(self, tags: List[int], rows: List[int], image_points: numpy.typing.NDArray[numpy.float64], calibration_config: CalibrationConfig, nt_config: NTConfig, timestamp: float) -> Optional[PoseEstimation]:
+        # Takes the pose predicted from the last frames when it reprojects within temporal_max_error. Checking that
+        # costs a projection, where any seeded refine measured slower than SQPNP. Otherwise the frame is solved as usual.
+        object_points = nt_config.tag_layout.object_points[rows].reshape(-1, 3)
+        if self._track != None and timestamp - self._track[2] > nt_config.temporal_timeout:
+            self._track = None
+            self._track_previous = None
+
+        solution = None
+        if self._track != None:
+            rvec, tvec = self._predict(timestamp)
+            if self._reprojection_error(object_points, image_points, rvec, tvec, calibration_config) <= nt_config.temporal_max_error:
+                solution = (rvec, tvec)
+
+        if solution == None:
+            solution = self._solve_field_pose(object_points, image_points, calibration_config)
+
+        if solution != None:
+            final_pose, distance = self._multi_tag_pose(solution[1], solution[0], rows, nt_config)
+            if not self._is_outside_field(final_pose, nt_config):
+                self._track_previous = self._track
+                self._track = (solution[0], solution[1], timestamp)
+                return PoseEstimation(tags, PoseMath.to_pose(final_pose), distance)
+
+        self._track = None
+        self._track_previous = None
+        return None
+
+    def _predict(self, timestamp: float) -> Tuple[cv2.typing.MatLike, cv2.typing.MatLike]:
+        assert self._track != None
+        rvec, tvec, last_timestamp = self._track
+        if self._track_previous == None or last_timestamp <= self._track_previous[2]:
+            return rvec.copy(), tvec.copy()
+
+        # Constant velocity: replay the motion between the last two accepted poses, scaled to the time since the last one
+        previous_rvec, previous_tvec, previous_timestamp = self._track_previous
+        inverse_rvec = -previous_rvec
+        inverse_tvec = -cv2.Rodrigues(inverse_rvec)[0] @ previous_tvec
+        delta_rvec, delta_tvec = cv2.composeRT(inverse_rvec, inverse_tvec, rvec, tvec)[:2]
+        scale = (timestamp - last_timestamp) / (last_timestamp - previous_timestamp)
+        return cv2.composeRT(rvec, tvec, delta_rvec * scale, delta_tvec * scale)[:2]
+
+    def _reprojection_error(self, object_points: numpy.typing.NDArray[numpy.float64], image_points: numpy.typing.NDArray[numpy.float64], rvec: cv2.typing.MatLike, tvec: cv2.typing.MatLike, calibration_config: CalibrationConfig) -> float:
+        projected, _ = cv2.projectPoints(object_points, rvec, tvec, calibration_config.distortion_matrix, calibration_config.distortion_coefficients)
+        return float(numpy.sqrt(numpy.square(projected.reshape(-1, 2) - image_points).sum(axis = 1).mean()))
+
+    def _solve_field_pose(self, object_points: numpy.typing.NDArray[numpy.float64], image_points: numpy.typing.NDArray[numpy.float64], calibration_config: CalibrationConfig) -> Optional[Tuple[cv2.typing.MatLike, cv2.typing.MatLike]]:
+        try:
+            _, rvecs, tvecs, errors = cv2.solvePnPGeneric(
+                object_points,
+                image_points,
+                calibration_config.distortion_matrix,
+                calibration_config.distortion_coefficients,
+                flags = cv2.SOLVEPNP_SQPNP
             )
-        )
+        except:
+            return None
 
-    def _is_outside_field(self, pose: Pose3d, nt_config: NTConfig) -> bool:
-        if pose.X() < -nt_config.field_margin[0] or pose.Y() < -nt_config.field_margin[1] or pose.Z() < -nt_config.field_margin[2] or pose.X() > nt_config.field_size[0] + nt_config.field_margin[0]  or pose.Y() > nt_config.field_size[1] + nt_config.field_margin[1] or pose.Z() > nt_config.field_size[2] + nt_config.field_margin[2]: # type: ignore
+        # Several tags on one plane can give SQPNP solutions with near identical errors, which are not an ambiguity
+        best = int(numpy.argmin(numpy.reshape(errors, -1)))
+        return rvecs[best], tvecs[best]
+
+    def _single_tag_pose(self, tvec: cv2.typing.MatLike, rvec: cv2.typing.MatLike, inverse: bool, row: int, nt_config: NTConfig) -> Tuple[PoseMath.Matrix, float]:
+        camera_to_tag = PoseMath.from_opencv(tvec, rvec)
+        distance = float(numpy.sqrt(numpy.square(camera_to_tag[:3, 3]).sum()))
+        if inverse:
+            camera_to_tag = PoseMath.invert(camera_to_tag)
+        return self._to_robot_pose(nt_config.tag_layout.matrices[row] @ camera_to_tag, nt_config), distance
+
+    def _multi_tag_pose(self, tvec: cv2.typing.MatLike, rvec: cv2.typing.MatLike, rows: List[int], nt_config: NTConfig) -> Tuple[PoseMath.Matrix, float]:
+        field_to_camera = PoseMath.invert(PoseMath.from_opencv(tvec, rvec))
+        final_pose = self._to_robot_pose(field_to_camera, nt_config)
+        offsets = nt_config.tag_layout.matrices[rows, :3, 3] - final_pose[:3, 3]
+        return final_pose, float(numpy.sqrt(numpy.square(offsets).sum(axis = 1)).mean())
+
+    def _is_outside_field(self, pose: PoseMath.Matrix, nt_config: NTConfig) -> bool:
+        x, y, z = pose[:3, 3].tolist()
+        if x < -nt_config.field_margin[0] or y < -nt_config.field_margin[1] or z < -nt_config.field_margin[2] or x > nt_config.field_size[0] + nt_config.field_margin[0] or y > nt_config.field_size[1] + nt_config.field_margin[1] or z > nt_config.field_size[2] + nt_config.field_margin[2]:
             return True
         else:
             return False
 
-    def _to_robot_pose(self, pose: Pose3d, nt_config: NTConfig) -> Pose3d:
-        return pose.transformBy(Transform3d(Translation3d(nt_config.camera_position[0], nt_config.camera_position[1], nt_config.camera_position[2]), Rotation3d(nt_config.camera_position[3], nt_config.camera_position[4], nt_config.camera_position[5])).inverse())
+    def _to_robot_pose(self, pose: PoseMath.Matrix, nt_config: NTConfig) -> PoseMath.Matrix:
+        if nt_config.camera_position != self._camera_position:
+            self._camera_position = list(nt_config.camera_position)
+            self._camera_to_robot = PoseMath.invert(PoseMath.from_pose(Pose3d(
+                Translation3d(nt_config.camera_position[0], nt_config.camera_position[1], nt_config.camera_position[2]),
+                Rotation3d(nt_config.camera_position[3], nt_config.camera_position[4], nt_config.camera_position[5])
+            )))
+        return pose @ self._camera_to_robot
@@ -0,0 +1,54 @@
+import cv2
+import cv2.typing
+import numpy
+import numpy.typing
+from wpimath.geometry import Pose3d, Rotation3d, Translation3d
+
+Matrix = numpy.typing.NDArray[numpy.float64]
+
+OPENCV_TO_WPILIB = numpy.array([
+    [0.0, 0.0, 1.0],
+    [-1.0, 0.0, 0.0],
+    [0.0, -1.0, 0.0]
+])
+
+def _empty() -> Matrix:
+    matrix = numpy.empty((4, 4))
+    matrix[3] = (0.0, 0.0, 0.0, 1.0)
+    return matrix
+
+def from_pose(pose: Pose3d) -> Matrix:
+    q = pose.rotation().getQuaternion()
+    w, x, y, z = q.W(), q.X(), q.Y(), q.Z()
+    matrix = numpy.identity(4)
+    matrix[:3, :3] = [
+        [1 - 2 * (y * y + z * z), 2 * (x * y - z * w), 2 * (x * z + y * w)],
+        [2 * (x * y + z * w), 1 - 2 * (x * x + z * z), 2 * (y * z - x * w)],
+        [2 * (x * z - y * w), 2 * (y * z + x * w), 1 - 2 * (x * x + y * y)]
+    ]
+    matrix[:3, 3] = [pose.X(), pose.Y(), pose.Z()]
+    return matrix
+
+def from_opencv(tvec: cv2.typing.MatLike, rvec: cv2.typing.MatLike) -> Matrix:
+    matrix = _empty()
+    matrix[:3, :3] = cv2.Rodrigues(OPENCV_TO_WPILIB @ numpy.reshape(rvec, 3))[0]
+    matrix[:3, 3] = OPENCV_TO_WPILIB @ numpy.reshape(tvec, 3)
+    return matrix
+
+def invert(matrix: Matrix) -> Matrix:
+    inverse = _empty()
+    inverse[:3, :3] = matrix[:3, :3].T
+    inverse[:3, 3] = inverse[:3, :3] @ -matrix[:3, 3]
+    return inverse
+
+def to_pose(matrix: Matrix) -> Pose3d:
+    x, y, z = matrix[:3, 3].tolist()
+    return Pose3d(Translation3d(x, y, z), Rotation3d(matrix[:3, :3]))
+
+def rotation_vectors_to_quaternions(rvecs: Matrix) -> Matrix:
+    # Converts (..., 3) rotation vectors to (..., 4) quaternions ordered w, x, y, z
+    angles = numpy.sqrt(numpy.square(rvecs).sum(axis = -1, keepdims = True))
+    quaternions = numpy.empty(rvecs.shape[:-1] + (4,))
+    quaternions[..., :1] = numpy.cos(angles / 2.0)
+    quaternions[..., 1:] = rvecs * numpy.divide(numpy.sin(angles / 2.0), angles, out = numpy.full_like(angles, 0.5), where = angles > 0.0)
+    return quaternions
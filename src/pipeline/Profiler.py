@@ -0,0 +1,207 @@
+import cProfile
+import datetime
+import math
+import os
+import pstats
+import sys
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from config.ConnectionConfig import ConnectionConfig
+from config.NTConfig import NTConfig
+
+class Profiler:
+    # Time boxed profiles of the running process. In "sampling" mode a separate thread reads the stack of every thread
+    # at a fixed interval and writes the counts as collapsed stacks for flame graph tools. In "cprofile" mode the frame
+    # loop threads profile themselves with cProfile and the results are merged into a pstats file. Between profiles
+    # nothing runs, and the checks in update and attach are all the frame loop pays.
+    MODES = { "sampling": ".collapsed", "cprofile": ".pstats" }
+    DEFAULT_SECONDS = 10.0
+    MAX_SECONDS = 300.0
+    SAMPLE_INTERVAL = 0.005
+    FINISH_TIMEOUT = 2.0
+
+    _connection_config: ConnectionConfig
+    _lock: threading.Lock
+    _local: threading.local
+    _finished: List[cProfile.Profile]
+    _done: threading.Event
+    _running = False
+    _requested = False
+    _session = 0
+    _attaching = False
+    _attached = 0
+    _enabled = 0
+
+    def __init__(self, connection_config: ConnectionConfig) -> None:
+        self._connection_config = connection_config
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._finished = []
+        self._done = threading.Event()
+
+    def update(self, nt_config: NTConfig) -> None:
+        # The profile topic starts one profile when it turns on, and has to be turned off again before the next
+        if not nt_config.profile:
+            self._requested = False
+            return
+
+        if not self._requested:
+            self._requested = True
+            try:
+                if self.start(nt_config.profile_seconds) == None:
+                    print("Not profiling, a profile is already running")
+            except ValueError as error:
+                print("Not profiling: " + str(error))
+
+    def start(self, seconds: float, mode: str = "") -> Optional[str]:
+        # Returns the name the profile will be saved under, or None when a profile is already running
+        if mode == "":
+            mode = self._connection_config.profile_mode
+        if mode not in self.MODES:
+            raise ValueError("Unknown profile mode \"" + mode + "\"")
+        if not math.isfinite(seconds):
+            raise ValueError("Profile length must be a number of seconds")
+        seconds = min(max(seconds, self.SAMPLE_INTERVAL), self.MAX_SECONDS)
+
+        with self._lock:
+            if self._running:
+                return None
+            self._running = True
+
+        name = "Blacklight-" + self._connection_config.name + "_" + datetime.datetime.now().strftime("%Y%m%d_%H%M%S") + self.MODES[mode]
+        target = self._sample if mode == "sampling" else self._collect
+        threading.Thread(target = target, daemon = True, args = (name, seconds), name = "profiler").start()
+        print("Profiling for %.1f s with %s, saving to %s" % (seconds, mode, name))
+        return name
+
+    def is_running(self) -> bool:
+        return self._running
+
+    def attach(self) -> None:
+        # Called by each frame loop stage. cProfile only sees the thread that enabled it, so while a cProfile run is
+        # collecting each thread turns it on for itself here, and off again once the run is over.
+        if not self._attaching and self._enabled == 0:
+            return
+
+        state: Optional[Tuple[int, cProfile.Profile]] = getattr(self._local, "state", None)
+        if state == None:
+            if not self._attaching:
+                return
+            with self._lock:
+                if not self._attaching:
+                    return
+                self._attached += 1
+                self._enabled += 1
+                session = self._session
+            profile = cProfile.Profile()
+            self._local.state = (session, profile)
+            profile.enable()
+        elif not self._attaching or state[0] != self._session:
+            state[1].disable()
+            self._local.state = None
+            with self._lock:
+                self._enabled -= 1
+                # Threads that come back after the run gave up on them are left out
+                if state[0] == self._session and not self._attaching:
+                    self._finished.append(state[1])
+                    if len(self._finished) == self._attached:
+                        self._done.set()
+
+    def files(self) -> List[str]:
+        directory = self._connection_config.profile_directory
+        if not os.path.isdir(directory):
+            return []
+        return sorted(name for name in os.listdir(directory) if os.path.splitext(name)[1] in self.MODES.values())
+
+    def path(self, name: str) -> Optional[str]:
+        # Only finished profiles can be read, which also keeps names from reaching outside the directory
+        if name not in self.files():
+            return None
+        return os.path.join(self._connection_config.profile_directory, name)
+
+    def _sample(self, name: str, seconds: float) -> None:
+        # The sampler needs the GIL to read stacks, and by default a busy thread only hands it over every 5 ms or when
+        # it blocks, which would hide short bursts of Python code. The switch interval is shortened while sampling.
+        switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(self.SAMPLE_INTERVAL / 10.0)
+        try:
+            stacks: Dict[str, int] = {}
+            samples = 0
+            own = threading.get_ident()
+            next_sample = time.perf_counter()
+            deadline = next_sample + seconds
+            while next_sample < deadline:
+                names = { thread.ident: thread.name for thread in threading.enumerate() }
+                for ident, frame in sys._current_frames().items():
+                    if ident == own:
+                        continue
+                    stack: List[str] = []
+                    while frame != None:
+                        stack.append(frame.f_code.co_name + " (" + os.path.basename(frame.f_code.co_filename) + ":" + str(frame.f_code.co_firstlineno) + ")")
+                        frame = frame.f_back # type: ignore
+                    stack.append(names.get(ident, str(ident)))
+                    key = ";".join(reversed(stack))
+                    stacks[key] = stacks.get(key, 0) + 1
+                samples += 1
+
+                next_sample += self.SAMPLE_INTERVAL
+                delay = next_sample - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    next_sample = time.perf_counter()
+
+            temporary = self._temporary(name)
+            with open(temporary, "w") as file:
+                for stack, count in sorted(stacks.items()):
+                    file.write(stack + " " + str(count) + "\n")
+            self._save(temporary, name)
+            print("Saved profile " + name + " with " + str(samples) + " samples")
+        except OSError as error:
+            print("Unable to save profile " + name + ": " + str(error))
+        finally:
+            sys.setswitchinterval(switch_interval)
+            self._running = False
+
+    def _collect(self, name: str, seconds: float) -> None:
+        try:
+            with self._lock:
+                self._session += 1
+                self._attached = 0
+                self._finished = []
+                self._done.clear()
+                self._attaching = True
+            time.sleep(seconds)
+
+            with self._lock:
+                self._attaching = False
+                if len(self._finished) == self._attached:
+                    self._done.set()
+            if not self._done.wait(self.FINISH_TIMEOUT):
+                print("Some frame loop threads did not finish profiling in time and are left out")
+            with self._lock:
+                profiles = list(self._finished)
+
+            if len(profiles) == 0:
+                print("Not saving profile " + name + ", no frame loop threads ran")
+                return
+            stats = pstats.Stats(profiles[0])
+            for profile in profiles[1:]:
+                stats.add(profile)
+            temporary = self._temporary(name)
+            stats.dump_stats(temporary)
+            self._save(temporary, name)
+            print("Saved profile " + name + " from " + str(len(profiles)) + " threads")
+        except OSError as error:
+            print("Unable to save profile " + name + ": " + str(error))
+        finally:
+            self._running = False
+
+    def _temporary(self, name: str) -> str:
+        os.makedirs(self._connection_config.profile_directory, exist_ok = True)
+        return os.path.join(self._connection_config.profile_directory, name + ".tmp")
+
+    def _save(self, temporary: str, name: str) -> None:
+        os.replace(temporary, os.path.join(self._connection_config.profile_directory, name))
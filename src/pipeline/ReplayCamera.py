@@ -0,0 +1,52 @@
+import cv2
+import cv2.typing
+import numpy
+import time
+from typing import BinaryIO, Optional, Tuple
+
+from config.NTConfig import NTConfig, deserialize
+from pipeline.FrameRecorder import FrameRecorder
+
+class ReplayCamera:
+    # Stands in for Camera, reading frames back from a FrameRecorder file instead of a device
+    timestamp = 0.0
+    nt_config: Optional[NTConfig] = None
+
+    _file: BinaryIO
+    _realtime: bool
+    _start: Optional[Tuple[float, float]] = None
+    _config_source = b""
+
+    def __init__(self, filename: str, realtime: bool = False) -> None:
+        self._file = open(filename, "rb")
+        self._realtime = realtime
+
+    def read(self, nt_config: NTConfig) -> Tuple[bool, cv2.typing.MatLike]:
+        header = self._file.read(FrameRecorder.HEADER.size)
+        if len(header) < FrameRecorder.HEADER.size:
+            return False, cv2.Mat(numpy.ndarray([]))
+
+        magic, timestamp, config_length, image_length = FrameRecorder.HEADER.unpack(header)
+        config_source = self._file.read(config_length)
+        image = self._file.read(image_length)
+        if magic != FrameRecorder.MAGIC or len(config_source) < config_length or len(image) < image_length:
+            print("Recording is truncated or corrupt, stopping replay")
+            return False, cv2.Mat(numpy.ndarray([]))
+
+        # Snapshots rarely change between frames, so only rebuild the config (and its tag layout) when they do
+        if config_source != self._config_source or self.nt_config == None:
+            self.nt_config = deserialize(config_source.decode("utf-8"))
+            self._config_source = config_source
+
+        if self._realtime:
+            if self._start == None:
+                self._start = (time.perf_counter(), timestamp)
+            delay = (timestamp - self._start[1]) - (time.perf_counter() - self._start[0])
+            if delay > 0:
+                time.sleep(delay)
+
+        self.timestamp = timestamp
+        return True, cv2.imdecode(numpy.frombuffer(image, numpy.uint8), cv2.IMREAD_UNCHANGED)
+
+    def release(self) -> None:
+        self._file.close()
@@ -1,25 +1,29 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 import cv2
 import cv2.typing
-from http.server import BaseHTTPRequestHandler, HTTPServer
-from io import BytesIO
-import numpy
-from PIL import Image
-import socketserver
+from http import HTTPStatus
+import json
 import threading
 import time
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
 
 from config.ConnectionConfig import ConnectionConfig
+from filter.OverlayMarkers import OverlayMarkers
+from pipeline.ApriltagDetector import ApriltagDetection
+from pipeline.H264Stream import H264Stream
+from pipeline.LatencyMetrics import LatencyMetrics
+from pipeline.Profiler import Profiler
 
 class StreamOutput:
-    _capture: cv2.typing.MatLike = numpy.array([])
-
-    class StreamServer(socketserver.ThreadingMixIn, HTTPServer):
-        allow_reuse_address = True
-        daemon_threads = True
-
-    def _make_handler(self_mjpeg): # type: ignore
-        class StreamHandler(BaseHTTPRequestHandler):
-            HTML = """
+    DEFAULT_QUALITY = 10
+    SNAPSHOT_TIMEOUT = 5.0
+    CLIENT_TIMEOUT = 10.0
+    WRITE_BUFFER_LIMIT = 64 * 1024
+    PREVIEW_MAX_WIDTH = 800
+    H264_MAX_BACKLOG = 64
+    HTML = """
     <html>
         <head>
             <title>Blacklight</title>
@@ -44,52 +48,344 @@ class StreamOutput:
     </html>
             """
 
-            def do_GET(self):
-                if self.path == "/":
-                    content = self.HTML.encode("utf-8")
-                    self.send_response(200)
-                    self.send_header("Content-Type", "text/html")
-                    self.send_header("Content-Length", str(len(content)))
-                    self.end_headers()
-                    self.wfile.write(content)
-                elif self.path == "/stream.mjpg":
-                    self.send_response(200)
-                    self.send_header("Age", "0")
-                    self.send_header("Cache-Control", "no-cache, private")
-                    self.send_header("Pragma", "no-cache")
-                    self.send_header("Content-Type", "multipart/x-mixed-replace; boundary=FRAME")
-                    self.end_headers()
-
-                    try:
-                        while True:
-                            if not self_mjpeg._capture.any():
-                                time.sleep(0.1)
-                            else:
-                                pil_im = Image.fromarray(self_mjpeg._capture) # type: ignore
-                                stream = BytesIO()
-                                pil_im.save(stream, format = "JPEG", quality = 10)
-                                frame_data = stream.getvalue()
-
-                                self.wfile.write(b"--FRAME\r\n")
-                                self.send_header("Content-Type", "image/jpeg")
-                                self.send_header("Content-Length", str(len(frame_data)))
-                                self.end_headers()
-                                self.wfile.write(frame_data)
-                                self.wfile.write(b"\r\n")
-                    except Exception as e:
-                        print("Removed streaming client %s: %s", self.client_address, str(e))
-                else:
-                    self.send_error(404)
-                    self.end_headers()
-
-        return StreamHandler
+    _lock: threading.Lock
+    _encoder: ThreadPoolExecutor
+    _loop: Optional[asyncio.AbstractEventLoop] = None
+    _frame_event: asyncio.Event
+    _max_clients = 0
+    _streams = 0
+    _viewers = 0
+    _capture: Optional[cv2.typing.MatLike] = None
+    _sequence = 0
+    _encoded: Dict[Tuple[int, float], Tuple[int, bytes]]
+    _overlay_markers = OverlayMarkers()
+    _metrics: LatencyMetrics
+    _profiler: Profiler
+    _h264: Optional[H264Stream] = None
+    _h264_clients: List["asyncio.Queue[Optional[bytes]]"]
+
+    def __init__(self, metrics: LatencyMetrics, profiler: Profiler) -> None:
+        self._metrics = metrics
+        self._profiler = profiler
+        self._lock = threading.Lock()
+        self._encoder = ThreadPoolExecutor(max_workers = 1, thread_name_prefix = "stream-encoder")
+        self._encoded = {}
+        self._h264_clients = []
+
+    async def _handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        writer.transport.set_write_buffer_limits(high = self.WRITE_BUFFER_LIMIT) # type: ignore
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), self.CLIENT_TIMEOUT)
+            while True:
+                header_line = await asyncio.wait_for(reader.readline(), self.CLIENT_TIMEOUT)
+                if header_line in (b"\r\n", b"\n", b""):
+                    break
+
+            request = request_line.decode("latin-1").split()
+            if len(request) < 2:
+                return
+            elif request[0] != "GET":
+                await self._send_response(writer, 405)
+                return
+
+            url = urlparse(request[1])
+            quality, scale, fps = self._parse_params(url.query)
+
+            if url.path == "/":
+                await self._send_response(writer, 200, { "Content-Type": "text/html" }, self.HTML.encode("utf-8"))
+            elif url.path == "/snapshot.jpg":
+                await self._send_snapshot(writer, quality, scale)
+            elif url.path == "/stream.mjpg" or url.path == "/stream.ts":
+                # Only streams are limited, so monitoring and profiling stay reachable while every slot is taken
+                if self._streams >= self._max_clients:
+                    await self._send_response(writer, 503)
+                    return
+                self._streams += 1
+                try:
+                    if url.path == "/stream.mjpg":
+                        await self._send_stream(writer, quality, scale, fps)
+                    else:
+                        await self._send_h264_stream(writer)
+                finally:
+                    self._streams -= 1
+            elif url.path == "/metrics":
+                await self._send_response(writer, 200, { "Content-Type": "text/plain; version=0.0.4" }, self._metrics.to_text().encode("utf-8"))
+            elif url.path == "/profile":
+                await self._start_profile(writer, url.query)
+            elif url.path == "/profiles":
+                body = json.dumps({ "running": self._profiler.is_running(), "files": self._profiler.files() })
+                await self._send_response(writer, 200, { "Content-Type": "application/json" }, body.encode("utf-8"))
+            elif url.path.startswith("/profiles/"):
+                await self._send_profile(writer, url.path[len("/profiles/"):])
+            else:
+                await self._send_response(writer, 404)
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def _send_response(self, writer: asyncio.StreamWriter, status: int, headers: Optional[Dict[str, str]] = None, body: Optional[bytes] = None) -> None:
+        if body == None:
+            body = HTTPStatus(status).phrase.encode("utf-8")
+            headers = { "Content-Type": "text/plain" }
+        elif headers == None:
+            headers = {}
+
+        head = "HTTP/1.0 " + str(status) + " " + HTTPStatus(status).phrase + "\r\n"
+        for key, value in headers.items():
+            head += key + ": " + value + "\r\n"
+        head += "Content-Length: " + str(len(body)) + "\r\n\r\n"
+        writer.write(head.encode("latin-1") + body)
+        await asyncio.wait_for(writer.drain(), self.CLIENT_TIMEOUT)
+
+    async def _send_snapshot(self, writer: asyncio.StreamWriter, quality: int, scale: float) -> None:
+        sequence = self._add_viewer()
+        try:
+            frame = await self._get_frame(sequence, quality, scale, self.SNAPSHOT_TIMEOUT)
+        finally:
+            self._remove_viewer()
+
+        if frame == None:
+            await self._send_response(writer, 503)
+        else:
+            await self._send_response(writer, 200, {
+                "Cache-Control": "no-cache, private",
+                "Pragma": "no-cache",
+                "Content-Type": "image/jpeg"
+            }, frame[1])
+
+    async def _send_stream(self, writer: asyncio.StreamWriter, quality: int, scale: float, fps: float) -> None:
+        writer.write(
+            b"HTTP/1.0 200 OK\r\n"
+            + b"Age: 0\r\n"
+            + b"Cache-Control: no-cache, private\r\n"
+            + b"Pragma: no-cache\r\n"
+            + b"Content-Type: multipart/x-mixed-replace; boundary=FRAME\r\n\r\n"
+        )
+
+        sequence = self._add_viewer()
+        loop = asyncio.get_running_loop()
+        try:
+            last_sent = 0.0
+            while True:
+                if fps > 0:
+                    delay = last_sent + 1.0 / fps - loop.time()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+
+                frame = await self._get_frame(sequence, quality, scale, None)
+                if frame == None:
+                    continue
+                sequence, frame_data = frame
+                last_sent = loop.time()
+
+                writer.write(
+                    b"--FRAME\r\n"
+                    + b"Content-Type: image/jpeg\r\n"
+                    + ("Content-Length: " + str(len(frame_data)) + "\r\n\r\n").encode("latin-1")
+                    + frame_data
+                    + b"\r\n"
+                )
+                await asyncio.wait_for(writer.drain(), self.CLIENT_TIMEOUT)
+        except Exception as e:
+            print("Removed streaming client " + str(writer.get_extra_info("peername")) + ": " + str(e))
+        finally:
+            self._remove_viewer()
+
+    async def _send_h264_stream(self, writer: asyncio.StreamWriter) -> None:
+        if self._h264 == None:
+            await self._send_response(writer, 404)
+            return
+
+        writer.write(
+            b"HTTP/1.0 200 OK\r\n"
+            + b"Age: 0\r\n"
+            + b"Cache-Control: no-cache, private\r\n"
+            + b"Pragma: no-cache\r\n"
+            + b"Content-Type: video/mp2t\r\n\r\n"
+        )
+
+        # All clients share one encoder, which only runs while at least one of them is connected
+        client: "asyncio.Queue[Optional[bytes]]" = asyncio.Queue()
+        self._h264_clients.append(client)
+        self._add_viewer()
+        self._h264.start()
+        try:
+            while True:
+                data = await client.get()
+                if data == None:
+                    raise ConnectionError("H.264 encoder unavailable or client too far behind")
+                writer.write(data)
+                await asyncio.wait_for(writer.drain(), self.CLIENT_TIMEOUT)
+        except Exception as e:
+            print("Removed H.264 streaming client " + str(writer.get_extra_info("peername")) + ": " + str(e))
+        finally:
+            if client in self._h264_clients:
+                self._h264_clients.remove(client)
+            if len(self._h264_clients) == 0:
+                self._h264.stop()
+            self._remove_viewer()
+
+    async def _start_profile(self, writer: asyncio.StreamWriter, query: str) -> None:
+        params = parse_qs(query)
+        try:
+            seconds = float(params.get("seconds", [Profiler.DEFAULT_SECONDS])[0])
+            mode = params.get("mode", [""])[0]
+            name = self._profiler.start(seconds, mode)
+        except ValueError as error:
+            await self._send_response(writer, 400, { "Content-Type": "text/plain" }, str(error).encode("utf-8"))
+            return
+
+        if name == None:
+            await self._send_response(writer, 409, { "Content-Type": "text/plain" }, b"A profile is already running")
+            return
+        body = json.dumps({ "file": name, "url": "/profiles/" + name })
+        await self._send_response(writer, 202, { "Content-Type": "application/json" }, body.encode("utf-8"))
+
+    async def _send_profile(self, writer: asyncio.StreamWriter, name: str) -> None:
+        path = self._profiler.path(name)
+        if path == None:
+            await self._send_response(writer, 404)
+            return
+
+        def read() -> bytes:
+            with open(path, "rb") as file: # type: ignore
+                return file.read()
+        body = await asyncio.get_running_loop().run_in_executor(None, read)
+        await self._send_response(writer, 200, { "Content-Type": "application/octet-stream", "Content-Disposition": "attachment; filename=\"" + name + "\"" }, body)
+
+    def _on_h264_data(self, data: Optional[bytes]) -> None:
+        if self._loop != None:
+            self._loop.call_soon_threadsafe(self._send_h264_data, data)
+
+    def _send_h264_data(self, data: Optional[bytes]) -> None:
+        # A client that cannot keep up is dropped, since skipping part of the stream would corrupt it
+        for client in list(self._h264_clients):
+            if data == None or client.qsize() >= self.H264_MAX_BACKLOG:
+                self._h264_clients.remove(client)
+                client.put_nowait(None)
+            else:
+                client.put_nowait(data)
+
+    def _parse_params(self, query: str) -> Tuple[int, float, float]:
+        params = parse_qs(query)
+        quality = self.DEFAULT_QUALITY
+        scale = 1.0
+        fps = 0.0
+        try:
+            if "quality" in params:
+                quality = min(max(int(params["quality"][0]), 1), 100)
+            if "scale" in params:
+                scale = round(min(max(float(params["scale"][0]), 0.05), 1.0), 2)
+            if "fps" in params:
+                fps = max(float(params["fps"][0]), 0.0)
+        except ValueError:
+            pass
+        return quality, scale, fps
+
+    def _add_viewer(self) -> int:
+        with self._lock:
+            self._viewers += 1
+            return self._sequence
+
+    def _remove_viewer(self) -> None:
+        with self._lock:
+            self._viewers -= 1
+            if self._viewers == 0:
+                self._capture = None
+                self._encoded = {}
+
+    def _notify_frame(self) -> None:
+        event = self._frame_event
+        self._frame_event = asyncio.Event()
+        event.set()
+
+    async def _get_frame(self, last_sequence: int, quality: int, scale: float, timeout: Optional[float]) -> Optional[Tuple[int, bytes]]:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout if timeout != None else None
+        while True:
+            with self._lock:
+                if self._sequence > last_sequence and self._capture is not None:
+                    sequence = self._sequence
+                    capture = self._capture
+                    cached = self._encoded.get((quality, scale))
+                    break
+                event = self._frame_event
+
+            try:
+                await asyncio.wait_for(event.wait(), deadline - loop.time() if deadline != None else None)
+            except asyncio.TimeoutError:
+                return None
+
+        if cached != None and cached[0] >= sequence:
+            return cached
+        return await loop.run_in_executor(self._encoder, self._encode, sequence, capture, quality, scale)
+
+    def _encode(self, sequence: int, capture: cv2.typing.MatLike, quality: int, scale: float) -> Tuple[int, bytes]:
+        # The cache is shared with the server and frame loop threads, so it is only read and replaced under the lock
+        key = (quality, scale)
+        with self._lock:
+            cached = self._encoded.get(key)
+        if cached != None and cached[0] >= sequence:
+            return cached
+
+        start = time.perf_counter()
+        jpeg = (sequence, self.encode_jpeg(capture, quality, scale))
+        with self._lock:
+            encoded = {k: v for k, v in self._encoded.items() if v[0] >= sequence}
+            encoded[key] = jpeg
+            self._encoded = encoded
+        self._metrics.record("encode", start)
+        return jpeg
+
+    async def _serve(self, port: int) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._frame_event = asyncio.Event()
+        server = await asyncio.start_server(self._handle_client, port = port, reuse_address = True)
+        async with server:
+            await server.serve_forever()
 
     def _run(self, port: int) -> None:
-        server = self.StreamServer(("", port), self._make_handler())
-        server.serve_forever()
+        asyncio.run(self._serve(port))
 
     def start_server(self, connection_config: ConnectionConfig) -> None:
+        self._max_clients = connection_config.max_stream_clients
+        self._h264 = H264Stream(connection_config.h264_bitrate, connection_config.h264_keyframe_interval, self._on_h264_data)
         threading.Thread(target = self._run, daemon = True, args = (connection_config.video_port,)).start()
 
-    def update(self, capture: cv2.typing.MatLike) -> None:
-        self._capture = capture.copy()
+    def has_viewers(self) -> bool:
+        return self._viewers > 0
+
+    def update(self, capture: cv2.typing.MatLike, detections: Optional[List[ApriltagDetection]]) -> None:
+        if not self.has_viewers() or self._loop == None:
+            return
+
+        preview = self.make_preview(capture, detections)
+        if self._h264 != None and len(self._h264_clients) > 0:
+            self._h264.update(preview)
+
+        with self._lock:
+            self._capture = preview
+            self._sequence += 1
+        self._loop.call_soon_threadsafe(self._notify_frame)
+
+    def make_preview(self, capture: cv2.typing.MatLike, detections: Optional[List[ApriltagDetection]]) -> cv2.typing.MatLike:
+        # A color copy of the capture, at most PREVIEW_MAX_WIDTH wide, with the detections drawn on
+        scale = min(self.PREVIEW_MAX_WIDTH / capture.shape[1], 1.0)
+        if scale < 1.0:
+            preview = cv2.resize(capture, None, fx = scale, fy = scale, interpolation = cv2.INTER_AREA)
+        else:
+            preview = capture.copy()
+
+        if len(preview.shape) == 2:
+            preview = cv2.cvtColor(preview, cv2.COLOR_GRAY2BGR)
+
+        if detections != None and len(detections) > 0:
+            self._overlay_markers.add_detections(preview, detections, scale)
+        return preview
+
+    def encode_jpeg(self, preview: cv2.typing.MatLike, quality: int, scale: float) -> bytes:
+        if scale < 1.0:
+            preview = cv2.resize(preview, None, fx = scale, fy = scale, interpolation = cv2.INTER_AREA)
+        _, jpeg = cv2.imencode(".jpg", preview, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        return jpeg.tobytes()
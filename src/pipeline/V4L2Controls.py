@@ -0,0 +1,40 @@
+import fcntl
+import os
+import struct
+from typing import Optional
+
+class V4L2Controls:
+    # Control ids and the VIDIOC_S_CTRL request from linux/videodev2.h
+    BRIGHTNESS = 0x00980900
+    GAIN = 0x00980913
+    SHARPNESS = 0x0098091b
+    EXPOSURE_AUTO = 0x009a0901
+    EXPOSURE_ABSOLUTE = 0x009a0902
+    VIDIOC_S_CTRL = 0xc008561c
+    CONTROL = struct.Struct("=Ii")
+
+    _device_path: str
+    _fd: Optional[int] = None
+
+    def __init__(self, device_path: str) -> None:
+        self._device_path = device_path
+        try:
+            self._fd = os.open(device_path, os.O_RDWR | os.O_NONBLOCK)
+        except OSError as e:
+            print("Unable to open " + device_path + " for camera controls: " + str(e))
+
+    def set(self, name: str, control: int, value: int) -> bool:
+        if self._fd == None:
+            return False
+
+        try:
+            fcntl.ioctl(self._fd, self.VIDIOC_S_CTRL, self.CONTROL.pack(control, value))
+            return True
+        except OSError as e:
+            print("Unable to set " + name + " to " + str(value) + " on " + self._device_path + ": " + str(e))
+            return False
+
+    def close(self) -> None:
+        if self._fd != None:
+            os.close(self._fd)
+            self._fd = None
@@ -0,0 +1,29 @@
+import argparse
+import numpy
+
+import pipeline.BinaryLog as BinaryLog
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Summarize Blacklight binary logs")
+    parser.add_argument("logs", nargs = "+")
+    args = parser.parse_args()
+
+    records = numpy.concatenate([BinaryLog.load(filename) for filename in args.logs])
+    if len(records) == 0:
+        print("No records")
+        exit()
+
+    duration = records["timestamp"][-1] - records["timestamp"][0]
+    with_pose = numpy.count_nonzero(~numpy.isnan(records["pose"][:, 0]))
+    with_tags = numpy.count_nonzero(records["tag_count"] > 0)
+    print(str(len(records)) + " frames over %.1f s, %d with tags, %d with a pose" % (duration, with_tags, with_pose))
+
+    print("stage     p50 ms   p95 ms   p99 ms   max ms")
+    for i, stage in enumerate(BinaryLog.STAGES + ["latency"]):
+        values = records["timings"][:, i] if stage != "latency" else records["latency"]
+        values = values[~numpy.isnan(values)]
+        if len(values) > 0:
+            print("%-7s %8.3f %8.3f %8.3f %8.3f" % (stage, *numpy.percentile(values, [50, 95, 99]), values.max()))
+
+    ids, counts = numpy.unique(records["ids"][records["ids"] >= 0], return_counts = True)
+    print("Tag sightings: " + ", ".join(str(id) + ": " + str(count) for id, count in zip(ids, counts)))
@@ -0,0 +1,96 @@
+import argparse
+import json
+import math
+import time
+from typing import Any, Dict, List
+
+from config.CalibrationConfig import CalibrationConfigLoader
+from config.DetectorProfile import DetectorProfileLoader
+from config.NTConfig import generate_default
+from pipeline.ApriltagDetector import ApriltagDetector
+from pipeline.LatencyMetrics import LatencyMetrics
+from pipeline.PoseEstimator import PoseEstimator
+from pipeline.ReplayCamera import ReplayCamera
+
+def replay(filename: str, calibration_file: str, realtime: bool) -> List[Dict[str, Any]]:
+    calibration_configs = CalibrationConfigLoader(calibration_file).load()
+    camera = ReplayCamera(filename, realtime)
+    apriltag_detector = ApriltagDetector(DetectorProfileLoader().load())
+    pose_estimator = PoseEstimator()
+    metrics = LatencyMetrics()
+    results: List[Dict[str, Any]] = []
+
+    start = time.perf_counter()
+    while True:
+        stage_start = time.perf_counter()
+        success, capture = camera.read(generate_default())
+        if not success or camera.nt_config == None:
+            break
+        metrics.record("capture", stage_start)
+        nt_config = camera.nt_config
+
+        result: Dict[str, Any] = { "timestamp": camera.timestamp, "ids": [], "pose": None }
+        results.append(result)
+        calibration_config = calibration_configs.get(nt_config.calibration_name, capture.shape[1], capture.shape[0])
+        if calibration_config == None:
+            continue
+
+        stage_start = time.perf_counter()
+        detections = apriltag_detector.search(capture, nt_config)
+        metrics.record("detect", stage_start)
+        result["ids"] = sorted(int(detection.id) for detection in detections)
+
+        stage_start = time.perf_counter()
+        pose_estimation = pose_estimator.get_estimated_pose(detections, calibration_config, nt_config, camera.timestamp)
+        metrics.record("pose", stage_start)
+        if pose_estimation != None:
+            pose = pose_estimation.pose
+            result["pose"] = [pose.X(), pose.Y(), pose.Z(), pose.rotation().X(), pose.rotation().Y(), pose.rotation().Z(), pose_estimation.distance]
+    elapsed = time.perf_counter() - start
+    camera.release()
+
+    print("Replayed " + str(len(results)) + " frames in %.2f s (%.1f fps)" % (elapsed, len(results) / elapsed if elapsed > 0 else 0.0))
+    print("stage     p50 ms   p95 ms   p99 ms   max ms")
+    for stage, values in metrics.summary().items():
+        print("%-7s %8.3f %8.3f %8.3f %8.3f" % (stage, *values))
+    return results
+
+def compare(results: List[Dict[str, Any]], baseline: List[Dict[str, Any]]) -> None:
+    if len(results) != len(baseline):
+        print("Frame count differs: " + str(len(results)) + " vs " + str(len(baseline)) + " in baseline")
+
+    id_changes = 0
+    pose_changes = 0
+    translation_diffs: List[float] = []
+    rotation_diffs: List[float] = []
+    for result, expected in zip(results, baseline):
+        if result["ids"] != expected["ids"]:
+            id_changes += 1
+        if (result["pose"] == None) != (expected["pose"] == None):
+            pose_changes += 1
+        elif result["pose"] != None:
+            translation_diffs.append(math.dist(result["pose"][:3], expected["pose"][:3]))
+            rotation_diffs.append(max(abs(math.remainder(a - b, math.tau)) for a, b in zip(result["pose"][3:6], expected["pose"][3:6])))
+
+    print("Frames with different tag ids: " + str(id_changes))
+    print("Frames gaining or losing a pose: " + str(pose_changes))
+    if len(translation_diffs) > 0:
+        print("Translation diff: mean %.2e m, max %.2e m" % (sum(translation_diffs) / len(translation_diffs), max(translation_diffs)))
+        print("Rotation diff: mean %.2e rad, max %.2e rad" % (sum(rotation_diffs) / len(rotation_diffs), max(rotation_diffs)))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Replay a recording through the detector and pose estimator")
+    parser.add_argument("recording")
+    parser.add_argument("--calibration", default = CalibrationConfigLoader.FILENAME)
+    parser.add_argument("--realtime", action = "store_true", help = "replay at the recorded frame rate instead of as fast as possible")
+    parser.add_argument("--save", help = "write per-frame results to a JSON file")
+    parser.add_argument("--compare", help = "diff the results against a JSON file written by --save")
+    args = parser.parse_args()
+
+    results = replay(args.recording, args.calibration, args.realtime)
+    if args.save != None:
+        with open(args.save, "w") as file:
+            json.dump(results, file)
+    if args.compare != None:
+        with open(args.compare) as file:
+            compare(results, json.load(file))
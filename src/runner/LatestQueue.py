@@ -0,0 +1,30 @@
+import threading
+from typing import Generic, Optional, TypeVar
+
+T = TypeVar("T")
+
+class LatestQueue(Generic[T]):
+    _condition: threading.Condition
+    _value: Optional[T] = None
+    _has_value: bool = False
+    dropped: int = 0
+
+    def __init__(self) -> None:
+        self._condition = threading.Condition()
+
+    def put(self, value: T) -> None:
+        with self._condition:
+            if self._has_value:
+                self.dropped += 1
+            self._value = value
+            self._has_value = True
+            self._condition.notify()
+
+    def get(self, timeout: Optional[float] = None) -> Optional[T]:
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._has_value, timeout):
+                return None
+            value = self._value
+            self._value = None
+            self._has_value = False
+            return value
@@ -0,0 +1,66 @@
+import os
+import sys
+import threading
+import traceback
+from typing import Callable
+
+from runner.LatestQueue import LatestQueue
+from runner.Runner import Frame, FrameResult, Runner
+
+class PipelinedRunner(Runner):
+    _frames_queue: LatestQueue[Frame]
+    _detections_queue: LatestQueue[FrameResult]
+    _results_queue: LatestQueue[FrameResult]
+
+    def run(self) -> None:
+        self._frames_queue = LatestQueue()
+        self._detections_queue = LatestQueue()
+        self._results_queue = LatestQueue()
+
+        threading.Thread(target = self._run_stage, args = (self._capture_loop,), daemon = True, name = "capture").start()
+        threading.Thread(target = self._run_stage, args = (self._detect_loop,), daemon = True, name = "detect").start()
+        threading.Thread(target = self._run_stage, args = (self._estimate_loop,), daemon = True, name = "estimate").start()
+        self._publish_loop()
+
+    def _run_stage(self, loop: Callable[[], None]) -> None:
+        # A stage that dies would leave the process running without publishing anything, so it takes the process down
+        # like an error in the sequential runner would, and the supervisor starts it again
+        try:
+            loop()
+        except BaseException:
+            traceback.print_exc()
+            print("Pipeline stage \"" + threading.current_thread().name + "\" failed, exiting")
+            sys.stdout.flush()
+            os._exit(1)
+
+    def _capture_loop(self) -> None:
+        while True:
+            frame = self._capture()
+            if frame != None:
+                self._frames_queue.put(frame)
+
+    def _detect_loop(self) -> None:
+        while True:
+            frame = self._frames_queue.get()
+            if frame != None:
+                self._detections_queue.put(self._detect(frame))
+
+    def _estimate_loop(self) -> None:
+        while True:
+            result = self._detections_queue.get()
+            if result != None:
+                self._results_queue.put(self._estimate(result))
+
+    def _publish_loop(self) -> None:
+        last_dropped = 0
+        while True:
+            result = self._results_queue.get()
+            if result == None:
+                continue
+
+            self._publish(result)
+            if self._frames == 0:
+                dropped = self._frames_queue.dropped + self._detections_queue.dropped + self._results_queue.dropped
+                if dropped != last_dropped:
+                    print("Dropped " + str(dropped - last_dropped) + " stale frames")
+                    last_dropped = dropped
@@ -0,0 +1,186 @@
+import cv2
+import cv2.typing
+from dataclasses import dataclass, field
+import datetime
+import math
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+from calibration.CalibrationSession import CalibrationSession
+from calibration.CalibrationSolver import CalibrationSolver
+from calibration.NTCalibrationController import NTCalibrationController
+from config.CalibrationConfig import CalibrationConfig, CalibrationConfigLoader, CalibrationConfigSet
+from config.ConnectionConfig import ConnectionConfig
+from config.NTConfig import NTConfig, NTConfigCache, NTConfigUpdater
+from pipeline.ApriltagDetector import ApriltagDetection, ApriltagDetector
+from pipeline.BinaryLog import BinaryLog
+from pipeline.Camera import Camera
+from pipeline.FrameRecorder import FrameRecorder
+from pipeline.LatencyMetrics import LatencyMetrics
+from pipeline.NTOutput import NTOutput
+from pipeline.PoseEstimator import PoseEstimation, PoseEstimator, TagObservations
+from pipeline.Profiler import Profiler
+from pipeline.StreamOutput import StreamOutput
+
+@dataclass
+class RunnerComponents:
+    connection_config: ConnectionConfig
+    calibration_config_loader: CalibrationConfigLoader
+    calibration_configs: CalibrationConfigSet
+    nt_config_updater: NTConfigUpdater
+    nt_config: NTConfig
+    nt_config_cache: NTConfigCache
+    calibration_controller: NTCalibrationController
+    camera: Camera
+    apriltag_detector: ApriltagDetector
+    pose_estimator: PoseEstimator
+    nt_output: NTOutput
+    stream_output: StreamOutput
+    metrics: LatencyMetrics
+    frame_recorder: FrameRecorder
+    binary_log: BinaryLog
+    profiler: Profiler
+
+@dataclass
+class Frame:
+    timestamp: float
+    captured: float
+    capture: cv2.typing.MatLike
+    nt_config: NTConfig
+    timings: Dict[str, float] = field(default_factory = dict)
+
+@dataclass
+class FrameResult:
+    frame: Frame
+    detections: Optional[List[ApriltagDetection]]
+    calibration_config: Optional[CalibrationConfig] = None
+    pose_estimation: Optional[PoseEstimation] = None
+    debug_pose_estimation: Optional[PoseEstimation] = None
+    ippe_errors: Tuple[float, float] = (math.nan, math.nan)
+    tag_observations: Optional[TagObservations] = None
+
+class Runner:
+    _components: RunnerComponents
+    _calibration_session: Optional[CalibrationSession] = None
+    _calibration_solver: Optional[CalibrationSolver] = None
+    _calibration_name = ""
+    _fps = 0
+    _frames = 0
+    _last_frame_print = 0.0
+
+    def __init__(self, components: RunnerComponents) -> None:
+        self._components = components
+
+    def run(self) -> None:
+        raise NotImplementedError()
+
+    def _capture(self) -> Optional[Frame]:
+        self._components.profiler.attach()
+        nt_config = self._components.nt_config_updater.update(self._components.nt_config)
+        self._components.nt_config = nt_config
+        self._components.nt_config_cache.update(nt_config)
+        self._components.profiler.update(nt_config)
+
+        timestamp = time.time()
+        start = time.perf_counter()
+        cam_success, capture = self._components.camera.read(nt_config)
+
+        if not cam_success:
+            print("Unable to capture frame")
+            time.sleep(0.5)
+            return None
+
+        frame = Frame(timestamp, time.perf_counter(), capture, nt_config)
+        frame.timings["capture"] = self._components.metrics.record("capture", start)
+        self._components.frame_recorder.update(frame.timestamp, frame.capture, frame.nt_config)
+        return frame
+
+    def _detect(self, frame: Frame) -> FrameResult:
+        self._components.profiler.attach()
+        self._poll_calibration()
+
+        if self._components.calibration_controller.is_calibrating():
+            if self._calibration_session == None:
+                self._calibration_session = CalibrationSession(12, 9, 0.030, 0.023, self._snapshot_directory())
+
+            self._calibration_session.intake_frame(frame.capture, self._components.calibration_controller.should_snap())
+            self._components.calibration_controller.update_views(self._calibration_session.views())
+            return FrameResult(frame, None)
+
+        if self._calibration_session != None:
+            solver = self._calibration_session.start_solve()
+            if solver != None:
+                if self._calibration_solver != None:
+                    self._calibration_solver.cancel()
+                self._calibration_solver = solver
+                self._calibration_name = frame.nt_config.calibration_name
+                print("Solving calibration from " + str(self._calibration_session.views()) + " views in the background")
+            self._calibration_session = None
+
+        calibration_config = self._components.calibration_configs.get(frame.nt_config.calibration_name, frame.capture.shape[1], frame.capture.shape[0])
+        if calibration_config != None and len(calibration_config.distortion_coefficients) > 0 and len(calibration_config.distortion_matrix) > 0:
+            start = time.perf_counter()
+            detections = self._components.apriltag_detector.search(frame.capture, frame.nt_config)
+            frame.timings["detect"] = self._components.metrics.record("detect", start)
+            return FrameResult(frame, detections, calibration_config)
+        else:
+            print("No calibration found")
+            time.sleep(0.5)
+            return FrameResult(frame, None)
+
+    def _snapshot_directory(self) -> str:
+        connection_config = self._components.connection_config
+        if connection_config.snapshot_directory == "":
+            return ""
+        return os.path.join(connection_config.snapshot_directory, "Blacklight-" + connection_config.name + "_" + datetime.datetime.now().strftime("%Y%m%d_%H%M%S"))
+
+    def _poll_calibration(self) -> None:
+        solver = self._calibration_solver
+        if solver == None:
+            return
+
+        solution = solver.poll()
+        self._components.calibration_controller.update_progress(solver.status, solver.progress, solver.elapsed())
+        if solution == None:
+            return
+
+        self._calibration_solver = None
+        self._components.calibration_controller.update_solution(solution)
+        if solution.is_valid():
+            # Frames keep using the previous set until the new one is written and loaded, then it is swapped in with one assignment
+            self._components.calibration_config_loader.write(solution.distortion_matrix, solution.distortion_coefficients, solution.width, solution.height, self._calibration_name, solution.rms, solution.view_errors) # type: ignore
+            self._components.calibration_configs = self._components.calibration_config_loader.load()
+            print("Finished calibration in %.1f s with RMS reprojection error %.3f px" % (solver.elapsed(), solution.rms))
+        else:
+            print("Calibration failed, keeping the current calibration: " + solution.error)
+
+    def _estimate(self, result: FrameResult) -> FrameResult:
+        self._components.profiler.attach()
+        if result.detections != None and result.calibration_config != None:
+            start = time.perf_counter()
+            result.pose_estimation = self._components.pose_estimator.get_estimated_pose(result.detections, result.calibration_config, result.frame.nt_config, result.frame.timestamp)
+            result.ippe_errors = self._components.pose_estimator.ippe_errors
+            result.tag_observations = self._components.pose_estimator.get_tag_observations(result.detections, result.calibration_config, result.frame.nt_config)
+            result.debug_pose_estimation = self._components.pose_estimator.get_estimated_debug_pose(result.tag_observations, result.frame.nt_config)
+            result.frame.timings["pose"] = self._components.metrics.record("pose", start)
+        return result
+
+    def _publish(self, result: FrameResult) -> None:
+        self._components.profiler.attach()
+        self._frames += 1
+        if result.frame.timestamp - self._last_frame_print > 1:
+            self._fps = self._frames
+            self._frames = 0
+            print("Pipeline running at " + str(self._fps) + " fps")
+            self._last_frame_print = result.frame.timestamp
+            self._components.nt_output.update_metrics(self._components.metrics.summary())
+
+        if result.detections != None:
+            start = time.perf_counter()
+            self._components.nt_output.update(result.frame.timestamp, self._fps, result.pose_estimation, result.debug_pose_estimation, result.tag_observations)
+            result.frame.timings["publish"] = self._components.metrics.record("publish", start)
+            latency = self._components.metrics.record("latency", result.frame.captured)
+            self._components.binary_log.update(result.frame.timestamp, latency, result.frame.timings, result.detections, result.ippe_errors, result.pose_estimation)
+
+        self._components.stream_output.update(result.frame.capture, result.detections)
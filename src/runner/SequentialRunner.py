@@ -0,0 +1,10 @@
+from runner.Runner import Runner
+
+class SequentialRunner(Runner):
+    def run(self) -> None:
+        while True:
+            frame = self._capture()
+            if frame == None:
+                continue
+
+            self._publish(self._estimate(self._detect(frame)))
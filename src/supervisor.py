@@ -0,0 +1,38 @@
+import multiprocessing
+import multiprocessing.process
+import time
+from typing import Dict
+
+from config.ConnectionConfig import ConnectionConfigLoader
+from main import run
+
+RESTART_DELAY = 2.0
+POLL_INTERVAL = 0.5
+
+if __name__ == "__main__":
+    connection_configs = ConnectionConfigLoader().load_all()
+    print("Loaded " + str(len(connection_configs)) + " camera configs")
+
+    context = multiprocessing.get_context("spawn")
+    workers: Dict[str, multiprocessing.process.BaseProcess] = {}
+    last_start: Dict[str, float] = {}
+
+    while True:
+        for connection_config in connection_configs:
+            worker = workers.get(connection_config.name)
+            if worker != None:
+                if worker.is_alive():
+                    continue
+                print("Camera worker \"" + connection_config.name + "\" exited with code " + str(worker.exitcode))
+                del workers[connection_config.name]
+
+            if time.time() - last_start.get(connection_config.name, 0.0) < RESTART_DELAY:
+                continue
+
+            worker = context.Process(target = run, args = (connection_config,), name = "Blacklight-" + connection_config.name, daemon = True)
+            worker.start()
+            workers[connection_config.name] = worker
+            last_start[connection_config.name] = time.time()
+            print("Started camera worker \"" + connection_config.name + "\" on stream port " + str(connection_config.video_port))
+
+        time.sleep(POLL_INTERVAL)
@@ -0,0 +1,150 @@
+import cv2
+import cv2.typing
+import math
+import numpy
+import numpy.typing
+from typing import Dict, List, Optional, Tuple
+from wpimath.geometry import Pose3d, Rotation3d, Transform3d, Translation3d
+
+from config.CalibrationConfig import CalibrationConfig
+from config.NTConfig import NTConfig
+from pipeline.ApriltagDetector import ApriltagDetection, ApriltagDetector
+import pipeline.PoseMath as PoseMath
+
+class SceneGenerator:
+    # Renders the tags of nt_config.tag_layout as a camera with calibration_config would see them. Tags are drawn into
+    # an ideal pinhole image and the lens distortion is applied afterwards with a remap, while the ground truth
+    # corners come straight from cv2.projectPoints.
+    BACKGROUND = 110
+    QUIET_ZONE = 1
+    MIN_CELL = 2
+    MAX_CELL = 64
+
+    _calibration_config: CalibrationConfig
+    _nt_config: NTConfig
+    _width: int
+    _height: int
+    _dictionary: cv2.aruco.Dictionary
+    _markers: Dict[Tuple[int, int], cv2.typing.MatLike]
+    _distortion_maps: Optional[Tuple[cv2.typing.MatLike, cv2.typing.MatLike]] = None
+
+    def __init__(self, calibration_config: CalibrationConfig, nt_config: NTConfig, width: int, height: int) -> None:
+        self._calibration_config = calibration_config
+        self._nt_config = nt_config
+        self._width = width
+        self._height = height
+        lookup = ApriltagDetector()._dictionary_lookup(nt_config.tag_family)
+        if lookup == None:
+            raise ValueError("Unknown tag family \"" + nt_config.tag_family + "\"")
+        self._dictionary = cv2.aruco.getPredefinedDictionary(lookup)
+        self._markers = {}
+
+        if numpy.any(numpy.reshape(calibration_config.distortion_coefficients, -1) != 0.0):
+            # For each output pixel, where it lands in the ideal image
+            grid = numpy.indices((height, width), numpy.float32)[::-1].reshape(2, -1).T.reshape(-1, 1, 2)
+            ideal = cv2.undistortPoints(grid, calibration_config.distortion_matrix, calibration_config.distortion_coefficients, P = calibration_config.distortion_matrix)
+            ideal = ideal.reshape(height, width, 2)
+            self._distortion_maps = (ideal[:, :, 0].copy(), ideal[:, :, 1].copy())
+
+    def camera_pose(self, robot_pose: Pose3d) -> Pose3d:
+        position = self._nt_config.camera_position
+        return robot_pose.transformBy(Transform3d(Translation3d(position[0], position[1], position[2]), Rotation3d(position[3], position[4], position[5])))
+
+    def robot_pose(self, camera_pose: Pose3d) -> Pose3d:
+        position = self._nt_config.camera_position
+        return camera_pose.transformBy(Transform3d(Translation3d(position[0], position[1], position[2]), Rotation3d(position[3], position[4], position[5])).inverse())
+
+    def sample_camera_pose(self, rng: numpy.random.Generator, min_distance: float, max_distance: float, max_angle: float) -> Pose3d:
+        # A camera in front of a random tag, up to max_angle off its axis, aimed near it with some roll
+        tag = self._nt_config.tag_layout.tags[int(rng.integers(len(self._nt_config.tag_layout.tags)))]
+        tag_pose = Pose3d(Translation3d(tag.x, tag.y, tag.z), Rotation3d(tag.rx, tag.ry, tag.rz))
+        distance = rng.uniform(min_distance, max_distance)
+        yaw, pitch = rng.uniform(-max_angle, max_angle), rng.uniform(-max_angle, max_angle) / 2.0
+        offset = Translation3d(distance * math.cos(pitch) * math.cos(yaw), distance * math.cos(pitch) * math.sin(yaw), distance * math.sin(pitch))
+        position = tag_pose.transformBy(Transform3d(offset, Rotation3d())).translation()
+        target = tag_pose.translation() + Translation3d(*rng.normal(0.0, 0.3, 3).tolist())
+        return self.look_at(position, target, rng.normal(0.0, 0.05))
+
+    def look_at(self, position: Translation3d, target: Translation3d, roll: float = 0.0) -> Pose3d:
+        direction = target - position
+        return Pose3d(position, Rotation3d(roll, -math.atan2(direction.Z(), math.hypot(direction.X(), direction.Y())), math.atan2(direction.Y(), direction.X())))
+
+    def project(self, camera_pose: Pose3d) -> List[ApriltagDetection]:
+        # Ground truth corners of the tags that face the camera and are at least partly inside the image
+        rvec, tvec = self._extrinsics(camera_pose)
+        rotation, _ = cv2.Rodrigues(rvec)
+        tags: List[ApriltagDetection] = []
+        for tag in self._nt_config.tag_layout.tags:
+            object_points = self._nt_config.tag_layout.object_points[self._nt_config.tag_layout.index[tag.id]]
+            if numpy.any((object_points @ rotation.T + tvec)[:, 2] < 0.05):
+                continue
+            image_points, _ = cv2.projectPoints(object_points, rvec, tvec, self._calibration_config.distortion_matrix, self._calibration_config.distortion_coefficients)
+            corners = image_points.reshape(4, 2)
+            # Corners run clockwise on screen for a tag seen from the front
+            if self._signed_area(corners) <= 0.0:
+                continue
+            if numpy.all((corners < 0) | (corners >= [self._width, self._height])):
+                continue
+            tags.append(ApriltagDetection(tag.id, corners.reshape(1, 4, 2).astype(numpy.float32)))
+        return tags
+
+    def render(self, camera_pose: Pose3d, blur: float = 0.0, noise: float = 0.0, seed: int = 0) -> Tuple[cv2.typing.MatLike, List[ApriltagDetection]]:
+        truth = self.project(camera_pose)
+        rvec, tvec = self._extrinsics(camera_pose)
+        image = numpy.full((self._height, self._width), float(self.BACKGROUND), numpy.float32)
+        for tag in truth:
+            object_points = self._nt_config.tag_layout.object_points[self._nt_config.tag_layout.index[tag.id]]
+            ideal, _ = cv2.projectPoints(object_points, rvec, tvec, self._calibration_config.distortion_matrix, None)
+            self._draw_tag(image, tag.id, ideal.reshape(4, 2).astype(numpy.float32))
+
+        if self._distortion_maps != None:
+            image = cv2.remap(image, self._distortion_maps[0], self._distortion_maps[1], cv2.INTER_LINEAR, borderValue = float(self.BACKGROUND))
+        if blur > 0.0:
+            image = cv2.GaussianBlur(image, (0, 0), blur)
+        if noise > 0.0:
+            image += numpy.random.default_rng(seed).normal(0.0, noise, image.shape).astype(numpy.float32)
+        return numpy.clip(image, 0, 255).astype(numpy.uint8), truth
+
+    def _extrinsics(self, camera_pose: Pose3d) -> Tuple[numpy.typing.NDArray[numpy.float64], numpy.typing.NDArray[numpy.float64]]:
+        field_to_camera = PoseMath.invert(PoseMath.from_pose(camera_pose))
+        rvec, _ = cv2.Rodrigues(PoseMath.OPENCV_TO_WPILIB.T @ field_to_camera[:3, :3] @ PoseMath.OPENCV_TO_WPILIB)
+        return rvec.reshape(3), PoseMath.OPENCV_TO_WPILIB.T @ field_to_camera[:3, 3]
+
+    def _signed_area(self, corners: numpy.typing.NDArray[numpy.float64]) -> float:
+        x, y = corners[:, 0], corners[:, 1]
+        return float(numpy.dot(x, numpy.roll(y, -1)) - numpy.dot(numpy.roll(x, -1), y)) / 2.0
+
+    def _marker(self, id: int, cell: int) -> cv2.typing.MatLike:
+        # Markers are cached at a few power of two sizes close to their size on screen, which limits aliasing
+        key = (id, cell)
+        if key not in self._markers:
+            cells = self._dictionary.markerSize + 2
+            marker = cv2.aruco.generateImageMarker(self._dictionary, id, cells * cell)
+            self._markers[key] = cv2.copyMakeBorder(marker, self.QUIET_ZONE * cell, self.QUIET_ZONE * cell, self.QUIET_ZONE * cell, self.QUIET_ZONE * cell, cv2.BORDER_CONSTANT, value = 255).astype(numpy.float32)
+        return self._markers[key]
+
+    def _draw_tag(self, image: numpy.typing.NDArray[numpy.float32], id: int, corners: numpy.typing.NDArray[numpy.float32]) -> None:
+        cells = self._dictionary.markerSize + 2
+        side = max(numpy.linalg.norm(corners - numpy.roll(corners, 1, axis = 0), axis = 1))
+        cell = int(min(max(2 ** math.ceil(math.log2(max(side / cells, 1.0))), self.MIN_CELL), self.MAX_CELL))
+        marker = self._marker(id, cell)
+
+        inner = self.QUIET_ZONE * cell
+        outer = inner + cells * cell
+        # Pixel centers are at integer coordinates, so the edges of the black square are half a pixel further out
+        source = numpy.array([[inner, inner], [outer, inner], [outer, outer], [inner, outer]], numpy.float32) - 0.5
+        homography = cv2.getPerspectiveTransform(source, corners)
+
+        size = float(marker.shape[0])
+        extent = cv2.perspectiveTransform(numpy.array([[[0.0, 0.0], [size, 0.0], [size, size], [0.0, size]]], numpy.float32), homography).reshape(4, 2)
+        x0, y0 = numpy.maximum(numpy.floor(extent.min(axis = 0)).astype(int) - 1, 0)
+        x1, y1 = numpy.minimum(numpy.ceil(extent.max(axis = 0)).astype(int) + 2, [self._width, self._height])
+        if x1 <= x0 or y1 <= y0:
+            return
+
+        # Only the tag's bounding box is warped, with a coverage mask so that its edges are antialiased
+        shift = numpy.array([[1.0, 0.0, -x0], [0.0, 1.0, -y0], [0.0, 0.0, 1.0]]) @ homography
+        warped = cv2.warpPerspective(marker, shift, (int(x1 - x0), int(y1 - y0)), flags = cv2.INTER_LINEAR)
+        mask = cv2.warpPerspective(numpy.ones_like(marker), shift, (int(x1 - x0), int(y1 - y0)), flags = cv2.INTER_LINEAR)
+        region = image[y0:y1, x0:x1]
+        region += (warped - region) * mask
@@ -0,0 +1,48 @@
+from dataclasses import replace
+import json
+import math
+import numpy
+from typing import Optional, Tuple
+from wpimath.geometry import Translation3d
+
+from config.CalibrationConfig import CalibrationConfig
+from config.NTConfig import NTConfig, NTConfigTagLayout, generate_default
+
+WALL_X = 8.0
+WALL_CENTER = (4.0, 0.9)
+CAMERA_OFFSET = 0.2
+DISTORTION = [-0.05, 0.02, 0.0, 0.0, 0.0]
+
+def make_scene(width: int, height: int, tag_count: int, tag_pixels: int) -> Optional[Tuple[CalibrationConfig, NTConfig, Translation3d, Translation3d]]:
+    # A grid of tags on a wall and a camera off to one side at the distance where a tag is tag_pixels wide, aimed at
+    # the grid's center. Returns None when the grid does not fit in the image at that size.
+    focal = width * 0.8
+    calibration_config = CalibrationConfig(numpy.array([[focal, 0.0, width / 2.0], [0.0, focal, height / 2.0], [0.0, 0.0, 1.0]]), numpy.array([DISTORTION]), width, height)
+    nt_config = generate_default()
+    columns = math.ceil(math.sqrt(tag_count * width / height))
+    rows = math.ceil(tag_count / columns)
+    spacing = nt_config.tag_size * 2.0
+    if (columns * 2 - 1) * tag_pixels > width * 0.8 or (rows * 2 - 1) * tag_pixels > height * 0.8:
+        return None
+
+    tags = [{
+        "id": i + 1,
+        "x": WALL_X,
+        "y": WALL_CENTER[0] + ((i % columns) - (columns - 1) / 2.0) * spacing,
+        "z": WALL_CENTER[1] + ((i // columns) - (rows - 1) / 2.0) * spacing,
+        "rx": 0.0,
+        "ry": 0.0,
+        "rz": math.pi
+    } for i in range(tag_count)]
+    nt_config = replace(
+        nt_config,
+        width = width,
+        height = height,
+        camera_position = [0.2, 0.1, 0.3, 0.0, -0.1, 0.05],
+        tag_layout = NTConfigTagLayout(json.dumps(tags), nt_config.tag_size),
+        debug_tag = 1
+    )
+
+    distance = focal * nt_config.tag_size / tag_pixels
+    position = Translation3d(WALL_X - distance, WALL_CENTER[0] + CAMERA_OFFSET * distance, WALL_CENTER[1])
+    return calibration_config, nt_config, position, Translation3d(WALL_X, WALL_CENTER[0], WALL_CENTER[1])
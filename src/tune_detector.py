@@ -0,0 +1,161 @@
+import argparse
+import cv2
+import cv2.typing
+from dataclasses import replace
+import numpy
+import os
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+from config.DetectorProfile import DetectorProfile, DetectorProfileLoader
+from config.NTConfig import NTConfig, generate_default
+from pipeline.ApriltagDetector import ApriltagDetector
+from pipeline.ReplayCamera import ReplayCamera
+
+IMAGE_EXTENSIONS = [".png", ".jpg", ".jpeg", ".bmp", ".pgm"]
+
+# Threshold windows (min, max, step) and minimum perimeter rates combined into variants of the base profile by --sweep
+WINDOW_SWEEP = [(3, 23, 10), (3, 13, 10), (5, 15, 10), (3, 33, 5), (7, 7, 10), (13, 13, 10), (23, 23, 10)]
+PERIMETER_SWEEP = [0.02, 0.03, 0.05, 0.08]
+
+def load_frames(directory: str, limit: int) -> List[cv2.typing.MatLike]:
+    frames: List[cv2.typing.MatLike] = []
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        extension = os.path.splitext(name)[1].lower()
+        if extension == ".blr":
+            camera = ReplayCamera(path)
+            while len(frames) < limit:
+                success, capture = camera.read(generate_default())
+                if not success:
+                    break
+                frames.append(capture)
+            camera.release()
+        elif extension in IMAGE_EXTENSIONS:
+            image = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+            if image is None:
+                print("Skipping unreadable image " + path)
+            else:
+                frames.append(image)
+
+        if len(frames) >= limit:
+            break
+    return frames
+
+def sweep_profiles(base: DetectorProfile) -> Dict[str, DetectorProfile]:
+    profiles: Dict[str, DetectorProfile] = {}
+    for window_min, window_max, window_step in WINDOW_SWEEP:
+        for perimeter in PERIMETER_SWEEP:
+            name = "w" + str(window_min) + "-" + str(window_max) + "s" + str(window_step) + "_p" + str(perimeter)
+            profiles[name] = replace(
+                base,
+                adaptive_thresh_win_size_min = window_min,
+                adaptive_thresh_win_size_max = window_max,
+                adaptive_thresh_win_size_step = window_step,
+                min_marker_perimeter_rate = perimeter
+            )
+    return profiles
+
+def run_profile(name: str, profile: DetectorProfile, frames: List[cv2.typing.MatLike], nt_config: NTConfig, repeat: int) -> Tuple[List[Set[int]], List[float]]:
+    # Each frame is searched in full (ROI tracking off) and timed by its fastest repeat, which filters out scheduler noise
+    apriltag_detector = ApriltagDetector({ name: profile })
+    nt_config = replace(nt_config, detector_profile = name, roi_tracking = False)
+    apriltag_detector.search(frames[0], nt_config)
+
+    ids: List[Set[int]] = []
+    times: List[float] = []
+    for frame in frames:
+        best = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            detections = apriltag_detector.search(frame, nt_config)
+            best = min(best, time.perf_counter() - start)
+        ids.append({ int(detection.id) for detection in detections })
+        times.append(best * 1000.0)
+    return ids, times
+
+def tune(frames: List[cv2.typing.MatLike], profiles: Dict[str, DetectorProfile], nt_config: NTConfig, repeat: int, reference: Optional[str], expected_ids: Optional[Set[int]], min_recall: float) -> Optional[str]:
+    results: Dict[str, Tuple[List[Set[int]], List[float]]] = {}
+    for name, profile in profiles.items():
+        results[name] = run_profile(name, profile, frames, nt_config, repeat)
+
+    # Without a reference profile, a tag counts as present in a frame if any profile found it there
+    if reference != None:
+        truth = [set(found) for found in results[reference][0]]
+    else:
+        truth = [set().union(*[results[name][0][i] for name in profiles]) for i in range(len(frames))]
+    if expected_ids != None:
+        truth = [found & expected_ids for found in truth]
+    total = sum(len(found) for found in truth)
+    print("Searched " + str(len(frames)) + " frames containing " + str(total) + " tags with " + str(len(profiles)) + " profiles")
+
+    rows: List[Tuple[float, float, float, int, str]] = []
+    for name, (ids, times) in results.items():
+        hits = sum(len(found & expected) for found, expected in zip(ids, truth))
+        if expected_ids != None:
+            false = sum(len(found - expected_ids) for found in ids)
+        else:
+            false = sum(len(found - expected) for found, expected in zip(ids, truth))
+        recall = hits / total if total > 0 else 1.0
+        rows.append((float(numpy.mean(times)), float(numpy.percentile(times, 95)), recall, false, name))
+    rows.sort()
+
+    print("profile                     windows  mean ms   p95 ms   recall    false")
+    for mean, p95, recall, false, name in rows:
+        print("%-27s %7d %8.3f %8.3f %8.3f %8d" % (name, profiles[name].window_sizes(), mean, p95, recall, false))
+
+    for mean, p95, recall, false, name in rows:
+        if recall >= min_recall:
+            print("Fastest profile with recall >= %.3f: %s (%.3f ms per frame)" % (min_recall, name, mean))
+            return name
+    print("No profile reached a recall of %.3f" % min_recall)
+    return None
+
+def parse_ids(source: str) -> Set[int]:
+    ids: Set[int] = set()
+    for part in source.split(","):
+        if "-" in part:
+            first, last = part.split("-")
+            ids.update(range(int(first), int(last) + 1))
+        else:
+            ids.add(int(part))
+    return ids
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Compare detector profiles on saved frames by time per frame and detection recall")
+    parser.add_argument("frames", help = "directory of images and/or .blr recordings")
+    parser.add_argument("--profiles", default = DetectorProfileLoader.FILENAME, help = "profile file to read and --save to")
+    parser.add_argument("--only", help = "comma separated profile names to compare instead of all of them")
+    parser.add_argument("--sweep", action = "store_true", help = "also compare threshold window and perimeter variants of the base profile")
+    parser.add_argument("--base", default = "default", help = "profile the --sweep variants start from")
+    parser.add_argument("--reference", help = "profile whose detections count as ground truth, instead of the union of all profiles")
+    parser.add_argument("--ids", help = "tag ids that may appear, such as 1-8, so that other ids count as false detections")
+    parser.add_argument("--tag-family", default = "16h5")
+    parser.add_argument("--decimation", type = int, default = 1)
+    parser.add_argument("--limit", type = int, default = 500, help = "maximum number of frames to load")
+    parser.add_argument("--repeat", type = int, default = 3, help = "searches per frame, the fastest is kept")
+    parser.add_argument("--min-recall", type = float, default = 1.0)
+    parser.add_argument("--save", metavar = "NAME", help = "write the fastest profile reaching --min-recall to the profile file under this name")
+    args = parser.parse_args()
+
+    loader = DetectorProfileLoader(args.profiles)
+    available = loader.load()
+    if args.only != None:
+        profiles = { name: available[name] for name in args.only.split(",") }
+    else:
+        profiles = dict(available)
+    if args.sweep:
+        profiles.update(sweep_profiles(available[args.base]))
+    if args.reference != None and args.reference not in profiles:
+        profiles[args.reference] = available[args.reference]
+
+    frames = load_frames(args.frames, args.limit)
+    if len(frames) == 0:
+        print("No frames found in " + args.frames)
+        exit(1)
+
+    nt_config = replace(generate_default(), tag_family = args.tag_family, decimation = args.decimation)
+    best = tune(frames, profiles, nt_config, args.repeat, args.reference, parse_ids(args.ids) if args.ids != None else None, args.min_recall)
+    if args.save != None and best != None:
+        loader.write(args.save, profiles[best])
+        print("Saved " + best + " as \"" + args.save + "\" in " + args.profiles)
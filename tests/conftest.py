@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The pipeline modules import each other from src, the same way main.py is run
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
@@ -0,0 +1,28 @@
+import os
+import time
+
+from config.ConnectionConfig import ConnectionConfigLoader
+from pipeline.BinaryLog import HEADER, BinaryLog
+
+def test_oldest_logs_are_removed_beyond_the_retention_cap(tmp_path):
+    log_directory = str(tmp_path)
+    old_names = ["Blacklight-test_20260101_00000" + str(i) + "_000000.bll" for i in range(4)]
+    for name in old_names:
+        with open(os.path.join(log_directory, name), "wb") as file:
+            file.write(bytes(1000))
+    other_camera = "Blacklight-other_20260101_000000_000000.bll"
+    with open(os.path.join(log_directory, other_camera), "wb") as file:
+        file.write(bytes(1000))
+
+    connection_config = ConnectionConfigLoader()._parse({ "name": "test", "nt_uri": "", "video_port": 0, "log_directory": log_directory, "log_retention_bytes": 1500 })
+    binary_log = BinaryLog(connection_config)
+    binary_log.update(0.0, 0.0, {}, [], (0.0, 0.0), None)
+
+    deadline = time.time() + 5.0
+    while time.time() < deadline and os.path.exists(os.path.join(log_directory, old_names[2])):
+        time.sleep(0.01)
+    names = sorted(os.listdir(log_directory))
+    assert old_names[:3] == [name for name in old_names if name not in names]
+    assert old_names[3] in names and other_camera in names
+    assert len([name for name in names if name.startswith("Blacklight-test_")]) == 2
+    assert os.path.getsize(os.path.join(log_directory, names[-1])) >= HEADER.size
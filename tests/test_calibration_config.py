@@ -0,0 +1,38 @@
+import cv2
+import numpy
+
+from config.CalibrationConfig import CalibrationConfigLoader
+
+CAMERA_MATRIX = numpy.array([[1100.0, 0.0, 800.0], [0.0, 1100.0, 600.0], [0.0, 0.0, 1.0]])
+DISTORTION = numpy.zeros((1, 5))
+
+def write_legacy(filename):
+    # The single calibration older versions saved, without the resolution it was taken at
+    file = cv2.FileStorage(filename, cv2.FILE_STORAGE_WRITE)
+    file.write("distortion_matrix", CAMERA_MATRIX)
+    file.write("distortion_coefficients", DISTORTION)
+    file.release()
+
+def test_calibration_is_refused_for_a_different_aspect_ratio(tmp_path):
+    loader = CalibrationConfigLoader(str(tmp_path / "calibration_config.json"))
+    loader.write(CAMERA_MATRIX, DISTORTION, 1600, 1200)
+    calibrations = loader.load()
+
+    assert calibrations.get("", 1280, 720) == None
+    scaled = calibrations.get("", 800, 600)
+    assert scaled != None
+    assert scaled.distortion_matrix[0, 0] == 550.0
+
+def test_calibration_without_a_resolution_is_not_used(tmp_path):
+    filename = str(tmp_path / "calibration_config.json")
+    write_legacy(filename)
+    loader = CalibrationConfigLoader(filename)
+    assert loader.load().get("", 1600, 1200) == None
+    assert loader.load().get("default", 1280, 720) == None
+
+    # Saving another calibration keeps the old one, which still only applies once its resolution is known
+    loader.write(CAMERA_MATRIX * [[0.8], [0.8], [1.0]], DISTORTION, 1280, 720)
+    calibrations = loader.load()
+    assert calibrations.get("", 1280, 720) is calibrations.calibrations["mode_1280x720"]
+    assert calibrations.get("", 1600, 1200) == None
+    assert calibrations.get("default", 1600, 1200) == None
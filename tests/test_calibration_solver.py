@@ -0,0 +1,101 @@
+import cv2
+import multiprocessing
+import numpy
+import os
+import time
+
+from calibration.CalibrationSession import CalibrationSession
+from config.CalibrationConfig import CalibrationConfigLoader
+from config.ConnectionConfig import ConnectionConfigLoader
+from config.NTConfig import generate_default
+from pipeline.Profiler import Profiler
+from runner.Runner import Frame, Runner, RunnerComponents
+
+WIDTH = 1600
+HEIGHT = 1200
+SQUARES = (12, 9)
+SQUARE_LENGTH = 0.030
+
+def board_views(count: int):
+    # The board as a camera with a known focal length sees it from random poses
+    board = cv2.aruco.CharucoBoard(SQUARES, SQUARE_LENGTH, 0.023, cv2.aruco.getPredefinedDictionary(CalibrationSession.DICTIONARY))
+    image = board.generateImage((1200, 900), marginSize = 40)
+    camera = numpy.array([[1100.0, 0.0, WIDTH / 2.0], [0.0, 1100.0, HEIGHT / 2.0], [0.0, 0.0, 1.0]])
+    width, height = SQUARE_LENGTH * SQUARES[0], SQUARE_LENGTH * SQUARES[1]
+    scale = min((1200 - 80) / SQUARES[0], (900 - 80) / SQUARES[1])
+    x, y = (1200 - scale * SQUARES[0]) / 2.0, (900 - scale * SQUARES[1]) / 2.0
+    source = numpy.float32([[x, y], [x + scale * SQUARES[0], y], [x + scale * SQUARES[0], y + scale * SQUARES[1]], [x, y + scale * SQUARES[1]]])
+    rng = numpy.random.default_rng(0)
+    views = []
+    for _ in range(count):
+        rvec = rng.uniform(-0.5, 0.5, 3)
+        tvec = numpy.array([-width / 2.0 + rng.uniform(-0.05, 0.05), -height / 2.0 + rng.uniform(-0.05, 0.05), rng.uniform(0.45, 0.7)])
+        corners, _ = cv2.projectPoints(numpy.float32([[0, 0, 0], [width, 0, 0], [width, height, 0], [0, height, 0]]), rvec, tvec, camera, None)
+        homography = cv2.getPerspectiveTransform(source, corners.reshape(4, 2).astype(numpy.float32))
+        views.append(cv2.warpPerspective(image, homography, (WIDTH, HEIGHT), borderValue = 255))
+    return views
+
+class FakeCalibrationController:
+    calibrating = True
+
+    def is_calibrating(self):
+        return self.calibrating
+
+    def should_snap(self):
+        return True
+
+    def update_views(self, views):
+        pass
+
+    def update_progress(self, status, progress, elapsed):
+        pass
+
+    def update_solution(self, solution):
+        self.solution = solution
+
+def end_calibration(calibration_file, results):
+    # Runs in a daemon process, like the camera workers the supervisor starts
+    connection_config = ConnectionConfigLoader()._parse({ "name": "test", "nt_uri": "", "video_port": 0, "snapshot_directory": "", "calibration_file": calibration_file })
+    loader = CalibrationConfigLoader(calibration_file)
+    controller = FakeCalibrationController()
+    components = RunnerComponents(
+        connection_config = connection_config,
+        calibration_config_loader = loader,
+        calibration_configs = loader.load(),
+        nt_config_updater = None,
+        nt_config = generate_default(),
+        nt_config_cache = None,
+        calibration_controller = controller,
+        camera = None,
+        apriltag_detector = None,
+        pose_estimator = None,
+        nt_output = None,
+        stream_output = None,
+        metrics = None,
+        frame_recorder = None,
+        binary_log = None,
+        profiler = Profiler(connection_config)
+    )
+    runner = Runner(components)
+    nt_config = generate_default()
+    for view in board_views(10):
+        runner._detect(Frame(time.time(), time.perf_counter(), view, nt_config))
+
+    controller.calibrating = False
+    runner._detect(Frame(time.time(), time.perf_counter(), board_views(1)[0], nt_config))
+    deadline = time.time() + 60.0
+    while runner._calibration_solver != None and time.time() < deadline:
+        runner._poll_calibration()
+        time.sleep(0.05)
+    results.put((controller.solution.error, len(components.calibration_configs)))
+
+def test_end_calibration_in_daemon_process(tmp_path):
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target = end_calibration, args = (os.path.join(str(tmp_path), "calibration.json"), results), daemon = True)
+    process.start()
+    process.join(120.0)
+    assert process.exitcode == 0
+    error, calibrations = results.get(timeout = 1.0)
+    assert error == ""
+    assert calibrations == 1
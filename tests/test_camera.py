@@ -0,0 +1,28 @@
+from dataclasses import replace
+import re
+
+import cv2
+import numpy
+import pytest
+
+from config.NTConfig import generate_default
+from pipeline.Camera import Camera
+
+HAS_GSTREAMER = re.search(r"GStreamer:\s*YES", cv2.getBuildInformation()) != None
+
+@pytest.mark.skipif(not HAS_GSTREAMER, reason = "OpenCV is built without GStreamer")
+@pytest.mark.parametrize("pixel_format", ["GRAY8", "YUYV", "NV12", "MJPEG"])
+def test_test_source_gives_gray_frames(pixel_format):
+    # The same pipelines as a camera, with videotestsrc producing each format in place of v4l2src
+    nt_config = replace(generate_default(), device_path = Camera.TEST_SOURCE, width = 320, height = 240, pixel_format = pixel_format)
+    camera = Camera()
+    try:
+        for _ in range(3):
+            success, frame = camera.read(nt_config)
+            if success:
+                break
+        assert success
+        assert frame.shape == (240, 320)
+        assert frame.dtype == numpy.uint8
+    finally:
+        camera.release()
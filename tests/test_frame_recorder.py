@@ -0,0 +1,43 @@
+from dataclasses import replace
+import os
+import threading
+import time
+
+import cv2
+import numpy
+
+from config.ConnectionConfig import ConnectionConfigLoader
+from config.NTConfig import generate_default
+from pipeline.FrameRecorder import FrameRecorder
+from pipeline.ReplayCamera import ReplayCamera
+
+def test_recording_keeps_the_frame_as_captured(tmp_path, monkeypatch):
+    # The encoder waits until the frame loop has drawn onto the capture, as calibration mode does
+    drawn = threading.Event()
+    encode = cv2.imencode
+    def delayed_encode(*args, **kwargs):
+        drawn.wait(5.0)
+        return encode(*args, **kwargs)
+    monkeypatch.setattr(cv2, "imencode", delayed_encode)
+
+    connection_config = ConnectionConfigLoader()._parse({ "name": "test", "nt_uri": "", "video_port": 0, "recording_directory": str(tmp_path) })
+    frame_recorder = FrameRecorder(connection_config)
+    nt_config = replace(generate_default(), recording = True)
+    capture = numpy.random.default_rng(0).integers(0, 256, (120, 160), dtype = numpy.uint8)
+    original = capture.copy()
+    frame_recorder.update(1.0, capture, nt_config)
+    cv2.rectangle(capture, (10, 10), (100, 100), 255, -1)
+    drawn.set()
+    frame_recorder.update(2.0, capture, replace(nt_config, recording = False))
+
+    # The chunk may still be being written, so it is read until it is whole
+    deadline = time.time() + 5.0
+    success = False
+    while not success and time.time() < deadline:
+        time.sleep(0.01)
+        for name in os.listdir(str(tmp_path)):
+            camera = ReplayCamera(os.path.join(str(tmp_path), name))
+            success, frame = camera.read(generate_default())
+            camera.release()
+    assert success
+    assert numpy.array_equal(frame, original)
@@ -0,0 +1,61 @@
+import shutil
+import subprocess
+import sys
+import threading
+import time
+
+import numpy
+import pytest
+
+from pipeline.H264Stream import H264Stream
+
+# Stands in for gst-launch: one packet marked with the frame width for every frame, and a last packet once its input
+# closes, like the frames x264enc still holds when the stream ends
+FAKE_ENCODER = """
+import sys, time
+width, height = int(sys.argv[1]), int(sys.argv[2])
+while len(sys.stdin.buffer.read(width * height * 3)) == width * height * 3:
+    sys.stdout.buffer.write(bytes([width]) * 188)
+    sys.stdout.buffer.flush()
+time.sleep(0.2)
+sys.stdout.buffer.write(b"T" * 188)
+"""
+
+def run_stream(frames, seconds):
+    chunks = []
+    lock = threading.Lock()
+    def on_data(data):
+        with lock:
+            chunks.append(data)
+    stream = H264Stream(1000, 30, on_data)
+    stream.start()
+    for frame in frames:
+        stream.update(frame)
+        time.sleep(seconds)
+    stream.stop()
+    time.sleep(0.5)
+    with lock:
+        return list(chunks)
+
+def test_output_of_a_replaced_encoder_is_dropped(monkeypatch):
+    monkeypatch.setattr(H264Stream, "_command", lambda self, width, height: [sys.executable, "-c", FAKE_ENCODER, str(width), str(height)])
+    chunks = run_stream([numpy.zeros((24, 32, 3), numpy.uint8), numpy.zeros((48, 64, 3), numpy.uint8)], 0.5)
+
+    assert None not in chunks
+    packets = [chunk[i:i + 188] for chunk in chunks for i in range(0, len(chunk), 188)]
+    markers = [packet[0] for packet in packets]
+    assert 32 in markers and 64 in markers
+    assert ord("T") not in markers
+    assert markers.index(64) > len(markers) - 1 - markers[::-1].index(32)
+
+@pytest.mark.skipif(shutil.which("gst-launch-1.0") == None, reason = "GStreamer is not installed")
+def test_encoder_pipeline_produces_a_transport_stream():
+    if subprocess.run(["gst-inspect-1.0", "x264enc"], capture_output = True).returncode != 0:
+        pytest.skip("x264enc is not installed")
+    frame = numpy.random.default_rng(0).integers(0, 256, (240, 320, 3), dtype = numpy.uint8)
+    chunks = run_stream([frame], 2.0)
+
+    assert None not in chunks
+    data = b"".join(chunks)
+    assert len(data) > 0 and len(data) % 188 == 0
+    assert all(data[i] == 0x47 for i in range(0, len(data), 188))
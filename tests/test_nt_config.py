@@ -0,0 +1,17 @@
+from dataclasses import replace
+
+from config.NTConfig import generate_default
+
+def test_same_snapshot_has_no_changes():
+    nt_config = generate_default()
+    assert nt_config.changed_fields(nt_config) == set()
+
+def test_replaced_config_reports_changes():
+    nt_config = generate_default()
+    changed = replace(nt_config, detector_profile = "fast", decimation = 2)
+    assert changed.version == nt_config.version
+    assert changed.changed_fields(nt_config) == { "detector_profile", "decimation" }
+
+def test_equal_copy_has_no_changes():
+    nt_config = generate_default()
+    assert replace(nt_config).changed_fields(nt_config) == set()
@@ -0,0 +1,109 @@
+import cv2
+from dataclasses import replace
+import math
+import numpy
+import pytest
+from wpimath.geometry import Translation3d
+
+from pipeline.ApriltagDetector import ApriltagDetection, ApriltagDetector
+from pipeline.PoseEstimator import PoseEstimator
+from synthetic.SceneGenerator import SceneGenerator
+from synthetic.WallScene import make_scene
+
+def render_coplanar_tags():
+    # Four tags on one wall, found by the real detector
+    calibration_config, nt_config, position, target = make_scene(1280, 720, 4, 64)
+    generator = SceneGenerator(calibration_config, nt_config, 1280, 720)
+    camera_pose = generator.look_at(position, target)
+    capture, _ = generator.render(camera_pose, 0.5, 2.0)
+    detections = ApriltagDetector().search(capture, nt_config)
+    assert len(detections) == 4
+    return detections, calibration_config, nt_config, generator.robot_pose(camera_pose)
+
+def check_pose(detections, calibration_config, nt_config, truth):
+    pose_estimation = PoseEstimator().get_estimated_pose(detections, calibration_config, nt_config, 0.0)
+    assert pose_estimation != None
+    assert pose_estimation.pose.translation().distance(truth.translation()) < 0.1
+
+def test_coplanar_tags_give_a_pose():
+    check_pose(*render_coplanar_tags())
+
+def test_coplanar_tags_with_equal_sqpnp_solutions(monkeypatch):
+    # Some OpenCV builds return several SQPNP solutions with the same error for coplanar points, which must not be
+    # treated as an ambiguous single tag
+    detections, calibration_config, nt_config, truth = render_coplanar_tags()
+    solve = cv2.solvePnPGeneric
+    def repeated_solutions(*args, **kwargs):
+        count, rvecs, tvecs, errors = solve(*args, **kwargs)
+        if kwargs.get("flags") == cv2.SOLVEPNP_SQPNP:
+            return 3, tuple(rvecs) * 3, tuple(tvecs) * 3, errors.repeat(3, axis = 0)
+        return count, rvecs, tvecs, errors
+    monkeypatch.setattr(cv2, "solvePnPGeneric", repeated_solutions)
+    check_pose(detections, calibration_config, nt_config, truth)
+
+def count_sqpnp_solves(monkeypatch):
+    solves = [0]
+    solve = cv2.solvePnPGeneric
+    def counted(*args, **kwargs):
+        if kwargs.get("flags") == cv2.SOLVEPNP_SQPNP:
+            solves[0] += 1
+        return solve(*args, **kwargs)
+    monkeypatch.setattr(cv2, "solvePnPGeneric", counted)
+    return solves
+
+def test_temporal_pose_skips_the_solve_while_the_prediction_reprojects(monkeypatch):
+    calibration_config, nt_config, position, target = make_scene(1280, 720, 4, 64)
+    nt_config = replace(nt_config, temporal_pose = True)
+    generator = SceneGenerator(calibration_config, nt_config, 1280, 720)
+    solves = count_sqpnp_solves(monkeypatch)
+    pose_estimator = PoseEstimator()
+
+    camera_pose = generator.look_at(position, target)
+    for frame in range(5):
+        pose_estimation = pose_estimator.get_estimated_pose(generator.project(camera_pose), calibration_config, nt_config, frame * 0.02)
+        assert pose_estimation != None
+        assert pose_estimation.pose.translation().distance(generator.robot_pose(camera_pose).translation()) < 0.01
+    assert solves[0] == 1
+
+    # A jump the prediction cannot explain is solved again
+    camera_pose = generator.look_at(position + Translation3d(0.0, 0.3, 0.0), target)
+    pose_estimation = pose_estimator.get_estimated_pose(generator.project(camera_pose), calibration_config, nt_config, 0.1)
+    assert pose_estimation != None
+    assert pose_estimation.pose.translation().distance(generator.robot_pose(camera_pose).translation()) < 0.01
+    assert solves[0] == 2
+
+def test_temporal_pose_leaves_single_tags_unchanged():
+    calibration_config, nt_config, position, target = make_scene(1280, 720, 1, 64)
+    generator = SceneGenerator(calibration_config, nt_config, 1280, 720)
+    detections = generator.project(generator.look_at(position, target))
+    expected = PoseEstimator().get_estimated_pose(detections, calibration_config, nt_config, 0.0)
+    pose_estimator = PoseEstimator()
+    for frame in range(3):
+        pose_estimation = pose_estimator.get_estimated_pose(detections, calibration_config, replace(nt_config, temporal_pose = True), frame * 0.02)
+        assert expected != None and pose_estimation != None
+        assert pose_estimation.pose == expected.pose
+        assert pose_estimation.distance == expected.distance
+        assert not math.isnan(pose_estimator.ippe_errors[0])
+
+def test_tag_observations_reuse_the_single_tag_solve(monkeypatch):
+    calibration_config, nt_config, position, target = make_scene(1280, 720, 1, 64)
+    generator = SceneGenerator(calibration_config, nt_config, 1280, 720)
+    detections = generator.project(generator.look_at(position, target))
+    unknown = ApriltagDetection(99, detections[0].corners + 200.0)
+    solves = [0]
+    solve = cv2.solvePnPGeneric
+    def counted(*args, **kwargs):
+        solves[0] += 1
+        return solve(*args, **kwargs)
+    monkeypatch.setattr(cv2, "solvePnPGeneric", counted)
+
+    pose_estimator = PoseEstimator()
+    assert pose_estimator.get_estimated_pose(detections + [unknown], calibration_config, nt_config, 0.0) != None
+    observations = pose_estimator.get_tag_observations(detections + [unknown], calibration_config, nt_config)
+    assert solves[0] == 1
+    assert numpy.all(numpy.isfinite(observations.tvecs[0])) and numpy.all(numpy.isnan(observations.tvecs[1]))
+
+    # The debug tag is solved even when it is not in the layout
+    observations = pose_estimator.get_tag_observations(detections + [unknown], calibration_config, replace(nt_config, debug_tag = 99))
+    assert solves[0] == 2
+    assert numpy.all(numpy.isfinite(observations.tvecs[1]))
@@ -0,0 +1,44 @@
+import socket
+import time
+import urllib.error
+import urllib.request
+
+from config.ConnectionConfig import ConnectionConfigLoader
+from pipeline.LatencyMetrics import LatencyMetrics
+from pipeline.Profiler import Profiler
+from pipeline.StreamOutput import StreamOutput
+
+def free_port() -> int:
+    with socket.socket() as listener:
+        listener.bind(("127.0.0.1", 0))
+        return listener.getsockname()[1]
+
+def get(port: int, path: str) -> int:
+    try:
+        with urllib.request.urlopen("http://127.0.0.1:" + str(port) + path, timeout = 5.0) as response:
+            return response.status
+    except urllib.error.HTTPError as error:
+        return error.code
+
+def test_full_stream_slots_leave_other_routes_reachable(tmp_path):
+    port = free_port()
+    connection_config = ConnectionConfigLoader()._parse({ "name": "test", "nt_uri": "", "video_port": port, "max_stream_clients": 1, "profile_directory": str(tmp_path) })
+    stream_output = StreamOutput(LatencyMetrics(), Profiler(connection_config))
+    stream_output.start_server(connection_config)
+    for _ in range(50):
+        try:
+            socket.create_connection(("127.0.0.1", port), 0.1).close()
+            break
+        except OSError:
+            time.sleep(0.1)
+
+    # The only stream slot is held by a viewer waiting for frames
+    viewer = socket.create_connection(("127.0.0.1", port))
+    viewer.sendall(b"GET /stream.mjpg HTTP/1.0\r\n\r\n")
+    time.sleep(0.5)
+    try:
+        assert get(port, "/stream.mjpg") == 503
+        assert get(port, "/metrics") == 200
+        assert get(port, "/profiles") == 200
+    finally:
+        viewer.close()